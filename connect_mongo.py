@@ -1,7 +1,9 @@
 import os
+from threading import Lock
+
 from dotenv import load_dotenv
 
-from mongoengine import connect
+from mongoengine import connect, disconnect
 
 load_dotenv()
 
@@ -9,5 +11,41 @@ mongo_user = os.getenv("MONGO_USER")
 mongodb_pass = os.getenv("MONGO_PASSWORD")
 domain = os.getenv("MONGO_DOMAIN")
 db_name = os.getenv("MONGO_DB_NAME")
+pool_size = int(os.getenv("MONGO_POOL_SIZE", 10))
+
+_connection = None
+_lock = Lock()
+
+
+def get_connection(**kwargs):
+    """
+    The get_connection function returns the shared MongoDB client, connecting on first use.
+    The client keeps its own connection pool, so it is created once per process
+    instead of connecting as a side effect of importing this module.
+
+    :param **kwargs: Extra arguments for mongoengine.connect, e.g. host or mongo_client_class for mongomock
+    :return: The pymongo client
+    """
+    global _connection
+    if _connection is None:
+        with _lock:
+            if _connection is None:
+                kwargs.setdefault(
+                    "host", f"mongodb+srv://{mongo_user}:{mongodb_pass}@{domain}/?retryWrites=true&w=majority&appName=Insight"
+                )
+                kwargs.setdefault("maxPoolSize", pool_size)
+                _connection = connect(**kwargs)
+    return _connection
+
+
+def close_connection():
+    """
+    The close_connection function closes the shared client so the next get_connection call reconnects.
 
-connect(host=f"mongodb+srv://{mongo_user}:{mongodb_pass}@{domain}/?retryWrites=true&w=majority&appName=Insight")
\ No newline at end of file
+    :return: None
+    """
+    global _connection
+    with _lock:
+        if _connection is not None:
+            disconnect()
+            _connection = None
@@ -0,0 +1,252 @@
+import json
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Model, Prefetch, QuerySet
+from django.conf import settings
+from django.http import HttpRequest, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.cache import cache_control
+
+from .autocomplete import autocomplete
+from .conditional import versioned_page
+from .models import Author, Quote, Tag
+from .pagination import KeysetPaginator
+from .suggestions import suggestions as suggestion_index
+from .tags import tag_registry
+from .versions import AUTHOR_NAMES, CATALOG, TAG_NAMES, TOP_TAGS
+
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+EXPORT_CHUNK_SIZE = 1000
+
+QUOTE_FIELDS: Dict[str, Callable[[Quote], Any]] = {
+    "id": lambda quote: quote.pk,
+    "quote": lambda quote: quote.quote,
+    "author": lambda quote: quote.author.fullname,
+    "tags": lambda quote: [tag.name for tag in quote.tags.all()],
+}
+AUTHOR_FIELDS: Dict[str, Callable[[Author], Any]] = {
+    "id": lambda author: author.pk,
+    "fullname": lambda author: author.fullname,
+    "born_date": lambda author: author.born_date,
+    "born_location": lambda author: author.born_location,
+    "description": lambda author: author.description,
+}
+TAG_FIELDS: Dict[str, Callable[[Tag], Any]] = {
+    "id": lambda tag: tag.pk,
+    "name": lambda tag: tag.name,
+    "quote_count": lambda tag: tag.quote_count,
+}
+
+
+class ApiError(ValueError):
+    pass
+
+
+def quote_queryset(fields: List[str]) -> QuerySet:
+    """
+    The quote_queryset function returns the quotes with only the relations the requested fields need:
+    the author is joined and the tags are prefetched (one query per page) only when they are serialized.
+
+    :param fields: The requested quote fields
+    :return: The queryset
+    """
+    quotes = Quote.objects.all()
+    if "author" in fields:
+        quotes = quotes.select_related("author")
+    if "tags" in fields:
+        quotes = quotes.prefetch_related(Prefetch("tags", queryset=Tag.objects.only("name").order_by("name")))
+    return quotes
+
+
+def requested_fields(request: HttpRequest, available: Dict[str, Callable]) -> List[str]:
+    """
+    The requested_fields function reads the sparse field selection (?fields=id,quote) of a request.
+
+    :param request: The API request
+    :param available: The serializers of the resource, by field name
+    :return: The selected field names, all of them when none are requested
+    """
+    fields = [field for field in request.GET.get("fields", "").split(",") if field]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}")
+    return fields or list(available)
+
+
+def page_size(request: HttpRequest) -> int:
+    try:
+        limit = int(request.GET.get("limit", API_PAGE_SIZE))
+    except ValueError:
+        raise ApiError("limit must be an integer")
+    return min(max(limit, 1), API_MAX_PAGE_SIZE)
+
+
+def serialize(obj: Model, fields: List[str], serializers: Dict[str, Callable]) -> Dict[str, Any]:
+    return {field: serializers[field](obj) for field in fields}
+
+
+def page_url(request: HttpRequest, cursor: Optional[str]) -> Optional[str]:
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params["cursor"] = cursor
+    return f"{request.path}?{params.urlencode()}"
+
+
+def paginated_response(
+    request: HttpRequest, queryset_func: Callable[[List[str]], QuerySet], serializers: Dict[str, Callable]
+) -> JsonResponse:
+    """
+    The paginated_response function returns one page of a resource as JSON.
+    Pages are read with the KeysetPaginator, so every page is a primary key range scan and
+    the "next" and "previous" links carry opaque cursors.
+
+    :param request: The API request
+    :param queryset_func: Takes the requested fields and returns the filtered queryset
+    :param serializers: The serializers of the resource, by field name
+    :return: A JsonResponse with the results and the links to the neighbouring pages
+    """
+    try:
+        fields = requested_fields(request, serializers)
+        paginator = KeysetPaginator(queryset_func(fields), per_page=page_size(request))
+    except ApiError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    page = paginator.get_page(request.GET.get("cursor"))
+    return JsonResponse(
+        {
+            "results": [serialize(obj, fields, serializers) for obj in page],
+            "next": page_url(request, page.next_cursor),
+            "previous": page_url(request, page.previous_cursor),
+        }
+    )
+
+
+@versioned_page(lambda: [CATALOG])
+def quotes(request: HttpRequest) -> JsonResponse:
+    """
+    The quotes function lists the quotes (GET /api/quotes/).
+    They can be filtered by tag name (?tag=) and author full name (?author=).
+
+    :param request: The API request
+    :return: A page of quotes
+    """
+
+    def queryset(fields: List[str]) -> QuerySet:
+        quotes = quote_queryset(fields)
+        if request.GET.get("tag"):
+            tag = tag_registry.lookup(request.GET["tag"])
+            if tag is None:
+                return quotes.none()
+            quotes = quotes.filter(pk__in=Quote.tags.through.objects.filter(tag_id=tag.id).values("quote_id"))
+        if request.GET.get("author"):
+            quotes = quotes.filter(author__fullname=request.GET["author"])
+        return quotes
+
+    return paginated_response(request, queryset, QUOTE_FIELDS)
+
+
+@versioned_page(lambda: [CATALOG])
+def authors(request: HttpRequest) -> JsonResponse:
+    return paginated_response(request, lambda fields: Author.objects.all(), AUTHOR_FIELDS)
+
+
+@versioned_page(lambda: [CATALOG, TOP_TAGS])
+def tags(request: HttpRequest) -> JsonResponse:
+    return paginated_response(request, lambda fields: Tag.objects.all(), TAG_FIELDS)
+
+
+def choices_response(request: HttpRequest, kind: str) -> JsonResponse:
+    """
+    The choices_response function returns a page of the choices of an autocomplete picker as JSON.
+
+    :param request: The API request, with the typed text in ?q=
+    :param kind: "authors" or "tags", see quoteapp.autocomplete
+    :return: A JsonResponse with the results and the link to the next page
+    """
+    page = autocomplete(kind, request.GET.get("q", ""), request.GET.get("cursor"))
+    return JsonResponse({"results": page["results"], "next": page_url(request, page["next"])})
+
+
+@versioned_page(lambda: [AUTHOR_NAMES])
+def author_choices(request: HttpRequest) -> JsonResponse:
+    return choices_response(request, "authors")
+
+
+@versioned_page(lambda: [TAG_NAMES])
+def tag_choices(request: HttpRequest) -> JsonResponse:
+    return choices_response(request, "tags")
+
+
+@cache_control(public=True, max_age=60)
+def suggestions(request: HttpRequest) -> JsonResponse:
+    """
+    The suggestions function returns the tags and authors suggested for the text typed in the navbar search box.
+    It reads the in-process index of quoteapp.suggestions only, no query and no session, so it can be called on
+    every keystroke; an empty list is returned until the build_suggestions command was run.
+
+    :param request: The API request, with the typed text in ?q=
+    :return: A JsonResponse with the suggestions, most popular first, as {"kind", "text", "url"} dicts
+    """
+    results = []
+    for suggestion in suggestion_index.suggest(request.GET.get("q", "")[:100], settings.SUGGESTIONS_LIMIT):
+        if suggestion.kind == "tag":
+            url = reverse("quoteapp:look_for_tag", args=[suggestion.name])
+        else:
+            url = reverse("quoteapp:get_info_author", args=[suggestion.name])
+        results.append({"kind": suggestion.kind, "text": suggestion.name, "url": url})
+    return JsonResponse({"results": results})
+
+
+def iter_chunked(queryset: QuerySet, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[Model]:
+    """
+    The iter_chunked function iterates over a whole table in primary key order, one chunk at a time.
+    Each chunk is a separate keyset query, so only chunk_size rows (and their prefetched relations)
+    are held in memory and no long-running server-side cursor is kept open.
+
+    :param queryset: The queryset to iterate over
+    :param chunk_size: The number of rows per query
+    :return: An iterator over the rows
+    """
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk.order_by("pk")[:chunk_size])
+        if not rows:
+            return
+        yield from rows
+        last_pk = rows[-1].pk
+
+
+def iter_catalog_lines() -> Iterator[str]:
+    """
+    The iter_catalog_lines function yields the whole catalog as NDJSON: every author, tag and quote
+    as one JSON object per line, with a "type" member telling them apart.
+
+    :return: An iterator over the lines
+    """
+    resources = [
+        ("author", Author.objects.all(), AUTHOR_FIELDS),
+        ("tag", Tag.objects.all(), TAG_FIELDS),
+        ("quote", quote_queryset(list(QUOTE_FIELDS)), QUOTE_FIELDS),
+    ]
+    for kind, queryset, serializers in resources:
+        for obj in iter_chunked(queryset):
+            record = {"type": kind, **serialize(obj, list(serializers), serializers)}
+            yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+@versioned_page(lambda: [CATALOG, TOP_TAGS])
+def export(request: HttpRequest) -> StreamingHttpResponse:
+    """
+    The export function streams the whole catalog as NDJSON (GET /api/export.ndjson).
+    The response is produced while the rows are read, so memory use doesn't grow with the catalog.
+
+    :param request: The API request
+    :return: A streaming response
+    """
+    response = StreamingHttpResponse(iter_catalog_lines(), content_type="application/x-ndjson")
+    response["Content-Disposition"] = 'attachment; filename="catalog.ndjson"'
+    return response
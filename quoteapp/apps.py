@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class QuoteappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "quoteapp"
+
+    def ready(self):
+        import quoteapp.signals
@@ -0,0 +1,21 @@
+"""
+The URLs of quoteapp for ASGI requests, see quoteapp.async_views: the same patterns, with the async read views.
+"""
+from django.urls import URLPattern
+
+from . import async_views, urls, views
+
+app_name = urls.app_name
+
+ASYNC_VIEWS = {
+    views.main: async_views.main,
+    views.get_info_author: async_views.get_info_author,
+    views.look_for_tag: async_views.look_for_tag,
+    views.search: async_views.search,
+    views.search_data: async_views.search_data,
+}
+
+urlpatterns = [
+    URLPattern(pattern.pattern, ASYNC_VIEWS.get(pattern.callback, pattern.callback), pattern.default_args, pattern.name)
+    for pattern in urls.urlpatterns
+]
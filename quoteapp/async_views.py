@@ -0,0 +1,192 @@
+"""
+Async versions of the read views, for the requests served through ASGI.
+
+AsyncViewsMiddleware routes ASGI requests to ASYNC_URLCONF (quotes.asgi_urls), where the views of this module take
+the place of their synchronous counterparts in quoteapp.views; WSGI requests keep using those. The views read their
+data with the async ORM API, so the event loop serves other requests while a query runs. The work that has to
+run in a thread, the conditional GET check (it reads the session) and template rendering together with reading
+the model files (see quoteapp.modelfiles), takes one thread hop each.
+
+Django 4.2 runs an async query with sync_to_async on the thread of its request, on the request's connection,
+so the queries of one request run one after another, like in the synchronous views.
+"""
+from typing import Callable, List, Union
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpRequest, HttpResponse, HttpResponseRedirect
+from django.shortcuts import redirect, render
+from django.template.response import TemplateResponse
+from django.urls import reverse
+
+from . import views
+from .conditional import request_version, versioned_page
+from .models import Author, Quote, QuoteCard, Tag
+from .pagination import PER_PAGE, IdListPaginator, KeysetPaginator, aestimate_count
+from .search import cached_search_quotes, normalize_query
+from .similar import similar_quotes
+from .tags import tag_registry
+from .templatetags.fragments import fragment_key
+from .versions import CATALOG, RELATED_TAGS, SIMILAR_QUOTES, TOP_TAGS, author_scope, tag_scope
+
+render_async = sync_to_async(render)
+
+
+@versioned_page(lambda page=1: [CATALOG, TOP_TAGS])
+async def main(request: HttpRequest, page: int = 1) -> TemplateResponse:
+    """
+    The main function is the async version of quoteapp.views.main.
+
+    :param request: Pass the request object to the view
+    :param page: The page number of an old /<page> link
+    :return: A rendered template with the quotes and top tags
+    """
+    quotes = QuoteCard.objects.all()
+    paginator = KeysetPaginator(quotes, per_page=PER_PAGE)
+    if page > 1:
+        return await sync_to_async(views.redirect_to_cursor)(paginator, page, reverse("quoteapp:main"))
+
+    page_object = await paginator.aget_page(request.GET.get("cursor"))
+    page_object.estimated_total = await aestimate_count(QuoteCard)
+    top_tags = await top_tags_unless_cached(request)
+    return await render_async(request, "quoteapp/index.html", {"quotes": page_object, "top_tags": top_tags})
+
+
+@versioned_page(lambda author: [author_scope(author), CATALOG, SIMILAR_QUOTES])
+async def get_info_author(request: HttpRequest, author) -> TemplateResponse:
+    """
+    The get_info_author function is the async version of quoteapp.views.get_info_author.
+    The similar quotes model is read from its file in a thread, not on the event loop.
+
+    :param request: Get the request from the user
+    :param author: Get the author object from the database
+    :return: The author_detail
+    """
+    author = await Author.objects.aget(fullname=author)
+    model = await sync_to_async(similar_quotes.current)()
+    if model is None:
+        similar_cards = []
+    else:
+        quote_ids = await alist(Quote.objects.filter(author=author).values_list("pk", flat=True))
+        similar_cards = await aget_cards(model.similar_to_many(quote_ids, settings.SIMILAR_QUOTES_LIMIT))
+    return await render_async(request, "quoteapp/author_detail.html", {"author": author, "similar_quotes": similar_cards})
+
+
+@versioned_page(lambda tag_name, page=1: [tag_scope(tag_name), TOP_TAGS, RELATED_TAGS])
+async def look_for_tag(request: HttpRequest, tag_name: str, page: int = 1) -> TemplateResponse:
+    """
+    The look_for_tag function is the async version of quoteapp.views.look_for_tag.
+    The related tags model is read from its file in the thread that renders the page.
+
+    :param request: Pass the request object to the view
+    :param tag_name: Get the tag object from the database
+    :param page: The page number of an old tag/<tag_name>/<page> link
+    :return: A page with all quotes that have the tag_name
+    """
+    tag = await sync_to_async(tag_registry.lookup)(tag_name)
+    if tag is None:
+        raise Http404(f"No tag named {tag_name}")
+    if tag.name != tag_name:
+        url = reverse("quoteapp:look_for_tag", args=[tag.name])
+        return redirect(f"{url}?{request.GET.urlencode()}" if request.GET else url, permanent=True)
+
+    paginator = KeysetPaginator(QuoteCard.objects.filter(quote__tags=tag.id), per_page=PER_PAGE, estimated_total=tag.quote_count)
+    if page > 1:
+        url = reverse("quoteapp:look_for_tag", args=[tag_name])
+        return await sync_to_async(views.redirect_to_cursor)(paginator, page, url)
+
+    page_object = await paginator.aget_page(request.GET.get("cursor"))
+    top_tags = await top_tags_unless_cached(request)
+
+    def render_page():
+        return render(request, "quoteapp/look_for_tag.html", views.tag_page_context(tag, page_object, top_tags))
+
+    return await sync_to_async(render_page)()
+
+
+@versioned_page(lambda: [CATALOG, TOP_TAGS])
+async def search(request: HttpRequest) -> TemplateResponse:
+    """
+    The search function is the async version of quoteapp.views.search.
+
+    :param request: HttpRequest: Get the request object from the view
+    :return: A templateresponse object
+    """
+    data = request.GET.get("q", "")
+    query = normalize_query(data)
+    if query != data:
+        return views.redirect_to_search(query, request.GET.get("cursor"))
+
+    quote_ids = await sync_to_async(cached_search_quotes)(query)
+    top_tags = await top_tags_unless_cached(request)
+    paginator = IdListPaginator(quote_ids, QuoteCard.objects.all(), per_page=PER_PAGE)
+    page_object = await paginator.aget_page(request.GET.get("cursor"))
+    return await render_async(request, "quoteapp/search.html", {"quotes": page_object, "top_tags": top_tags, "data": query})
+
+
+async def search_data(request: HttpRequest, data: str, page: int = 1) -> HttpResponseRedirect:
+    """
+    The search_data function is the async version of quoteapp.views.search_data.
+    It only redirects and runs no queries, so the synchronous view is called as it is.
+
+    :param request: HttpRequest: Get the request object from the view
+    :param data: str: The search data of an old search_data/<data> link
+    :param page: int: The page number of an old search_data/<data>/<page> link
+    :return: A redirect to the search view
+    """
+    return views.search_data(request, data, page)
+
+
+async def aget_top_tags() -> List[Tag]:
+    return views.set_font_sizes(await alist(views.top_tags_queryset()))
+
+
+async def top_tags_unless_cached(request: HttpRequest) -> Union[List[Tag], Callable[[], List[Tag]]]:
+    """
+    The top_tags_unless_cached function reads the top tags when the cached tag cloud of the page is stale.
+    Otherwise the template gets quoteapp.views.get_top_tags, which it only calls if the fragment expires meanwhile.
+
+    :param request: The request of a versioned_page view that depends on TOP_TAGS
+    :return: The top tags, or a callable returning them
+    """
+    if await cache.ahas_key(fragment_key("top_tags", request_version(request, TOP_TAGS))):
+        return views.get_top_tags
+    return await aget_top_tags()
+
+
+async def aget_cards(quote_ids: List[int]) -> List[QuoteCard]:
+    cards = await QuoteCard.objects.ain_bulk(quote_ids)
+    return [cards[pk] for pk in quote_ids if pk in cards]
+
+
+async def alist(queryset) -> list:
+    return [row async for row in queryset]
+
+
+class AsyncViewsMiddleware:
+    """
+    Routes the requests served through ASGI to ASYNC_URLCONF, the URLs with the async views of this module.
+    It is async capable, so ASGI requests reach an async view without a thread hop; under WSGI it does nothing.
+    Set ASYNC_VIEWS = False to serve the synchronous views to ASGI requests too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable):
+        if not getattr(settings, "ASYNC_VIEWS", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        request.urlconf = settings.ASYNC_URLCONF
+        return await self.get_response(request)
@@ -0,0 +1,94 @@
+"""
+The author and tag lookups behind the autocomplete pickers of QuoteForm (see quoteapp.widgets).
+
+A lookup returns the names starting with the typed prefix, one page at a time. The prefix is matched against a key,
+Tag.name (stored lowercased) or lower(Author.fullname), and the choices are ordered by the key and the id; the cursor
+of the next page is the key and id of the last choice, so every page is a range scan of one index. On PostgreSQL
+the key is compared in the "C" collation, the one of the (key, id) indexes of migration 0012: an index in the
+database collation can't serve LIKE 'prefix%' and a text_pattern_ops one can't serve ORDER BY.
+
+Pages are cached under the version of the names they list (AUTHOR_NAMES, TAG_NAMES), so they are only read
+again after an author or tag was added, renamed or removed. A page read from a replica right after a change
+isn't cached, see quotes.routers.
+"""
+import hashlib
+from typing import Any, Callable, Dict, NamedTuple, Optional, Type
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F, Model, Q
+from django.db.models.functions import Collate, Lower
+from quotes.routers import may_be_stale
+
+from .models import Author, Tag, normalize_tag_name
+from .pagination import decode_cursor, encode_cursor
+from .versions import AUTHOR_NAMES, TAG_NAMES, get_versions
+
+AUTOCOMPLETE_PAGE_SIZE = 20
+# Longer prefixes can't match, names have at most 50 characters
+MAX_PREFIX_LENGTH = 50
+PAGE_KEY = "quoteapp:autocomplete:{}:{}:{}"
+
+
+class Lookup(NamedTuple):
+    scope: str
+    model: Type[Model]
+    name_field: str
+    # The expression the normalized prefix is matched against, a lowercased name
+    key: Callable[[], Any]
+    normalize: Callable[[str], str]
+
+
+LOOKUPS: Dict[str, Lookup] = {
+    "authors": Lookup(AUTHOR_NAMES, Author, "fullname", lambda: Lower("fullname"), lambda prefix: prefix.lstrip().lower()),
+    "tags": Lookup(TAG_NAMES, Tag, "name", lambda: F("name"), normalize_tag_name),
+}
+
+
+def prefix_key(expression: Any) -> Any:
+    """
+    The prefix_key function returns the key expression of a lookup as it is compared, matched and ordered.
+    On PostgreSQL that is in the "C" collation, see the module docstring.
+
+    :param expression: The key of a Lookup
+    :return: The expression to filter and order by
+    """
+    if connection.vendor == "postgresql":
+        return Collate(expression, "C")
+    return expression
+
+
+def autocomplete(kind: str, prefix: str, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """
+    The autocomplete function returns a page of the authors or tags whose names start with a prefix.
+
+    :param kind: "authors" or "tags"
+    :param prefix: The typed text
+    :param cursor: The token of the page, None for the first one
+    :return: The choices of the page as {"id", "text"} dicts under "results" and the token of the next page
+    """
+    lookup = LOOKUPS[kind]
+    prefix = lookup.normalize(prefix)[:MAX_PREFIX_LENGTH]
+    after = decode_cursor(cursor).get("after")
+    if not (isinstance(after, list) and len(after) == 2 and isinstance(after[0], str) and isinstance(after[1], int)):
+        after = None
+
+    version, modified = get_versions([lookup.scope])[lookup.scope]
+    key = PAGE_KEY.format(kind, version, hashlib.md5(f"{prefix}\0{after or ''}".encode()).hexdigest())
+    page = cache.get(key)
+    if page is None:
+        rows = lookup.model.objects.annotate(key=prefix_key(lookup.key())).filter(key__startswith=prefix)
+        if after is not None:
+            # key >= after_key is the range of the index, the rest of the key's ties are skipped by id
+            rows = rows.filter(key__gte=after[0]).exclude(Q(key=after[0]) & Q(pk__lte=after[1]))
+        rows = list(rows.order_by("key", "pk").values_list("pk", lookup.name_field, "key")[: AUTOCOMPLETE_PAGE_SIZE + 1])
+        has_next = len(rows) > AUTOCOMPLETE_PAGE_SIZE
+        rows = rows[:AUTOCOMPLETE_PAGE_SIZE]
+        page = {
+            "results": [{"id": pk, "text": name} for pk, name, _ in rows],
+            "next": encode_cursor(after=[rows[-1][2], rows[-1][0]]) if has_next else None,
+        }
+        if not may_be_stale(modified):
+            cache.set(key, page, settings.AUTOCOMPLETE_CACHE_TIMEOUT)
+    return page
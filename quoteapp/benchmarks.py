@@ -0,0 +1,472 @@
+import asyncio
+import bisect
+import io
+import json
+import math
+import random
+import re
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import accumulate
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, unquote_to_bytes, urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.wsgi import get_wsgi_application
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from .models import Author, Quote, Tag
+from .pagination import PER_PAGE, KeysetPaginator, encode_cursor
+
+BENCHMARK_USERNAME = "benchmark"
+DEFAULT_ZIPF_EXPONENT = 1.1
+# The pages whose throughput is compared under WSGI and ASGI, see quoteapp.async_views
+THROUGHPUT_LABELS = ["main", "tag", "author", "search"]
+
+
+class ZipfSampler:
+    """
+    Draws ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** exponent,
+    so a few tags are on most quotes and most tags are rare, like on the real site.
+    """
+
+    def __init__(self, n: int, exponent: float, rng: random.Random):
+        self.cum_weights = list(accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+        self.rng = rng
+
+    def sample(self) -> int:
+        return bisect.bisect_left(self.cum_weights, self.rng.random() * self.cum_weights[-1])
+
+    def sample_distinct(self, k: int) -> List[int]:
+        ranks = set()
+        while len(ranks) < min(k, len(self.cum_weights)):
+            ranks.add(self.sample())
+        return sorted(ranks)
+
+
+def write_json_array(path: Path, items: Iterator[dict]) -> int:
+    """
+    The write_json_array function writes a JSON array one item at a time, so a corpus of
+    millions of quotes is never held in memory.
+
+    :param path: The file to write
+    :param items: The items of the array
+    :return: The number of items written
+    """
+    count = 0
+    with open(path, "w") as fp:
+        fp.write("[\n")
+        for item in items:
+            fp.write(("" if count == 0 else ",\n") + json.dumps(item))
+            count += 1
+        fp.write("\n]\n")
+    return count
+
+
+def generate_corpus(
+    output_dir: Path,
+    quotes: int,
+    authors: Optional[int] = None,
+    tags: Optional[int] = None,
+    exponent: float = DEFAULT_ZIPF_EXPONENT,
+    seed: int = 0,
+    source_dir: Path = Path("."),
+) -> Dict[str, int]:
+    """
+    The generate_corpus function writes authors.json and quotes.json files with the shape of the
+    bundled ones, scaled to any number of quotes. Quote texts are built from the vocabulary of the
+    bundled quotes, the number of tags per quote follows the bundled distribution and the tags
+    themselves are drawn from a Zipf distribution. The output is deterministic for a given seed.
+
+    :param output_dir: Where to write authors.json and quotes.json
+    :param quotes: The number of quotes
+    :param authors: The number of authors, quotes / 20 by default
+    :param tags: The size of the tag vocabulary, quotes / 50 (at least 137) by default
+    :param exponent: The exponent of the Zipf distribution of the tags
+    :param seed: The random seed
+    :param source_dir: The directory with the bundled authors.json and quotes.json
+    :return: The number of authors, tags and quotes written
+    """
+    rng = random.Random(seed)
+    with open(source_dir / "quotes.json") as fp:
+        source_quotes = json.load(fp)
+    with open(source_dir / "authors.json") as fp:
+        source_authors = json.load(fp)
+
+    authors = authors or max(quotes // 20, 1)
+    tags = tags or max(quotes // 50, 137)
+    words = [word for quote in source_quotes for word in re.findall(r"[\w']+", quote["quote"])]
+    source_tags = list(dict.fromkeys(tag for quote in source_quotes for tag in quote["tags"]))
+    tag_names = [source_tags[i] if i < len(source_tags) else f"{source_tags[i % len(source_tags)]}-{i}" for i in range(tags)]
+    tag_counts = [len(quote["tags"]) for quote in source_quotes]
+    author_names = [f"{source_authors[i % len(source_authors)]['fullname']} {i}" for i in range(authors)]
+
+    def author_items():
+        for i, name in enumerate(author_names):
+            template = source_authors[i % len(source_authors)]
+            yield {**template, "fullname": name}
+
+    def quote_items():
+        sampler = ZipfSampler(tags, exponent, rng)
+        for i in range(quotes):
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(8, 40)))
+            yield {
+                "tags": [tag_names[rank] for rank in sampler.sample_distinct(rng.choice(tag_counts))],
+                "author": author_names[rng.randrange(authors)],
+                "quote": f"{text.capitalize()}. ({i})",
+            }
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return {
+        "authors": write_json_array(output_dir / "authors.json", author_items()),
+        "tags": tags,
+        "quotes": write_json_array(output_dir / "quotes.json", quote_items()),
+    }
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """
+    The percentile function returns the nearest-rank percentile of an already sorted list.
+
+    :param sorted_values: The measurements, in ascending order
+    :param p: The percentile, between 0 and 100
+    :return: The percentile
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+# A benchmark target: (label, path, needs a logged in user)
+Target = Tuple[str, str, bool]
+
+
+def benchmark_targets(user: User) -> Tuple[List[Target], List[str]]:
+    """
+    The benchmark_targets function turns every named URL of quoteapp and users into concrete
+    request paths, using rows of the current database for the URL arguments.
+
+    :param user: The benchmark user, used for the password reset link
+    :return: The targets and the names of URL patterns without a known way to build them
+    """
+    author = Author.objects.order_by("pk").first()
+    tag = Tag.objects.order_by("-quote_count").first()
+    quote = Quote.objects.order_by("pk").first()
+    word = re.findall(r"\w+", quote.quote)[0] if quote else "life"
+    deep_cursor = KeysetPaginator(Quote.objects.all(), per_page=PER_PAGE).cursor_for_page(50) or encode_cursor(after=0)
+
+    builders: Dict[str, Callable[[], List[Target]]] = {
+        "quoteapp:main": lambda: [
+            ("main", reverse("quoteapp:main"), False),
+            ("main_deep_page", f"{reverse('quoteapp:main')}?cursor={deep_cursor}", False),
+            ("main_legacy_page", reverse("quoteapp:main", args=[5]), False),
+        ],
+        "quoteapp:get_info_author": lambda: [
+            ("author", reverse("quoteapp:get_info_author", args=[author.fullname]), False),
+        ]
+        if author
+        else [],
+        "quoteapp:look_for_tag": lambda: [
+            ("tag", reverse("quoteapp:look_for_tag", args=[tag.name]), False),
+            ("tag_legacy_page", reverse("quoteapp:look_for_tag", args=[tag.name, 2]), False),
+        ]
+        if tag
+        else [],
+        "quoteapp:similar_quotes": lambda: [
+            ("similar_quotes", reverse("quoteapp:similar_quotes", args=[quote.pk]), False),
+        ]
+        if quote
+        else [],
+        "quoteapp:random_quote": lambda: [
+            ("random_quote", reverse("quoteapp:random_quote"), False),
+            ("random_quote_by_tag", f"{reverse('quoteapp:random_quote')}?tag={tag.name}", False),
+        ]
+        if tag
+        else [("random_quote", reverse("quoteapp:random_quote"), False)],
+        "quoteapp:quote_of_the_day": lambda: [("quote_of_the_day", reverse("quoteapp:quote_of_the_day"), False)],
+        "quoteapp:add_tag": lambda: [("add_tag", reverse("quoteapp:add_tag"), True)],
+        "quoteapp:add_author": lambda: [("add_author", reverse("quoteapp:add_author"), True)],
+        "quoteapp:add_quote": lambda: [("add_quote", reverse("quoteapp:add_quote"), True)],
+        "quoteapp:search": lambda: [("search", f"{reverse('quoteapp:search')}?q={word.lower()}", False)],
+        "quoteapp:search_data": lambda: [("search_legacy", reverse("quoteapp:search_data", args=[word]), False)],
+        "quoteapp:api_quotes": lambda: [
+            ("api_quotes", reverse("quoteapp:api_quotes"), False),
+            ("api_quotes_by_tag", f"{reverse('quoteapp:api_quotes')}?tag={tag.name if tag else ''}", False),
+        ],
+        "quoteapp:api_authors": lambda: [("api_authors", reverse("quoteapp:api_authors"), False)],
+        "quoteapp:api_tags": lambda: [("api_tags", reverse("quoteapp:api_tags"), False)],
+        "quoteapp:api_author_choices": lambda: [
+            (
+                "api_author_choices",
+                f"{reverse('quoteapp:api_author_choices')}?{urlencode({'q': author.fullname[:2] if author else ''})}",
+                False,
+            )
+        ],
+        "quoteapp:api_tag_choices": lambda: [
+            ("api_tag_choices", f"{reverse('quoteapp:api_tag_choices')}?{urlencode({'q': tag.name[:2] if tag else ''})}", False)
+        ],
+        "quoteapp:api_suggestions": lambda: [
+            ("api_suggestions", f"{reverse('quoteapp:api_suggestions')}?{urlencode({'q': word[:3].lower()})}", False)
+        ],
+        "quoteapp:api_export": lambda: [("api_export", reverse("quoteapp:api_export"), False)],
+        "quoteapp:fragment_stats": lambda: [("fragment_stats", reverse("quoteapp:fragment_stats"), True)],
+        "users:signup": lambda: [("signup", reverse("users:signup"), False)],
+        "users:login": lambda: [("login", reverse("users:login"), False)],
+        "users:logout": lambda: [("logout", reverse("users:logout"), True)],
+        "users:profile": lambda: [("profile", reverse("users:profile"), True)],
+        "users:password_reset": lambda: [("password_reset", reverse("users:password_reset"), False)],
+        "users:password_reset_done": lambda: [("password_reset_done", reverse("users:password_reset_done"), False)],
+        "users:password_reset_confirm": lambda: [
+            (
+                "password_reset_confirm",
+                reverse(
+                    "users:password_reset_confirm",
+                    args=[urlsafe_base64_encode(force_bytes(user.pk)), default_token_generator.make_token(user)],
+                ),
+                False,
+            )
+        ],
+        "users:password_reset_complete": lambda: [("password_reset_complete", reverse("users:password_reset_complete"), False)],
+    }
+
+    names = list(dict.fromkeys(url_names("quoteapp.urls", "quoteapp") + url_names("users.urls", "users")))
+    targets = [target for name in names if name in builders for target in builders[name]()]
+    return targets, [name for name in names if name not in builders]
+
+
+def url_names(urlconf: str, namespace: str) -> List[str]:
+    names = []
+    for pattern in get_resolver(urlconf).url_patterns:
+        if isinstance(pattern, URLPattern) and pattern.name:
+            names.append(f"{namespace}:{pattern.name}")
+        elif isinstance(pattern, URLResolver):
+            names.extend(url_names(pattern.urlconf_name, pattern.namespace or namespace))
+    return names
+
+
+def consume(response) -> int:
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def benchmark_url(client: Client, user: User, target: Target, requests: int, warmup: int, cold: bool) -> Dict[str, object]:
+    """
+    The benchmark_url function requests one path repeatedly and measures it.
+    Latency percentiles and the query count come from the timed requests; the peak memory is
+    measured on one extra request, because tracemalloc would distort the timings.
+
+    :param client: The test client
+    :param user: The user to log in for targets that need one
+    :param target: The label, path and login requirement of the URL
+    :param requests: The number of timed requests
+    :param warmup: The number of untimed requests made first
+    :param cold: Clear the cache before every request
+    :return: The measurements
+    """
+    label, path, needs_login = target
+
+    def request():
+        if cold:
+            cache.clear()
+        if needs_login:
+            client.force_login(user)
+        else:
+            client.logout()
+
+    for _ in range(warmup):
+        request()
+        consume(client.get(path))
+
+    latencies, queries, status, size = [], [], None, 0
+    for _ in range(requests):
+        request()
+        with ExitStack() as stack:
+            # Reads may be routed to a replica, so the queries are counted on every connection the router uses
+            aliases = [DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS]
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in aliases]
+            started = time.perf_counter()
+            response = client.get(path)
+            size = consume(response)
+            latencies.append(time.perf_counter() - started)
+        queries.append(sum(map(len, captured)))
+        status = response.status_code
+
+    request()
+    tracemalloc.start()
+    consume(client.get(path))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "path": path,
+        "status": status,
+        "bytes": size,
+        "requests": requests,
+        **summarize(latencies),
+        "queries": max(queries) if queries else 0,
+        "peak_memory_kib": round(peak / 1024, 1),
+    }
+
+
+def wsgi_throughput(path: str, concurrency: int, requests: int, server_name: str) -> Dict[str, object]:
+    """
+    The wsgi_throughput function calls the WSGI application of the site from concurrency threads,
+    like a threaded WSGI server would, and measures how many requests it serves per second.
+    Requests go to the application directly, so the numbers leave out the network and the server.
+
+    :param path: The path and query string to request
+    :param concurrency: The number of requests in flight at a time
+    :param requests: The number of requests
+    :param server_name: The host name to send, one of ALLOWED_HOSTS
+    :return: The measurements
+    """
+    application = get_wsgi_application()
+    url = urlsplit(path)
+
+    def request() -> Tuple[int, float]:
+        statuses = []
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": unquote_to_bytes(url.path).decode("iso-8859-1"),
+            "QUERY_STRING": url.query,
+            "SERVER_NAME": server_name,
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "wsgi.input": io.BytesIO(),
+            "wsgi.errors": io.StringIO(),
+            "wsgi.url_scheme": "http",
+        }
+        started = time.perf_counter()
+        response = application(environ, lambda status, headers, exc_info=None: statuses.append(int(status[:3])))
+        try:
+            for _ in response:
+                pass
+        finally:
+            response.close()
+        return statuses[0], time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: request(), range(requests)))
+    return summarize_throughput(results, time.perf_counter() - started, concurrency)
+
+
+def asgi_throughput(path: str, concurrency: int, requests: int, server_name: str) -> Dict[str, object]:
+    """
+    The asgi_throughput function calls the ASGI application of the site from one event loop with up to
+    concurrency requests in flight, like an ASGI server would, and measures how many requests it serves per second.
+    ASGI requests are served by the async views (quoteapp.async_views) unless ASYNC_VIEWS is off.
+
+    :param path: The path and query string to request
+    :param concurrency: The number of requests in flight at a time
+    :param requests: The number of requests
+    :param server_name: The host name to send, one of ALLOWED_HOSTS
+    :return: The measurements
+    """
+    application = get_asgi_application()
+    url = urlsplit(path)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": unquote(url.path),
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": [(b"host", server_name.encode())],
+        "server": (server_name, 80),
+    }
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def request(semaphore: asyncio.Semaphore) -> Tuple[int, float]:
+        messages = []
+
+        async def send(message: dict) -> None:
+            messages.append(message)
+
+        async with semaphore:
+            started = time.perf_counter()
+            await application(dict(scope), receive, send)
+            return messages[0]["status"], time.perf_counter() - started
+
+    async def run() -> List[Tuple[int, float]]:
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(request(semaphore) for _ in range(requests)))
+
+    started = time.perf_counter()
+    results = asyncio.run(run())
+    return summarize_throughput(results, time.perf_counter() - started, concurrency)
+
+
+def summarize_throughput(results: List[Tuple[int, float]], seconds: float, concurrency: int) -> Dict[str, object]:
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": sum(1 for status, _ in results if status >= 400),
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(len(results) / seconds, 1) if seconds else 0.0,
+        **summarize([latency for _, latency in results]),
+    }
+
+
+def compare_results(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    The compare_results function lists the measurements that got worse than a baseline run.
+
+    :param current: The results of this run
+    :param baseline: The results of an earlier run
+    :param threshold: The relative slowdown that counts as a regression, e.g. 0.2 for 20%
+    :return: One line per regression
+    """
+    regressions = []
+    for section in ("urls", "imports"):
+        for label, result in current.get(section, {}).items():
+            before = baseline.get(section, {}).get(label)
+            if not before:
+                continue
+            for metric in ("p95_ms", "seconds"):
+                if metric in result and before.get(metric) and result[metric] > before[metric] * (1 + threshold):
+                    regressions.append(f"{section}.{label}.{metric}: {before[metric]} -> {result[metric]}")
+            if "queries" in result and result["queries"] > before.get("queries", math.inf):
+                regressions.append(f"{section}.{label}.queries: {before['queries']} -> {result['queries']}")
+    for label, interfaces in current.get("throughput", {}).items():
+        for interface, result in interfaces.items():
+            before = baseline.get("throughput", {}).get(label, {}).get(interface)
+            if before and result["requests_per_second"] < before["requests_per_second"] * (1 - threshold):
+                regressions.append(
+                    f"throughput.{label}.{interface}.requests_per_second: {before['requests_per_second']} -> "
+                    f"{result['requests_per_second']}"
+                )
+    return regressions
+
+
+def corpus_counts() -> Dict[str, int]:
+    return {"authors": Author.objects.count(), "tags": Tag.objects.count(), "quotes": Quote.objects.count()}
+
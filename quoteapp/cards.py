@@ -0,0 +1,66 @@
+from itertools import chain
+from typing import Iterable, Iterator, List
+
+from django.db.models import F, Prefetch
+
+from .models import Quote, QuoteCard, Tag
+from .search import index_cards
+from .versions import bump_version, tag_scope
+
+CARD_FIELDS = ["text", "author_name", "tag_names"]
+REFRESH_CHUNK_SIZE = 1000
+
+
+def build_card(quote: Quote, author_name: str, tag_names: Iterable[str]) -> QuoteCard:
+    return QuoteCard(quote_id=quote.pk, text=quote.quote, author_name=author_name, tag_names=sorted(tag_names))
+
+
+def refresh_cards(quote_ids: Iterable[int]) -> None:
+    """
+    The refresh_cards function rebuilds the QuoteCard rows of the given quotes from the normalized tables.
+    Quotes are processed in chunks; every chunk costs a fixed number of queries (quotes with authors,
+    tags, upsert, version bump, search vectors) no matter how many quotes it holds.
+
+    The pages of every tag a card had before or has after the refresh are marked as modified.
+
+    :param quote_ids: The primary keys of the quotes whose cards are stale
+    :return: None
+    """
+    for chunk in chunked(quote_ids, REFRESH_CHUNK_SIZE):
+        tag_names = set(chain.from_iterable(QuoteCard.objects.filter(pk__in=chunk).values_list("tag_names", flat=True)))
+        quotes = (
+            Quote.objects.filter(pk__in=chunk)
+            .select_related("author")
+            .prefetch_related(Prefetch("tags", queryset=Tag.objects.only("name")))
+        )
+        cards = [build_card(quote, quote.author.fullname, [tag.name for tag in quote.tags.all()]) for quote in quotes]
+        QuoteCard.objects.bulk_create(cards, update_conflicts=True, unique_fields=["quote"], update_fields=CARD_FIELDS)
+        QuoteCard.objects.filter(pk__in=chunk).update(version=F("version") + 1)
+        index_cards(QuoteCard.objects.filter(pk__in=chunk))
+        tag_names.update(chain.from_iterable(card.tag_names for card in cards))
+        bump_version(*map(tag_scope, tag_names))
+
+
+def rebuild_all_cards() -> int:
+    """
+    The rebuild_all_cards function refreshes the cards of every quote.
+
+    :return: The number of quotes processed
+    """
+    processed = 0
+    quote_ids = Quote.objects.order_by("pk").values_list("pk", flat=True).iterator(REFRESH_CHUNK_SIZE)
+    for chunk in chunked(quote_ids, REFRESH_CHUNK_SIZE):
+        refresh_cards(chunk)
+        processed += len(chunk)
+    return processed
+
+
+def chunked(values: Iterable, size: int) -> Iterator[List]:
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,120 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from .versions import get_versions
+
+ScopesFunc = Callable[..., List[str]]
+
+
+def content_versions(request: HttpRequest, scopes_func: ScopesFunc, *args, **kwargs) -> Dict[str, Tuple[int, float]]:
+    """
+    The content_versions function reads the versions of the scopes a page depends on, once per request.
+    Both the ETag and the Last-Modified value are derived from it, so a revalidation costs one cache round trip.
+    The time the versions were read at is kept as request._content_versions_read_at.
+
+    :param request: The current request
+    :param scopes_func: Returns the scope names for the view arguments
+    :return: A mapping of scope to (version, modified timestamp)
+    """
+    if not hasattr(request, "_content_versions"):
+        request._content_versions_read_at = time.time()
+        request._content_versions = get_versions(scopes_func(*args, **kwargs))
+    return request._content_versions
+
+
+def request_version(request: HttpRequest, scope: str) -> int:
+    """
+    The request_version function returns the version of a scope as it was read for the conditional GET check of a
+    versioned_page view, so the view renders the content the ETag describes without another cache round trip.
+
+    :param request: The current request
+    :param scope: One of the scopes of the view
+    :return: The version number
+    """
+    return request._content_versions[scope][0]
+
+
+def viewer(request: HttpRequest) -> str:
+    user = request.user
+    return f"{user.pk}:{user.username}" if user.is_authenticated else "anon"
+
+
+def versioned_page(scopes_func: ScopesFunc) -> Callable:
+    """
+    The versioned_page decorator answers conditional GET requests for a public read view
+    without running the view. The strong ETag is a digest of the content versions the page depends on,
+    the viewer (the navbar differs per user) and the full path, and Last-Modified is the newest
+    modification time of those scopes. Matching If-None-Match / If-Modified-Since headers get a 304
+    before any query or template rendering; every response must be revalidated by the client.
+    Last-Modified has a resolution of one second, so it is left out while a change within the second of the
+    newest modification could still follow; the ETag alone revalidates those responses.
+    Async views (see quoteapp.async_views) are checked in one thread hop, the check reads the cache and the session.
+
+    :param scopes_func: Takes the view arguments and returns the version scopes the page depends on
+    :return: The decorator
+    """
+
+    def etag(request: HttpRequest, *args, **kwargs) -> str:
+        versions = content_versions(request, scopes_func, *args, **kwargs)
+        parts = [request.get_full_path(), viewer(request)]
+        parts.extend(f"{scope}={version}" for scope, (version, _) in sorted(versions.items()))
+        return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+    def last_modified(request: HttpRequest, *args, **kwargs) -> Optional[datetime]:
+        versions = content_versions(request, scopes_func, *args, **kwargs)
+        modified = max(modified for _, modified in versions.values())
+        # A change after the versions were read would have the same Last-Modified and get a 304
+        if int(modified) >= int(request._content_versions_read_at):
+            return None
+        return datetime.fromtimestamp(modified, tz=timezone.utc)
+
+    def preconditions(request: HttpRequest, *args, **kwargs) -> Tuple[str, Optional[int], Optional[HttpResponse]]:
+        # What condition() does before calling the view
+        res_etag = quote_etag(etag(request, *args, **kwargs))
+        modified = last_modified(request, *args, **kwargs)
+        res_last_modified = int(modified.timestamp()) if modified else None
+        return res_etag, res_last_modified, get_conditional_response(request, etag=res_etag, last_modified=res_last_modified)
+
+    def patch_headers(request: HttpRequest, response: HttpResponse) -> HttpResponse:
+        patch_vary_headers(response, ("Cookie",))
+        if request.user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+    def decorator(view: Callable) -> Callable:
+        if iscoroutinefunction(view):
+
+            @wraps(view)
+            async def async_wrapper(request: HttpRequest, *args, **kwargs):
+                res_etag, res_last_modified, response = await sync_to_async(preconditions)(request, *args, **kwargs)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                if request.method in ("GET", "HEAD"):
+                    if res_last_modified is not None and not response.has_header("Last-Modified"):
+                        response.headers["Last-Modified"] = http_date(res_last_modified)
+                    response.headers.setdefault("ETag", res_etag)
+                # request.user was loaded by the ETag
+                return patch_headers(request, response)
+
+            return async_wrapper
+
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request: HttpRequest, *args, **kwargs):
+            return patch_headers(request, conditional_view(request, *args, **kwargs))
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,49 @@
+from collections import defaultdict
+from typing import Mapping
+
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Quote, Tag
+from .versions import TOP_TAGS, bump_version
+
+
+def adjust_tag_counts(deltas: Mapping[int, int]) -> None:
+    """
+    The adjust_tag_counts function applies quote count changes to tags.
+    Tags that change by the same amount are updated together, so a whole import
+    batch costs a handful of UPDATE statements instead of one per tag.
+
+    :param deltas: A mapping of tag id to the number of quotes added (or removed, if negative)
+    :return: None
+    """
+    tags_by_delta = defaultdict(list)
+    for tag_id, delta in deltas.items():
+        if delta:
+            tags_by_delta[delta].append(tag_id)
+
+    for delta, tag_ids in tags_by_delta.items():
+        Tag.objects.filter(pk__in=tag_ids).update(quote_count=Greatest(F("quote_count") + delta, Value(0)))
+    if tags_by_delta:
+        bump_version(TOP_TAGS)
+
+
+def reconcile_tag_counts() -> int:
+    """
+    The reconcile_tag_counts function recomputes every tag's quote count from the Quote.tags table
+    in a single set-based UPDATE, fixing any drift of the maintained counters.
+
+    :return: The number of tags whose counter was wrong
+    """
+    real_count = Coalesce(
+        Subquery(
+            Quote.tags.through.objects.filter(tag_id=OuterRef("pk")).values("tag_id").annotate(count=Count("*")).values("count")
+        ),
+        0,
+    )
+    drifted = Tag.objects.alias(real_count=real_count).exclude(quote_count=F("real_count"))
+    fixed = drifted.count()
+    if fixed:
+        Tag.objects.update(quote_count=real_count)
+        bump_version(TOP_TAGS)
+    return fixed
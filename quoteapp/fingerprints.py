@@ -0,0 +1,233 @@
+"""
+Content fingerprints of quotes, used to find duplicates before they are saved.
+
+Exact duplicates share a content hash: the SHA-256 of the normalized text (markup removed, lowercased, words only),
+stored in the indexed Quote.content_hash column.
+
+Near duplicates (a changed word, other punctuation) are found with MinHash and locality-sensitive hashing. The
+MinHash signature of the word shingles of a text is cut into BANDS bands of ROWS values and every band is hashed
+into a bucket, stored in QuoteBucket. Texts whose shingle sets have a Jaccard similarity s share at least one
+bucket with probability 1 - (1 - s ** ROWS) ** BANDS, about 0.99 for s = 0.75. The quotes sharing a bucket are
+only candidates; they are confirmed with the exact Jaccard similarity of their texts.
+
+Both lookups are index scans for a whole batch of texts at once, so their cost depends on the size of the batch
+rather than on the number of stored quotes.
+"""
+import hashlib
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from django.utils.html import strip_tags
+
+from .cards import chunked
+from .models import Quote, QuoteBucket
+
+WORD_RE = re.compile(r"\w+")
+SHINGLE_SIZE = 2
+BANDS = 16
+ROWS = 4
+# Near duplicates have at least this Jaccard similarity of their shingle sets
+SIMILARITY = 0.75
+# A text is compared with at most this many candidates, the ones sharing the most buckets
+MAX_CANDIDATES = 50
+# Bounds the number of parameters of an IN (...) lookup
+LOOKUP_CHUNK_SIZE = 500
+
+# The hash functions of the signature must never change, every stored bucket depends on them
+_rng = np.random.default_rng(20260418)
+_MULTIPLIERS = _rng.integers(1, 2**63, BANDS * ROWS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_INCREMENTS = _rng.integers(0, 2**63, BANDS * ROWS, dtype=np.uint64)
+
+
+class Fingerprint(NamedTuple):
+    content_hash: str
+    shingles: frozenset
+    buckets: Tuple[int, ...]
+
+
+class Duplicate(NamedTuple):
+    quote_id: int
+    # 1.0 for an exact duplicate, the Jaccard similarity of the shingle sets otherwise
+    similarity: float
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(WORD_RE.findall(strip_tags(text).lower()))
+
+
+def shingles(normalized: str) -> frozenset:
+    words = normalized.split()
+    if len(words) <= SHINGLE_SIZE:
+        return frozenset([normalized]) if normalized else frozenset()
+    return frozenset(" ".join(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1))
+
+
+def minhash(shingle_set: Iterable[str]) -> np.ndarray:
+    """
+    The minhash function returns the MinHash signature of a set of shingles: for each of BANDS * ROWS
+    hash functions a * x + b (mod 2 ** 64) the smallest value over the shingles.
+
+    :param shingle_set: The shingles of a text
+    :return: The signature, an array of BANDS * ROWS unsigned 64 bit integers
+    """
+    values = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "little") for shingle in shingle_set),
+        dtype=np.uint64,
+    )
+    return (values[:, None] * _MULTIPLIERS + _INCREMENTS).min(axis=0)
+
+
+def lsh_buckets(signature: np.ndarray) -> Tuple[int, ...]:
+    bands = signature.astype("<u8").reshape(BANDS, ROWS)
+    return tuple(
+        int.from_bytes(hashlib.blake2b(bytes([band]) + bands[band].tobytes(), digest_size=8).digest(), "little", signed=True)
+        for band in range(BANDS)
+    )
+
+
+def fingerprint(text: str) -> Fingerprint:
+    """
+    The fingerprint function computes the content hash, the shingles and the LSH buckets of a quote text.
+
+    :param text: The text of the quote, possibly with markup
+    :return: The fingerprint
+    """
+    normalized = normalize_text(text)
+    shingle_set = shingles(normalized)
+    # Texts without words are only compared by their content hash
+    buckets = lsh_buckets(minhash(shingle_set)) if shingle_set else ()
+    return Fingerprint(hashlib.sha256(normalized.encode()).hexdigest(), shingle_set, buckets)
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class FingerprintIndex:
+    """
+    An in-memory index of fingerprints by content hash and bucket, for the texts of a batch that aren't stored yet.
+    """
+
+    def __init__(self):
+        self.fingerprints: Dict[int, Fingerprint] = {}
+        self._hashes: Dict[str, int] = {}
+        self._buckets: Dict[int, List[int]] = defaultdict(list)
+
+    def add(self, key: int, fp: Fingerprint) -> None:
+        self.fingerprints[key] = fp
+        self._hashes.setdefault(fp.content_hash, key)
+        for bucket in fp.buckets:
+            self._buckets[bucket].append(key)
+
+    def find(self, fp: Fingerprint) -> Optional[Tuple[int, float]]:
+        """
+        The find function returns the indexed text that fp duplicates.
+
+        :param fp: The fingerprint to look up
+        :return: A (key, similarity) tuple, or None
+        """
+        if fp.content_hash in self._hashes:
+            return self._hashes[fp.content_hash], 1.0
+        candidates = Counter(key for bucket in fp.buckets for key in self._buckets.get(bucket, ()))
+        return best_match(fp, {key: self.fingerprints[key].shingles for key, _ in candidates.most_common(MAX_CANDIDATES)})
+
+
+def best_match(fp: Fingerprint, candidates: Dict[int, frozenset]) -> Optional[Tuple[int, float]]:
+    scored = [(jaccard(fp.shingles, shingle_set), key) for key, shingle_set in candidates.items()]
+    scored = [(similarity, key) for similarity, key in scored if similarity >= SIMILARITY]
+    if not scored:
+        return None
+    similarity, key = max(scored, key=lambda item: (item[0], -item[1]))
+    return key, similarity
+
+
+def find_duplicates(fingerprints: Sequence[Fingerprint], exclude: Optional[int] = None) -> List[Optional[Duplicate]]:
+    """
+    The find_duplicates function looks up the stored quotes that the given texts duplicate.
+    A whole batch costs three queries per LOOKUP_CHUNK_SIZE values: the content hashes, the buckets and the
+    texts of the candidates. Exact duplicates win over near ones, lower quote ids over higher ones.
+
+    :param fingerprints: The fingerprints of the texts
+    :param exclude: The id of a quote to ignore, e.g. the one being edited
+    :return: The duplicate of every text, None when there is none
+    """
+    quotes = Quote.objects.exclude(pk=exclude) if exclude else Quote.objects.all()
+    exact: Dict[str, int] = {}
+    for chunk in chunked({fp.content_hash for fp in fingerprints}, LOOKUP_CHUNK_SIZE):
+        for content_hash, quote_id in quotes.filter(content_hash__in=chunk).values_list("content_hash", "pk"):
+            exact[content_hash] = min(quote_id, exact.get(content_hash, quote_id))
+
+    remaining = [fp for fp in fingerprints if fp.content_hash not in exact]
+    bucket_quotes: Dict[int, Set[int]] = defaultdict(set)
+    buckets = QuoteBucket.objects.exclude(quote_id=exclude) if exclude else QuoteBucket.objects.all()
+    for chunk in chunked({bucket for fp in remaining for bucket in fp.buckets}, LOOKUP_CHUNK_SIZE):
+        for bucket, quote_id in buckets.filter(bucket__in=chunk).values_list("bucket", "quote_id"):
+            bucket_quotes[bucket].add(quote_id)
+
+    candidates: Dict[str, List[int]] = {}
+    for fp in remaining:
+        counts = Counter(quote_id for bucket in fp.buckets for quote_id in bucket_quotes.get(bucket, ()))
+        if counts:
+            candidates[fp.content_hash] = [quote_id for quote_id, _ in counts.most_common(MAX_CANDIDATES)]
+    candidate_shingles: Dict[int, frozenset] = {}
+    for chunk in chunked({quote_id for quote_ids in candidates.values() for quote_id in quote_ids}, LOOKUP_CHUNK_SIZE):
+        for quote_id, text in Quote.objects.filter(pk__in=chunk).values_list("pk", "quote"):
+            candidate_shingles[quote_id] = shingles(normalize_text(text))
+
+    duplicates: List[Optional[Duplicate]] = []
+    for fp in fingerprints:
+        if fp.content_hash in exact:
+            duplicates.append(Duplicate(exact[fp.content_hash], 1.0))
+            continue
+        quote_ids = candidates.get(fp.content_hash, [])
+        match = best_match(
+            fp, {quote_id: candidate_shingles[quote_id] for quote_id in quote_ids if quote_id in candidate_shingles}
+        )
+        duplicates.append(Duplicate(*match) if match else None)
+    return duplicates
+
+
+def store_fingerprints(quotes: Iterable[Tuple[int, Fingerprint]], replace: bool = True) -> None:
+    """
+    The store_fingerprints function stores the buckets of quotes. The content hashes are
+    columns of the quotes, so they are written with the quotes themselves.
+
+    :param quotes: (quote id, fingerprint) tuples
+    :param replace: Delete the buckets the quotes had before; False for new quotes
+    :return: None
+    """
+    quotes = list(quotes)
+    for chunk in chunked([quote_id for quote_id, _ in quotes] if replace else [], LOOKUP_CHUNK_SIZE):
+        QuoteBucket.objects.filter(quote_id__in=chunk).delete()
+    QuoteBucket.objects.bulk_create(
+        [QuoteBucket(quote_id=quote_id, bucket=bucket) for quote_id, fp in quotes for bucket in set(fp.buckets)],
+        batch_size=LOOKUP_CHUNK_SIZE,
+    )
+
+
+def fingerprint_all_quotes(missing_only: bool = True, chunk_size: int = 1000) -> int:
+    """
+    The fingerprint_all_quotes function computes and stores the fingerprints of the stored quotes.
+
+    :param missing_only: Only process the quotes that have no content hash yet
+    :param chunk_size: How many quotes to process per batch
+    :return: The number of quotes processed
+    """
+    processed = 0
+    quotes = Quote.objects.filter(content_hash="") if missing_only else Quote.objects.all()
+    last_id = 0
+    while True:
+        batch = list(quotes.filter(pk__gt=last_id).order_by("pk").only("pk", "quote")[:chunk_size])
+        if not batch:
+            return processed
+        last_id = batch[-1].pk
+        fingerprints = [(quote.pk, fingerprint(quote.quote)) for quote in batch]
+        for quote, (_, fp) in zip(batch, fingerprints):
+            quote.content_hash = fp.content_hash
+        Quote.objects.bulk_update(batch, ["content_hash"], batch_size=chunk_size)
+        store_fingerprints(fingerprints)
+        processed += len(batch)
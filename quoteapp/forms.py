@@ -1,8 +1,19 @@
 from bootstrap_datepicker_plus.widgets import DatePickerInput
-from django.forms import CharField, CheckboxSelectMultiple, DateField, ModelForm, Select, TextInput
+from django.forms import (
+    BooleanField,
+    CharField,
+    CheckboxInput,
+    DateField,
+    ModelForm,
+    TextInput,
+    ValidationError,
+)
+from django.utils.html import strip_tags
 from tinymce.widgets import TinyMCE
 
-from .models import Author, Quote, Tag
+from .fingerprints import find_duplicates, fingerprint
+from .models import Author, Quote, QuoteCard, Tag, normalize_tag_name
+from .widgets import AutocompleteSelect, AutocompleteSelectMultiple
 
 
 class TagForm(ModelForm):
@@ -14,6 +25,9 @@ class TagForm(ModelForm):
         model = Tag
         fields = ["name"]
 
+    def clean_name(self):
+        return normalize_tag_name(self.cleaned_data["name"])
+
 
 class AuthorForm(ModelForm):
     fullname = CharField(
@@ -31,16 +45,45 @@ class AuthorForm(ModelForm):
 
 
 class QuoteForm(ModelForm):
+    # Shown together with the duplicate warning, see clean()
+    save_anyway = BooleanField(required=False, label="Save anyway", widget=CheckboxInput(attrs={"class": "form-check-input"}))
+
     class Meta:
         model = Quote
-        fields = ["quote", "author"]
+        fields = ["quote", "author", "tags"]
+        # Only the selected authors and tags are rendered, the pickers look up the others while typing.
+        # Validation reads the submitted ids only: one query for the author, one for all tags.
         widgets = {
             "quote": TinyMCE(attrs={"placeholder": "Enter the quote"}),
-            "author": Select(attrs={"class": "form-select"}),
-            "tags": CheckboxSelectMultiple(attrs={"class": "form-select"}),
+            "author": AutocompleteSelect("quoteapp:api_author_choices", attrs={"class": "form-select"}),
+            "tags": AutocompleteSelectMultiple("quoteapp:api_tag_choices", attrs={"class": "form-select", "size": 10}),
         }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields["quote"].required = True
         self.fields["author"].required = True
+        self.fields["tags"].required = False
+        self.duplicate = None
+
+    def clean(self):
+        """
+        The clean function warns about a quote that duplicates (exactly or nearly) a stored one, see quoteapp.fingerprints.
+        The form is invalid until it is submitted again with save_anyway checked.
+
+        :return: The cleaned data
+        """
+        cleaned_data = super().clean()
+        text = cleaned_data.get("quote")
+        if text and not cleaned_data.get("save_anyway"):
+            duplicate = find_duplicates([fingerprint(text)], exclude=self.instance.pk)[0]
+            if duplicate is not None:
+                self.duplicate = QuoteCard.objects.filter(pk=duplicate.quote_id).first()
+                if self.duplicate is not None:
+                    raise ValidationError(
+                        "A quote like this one already exists: %(text)s (%(author)s). "
+                        'Check "Save anyway" to add it all the same.',
+                        code="duplicate",
+                        params={"text": strip_tags(self.duplicate.text), "author": self.duplicate.author_name},
+                    )
+        return cleaned_data
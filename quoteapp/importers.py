@@ -0,0 +1,293 @@
+import json
+from collections import Counter, defaultdict
+from itertools import chain
+from typing import Callable, Dict, IO, Iterable, Iterator, List, Optional, Set, Tuple
+
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .cards import build_card, refresh_cards
+from .counters import adjust_tag_counts
+from .fingerprints import Fingerprint, FingerprintIndex, find_duplicates, fingerprint, store_fingerprints
+from .models import Author, Quote, QuoteCard, Tag, normalize_tag_name
+from .related import pair_counts, related_tags, tag_change_deltas
+from .search import index_cards
+from .versions import AUTHOR_NAMES, CATALOG, QUOTE_IDS, TAG_NAMES, author_scope, bump_version, tag_scope
+
+JSON_WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(fp: IO[str], chunk_size: int = 64 * 1024) -> Iterator[dict]:
+    """
+    The iter_json_array function yields the items of a top-level JSON array one by one.
+    The file is read in chunks of chunk_size characters, so memory use depends on the size
+    of a single item rather than on the size of the whole file.
+
+    :param fp: A text file object positioned at the start of a JSON array
+    :param chunk_size: How many characters to read from the file at a time
+    :return: An iterator over the decoded items of the array
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    started = False
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    while True:
+        while position < len(buffer) and buffer[position] in JSON_WHITESPACE + ("," if started else ""):
+            position += 1
+        if position >= len(buffer):
+            if eof or not fill():
+                raise ValueError("Unexpected end of JSON array")
+            continue
+
+        if not started:
+            if buffer[position] != "[":
+                raise ValueError("Expected a JSON array")
+            started = True
+            position += 1
+            continue
+
+        if buffer[position] == "]":
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof or not fill():
+                raise
+            continue
+
+        # A value that ends exactly at the end of the buffer may have been cut in half
+        if end >= len(buffer) and not eof and fill():
+            continue
+
+        position = end
+        yield item
+
+
+class BulkLoader:
+    """
+    Buffers authors and quotes and writes them with bulk_create in batches.
+    Authors and tags are resolved through in-memory name -> id maps which are
+    pre-loaded from the database once, so no per-quote lookups are needed.
+    With update_existing, authors that are already known are upserted instead of skipped.
+    With skip_duplicates, quotes that duplicate a stored or an earlier quote (see quoteapp.fingerprints)
+    are not inserted; their tags are added to the quote they duplicate instead.
+    Without auto_flush, nothing is written until flush() is called, so callers can commit a batch
+    together with their own bookkeeping in one transaction.
+    The tag co-occurrence changes of the committed batches are collected and recorded at once by flush_related_tags().
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 1000,
+        dry_run: bool = False,
+        update_existing: bool = False,
+        skip_duplicates: bool = True,
+        auto_flush: bool = True,
+        progress: Optional[Callable[[Counter], None]] = None,
+    ):
+        self.batch_size = batch_size
+        self.auto_flush = auto_flush
+        self.dry_run = dry_run
+        self.update_existing = update_existing
+        self.skip_duplicates = skip_duplicates
+        self.progress = progress
+        self.stats = Counter()
+        self.author_ids: Dict[str, Optional[int]] = dict(Author.objects.values_list("fullname", "id"))
+        self.tag_ids: Dict[str, Optional[int]] = dict(Tag.objects.values_list("name", "id"))
+        self._authors: List[Author] = []
+        self._author_names: Set[str] = set()
+        self._quotes: List[Tuple[Quote, str, List[str]]] = []
+        self._fingerprints: List[Fingerprint] = []
+        self._pair_deltas = Counter()
+
+    def add_author(self, fullname: str, **fields) -> None:
+        """
+        The add_author function queues a new author for insertion.
+        Authors that already exist (in the database or earlier in this run) are skipped,
+        unless the loader was created with update_existing.
+
+        :param fullname: The unique name of the author
+        :param **fields: The remaining Author fields
+        :return: None
+        """
+        if fullname in self.author_ids and not (self.update_existing and fullname not in self._author_names):
+            self.stats["authors_skipped"] += 1
+            return
+
+        self.author_ids.setdefault(fullname, None)
+        self._author_names.add(fullname)
+        self._authors.append(Author(fullname=fullname, **{key: value for key, value in fields.items() if value is not None}))
+        if self.auto_flush and len(self._authors) >= self.batch_size:
+            self.flush_authors()
+
+    def add_quote(self, text: str, author_name: str, tag_names: Iterable[str]) -> None:
+        """
+        The add_quote function queues a quote together with the names of its tags.
+        Quotes whose author is unknown are skipped. Tag names are normalized, so tags
+        that only differ in letter case or surrounding spaces are the same tag.
+
+        :param text: The text of the quote
+        :param author_name: The fullname of the quote author
+        :param tag_names: The names of the quote tags
+        :return: None
+        """
+        if author_name not in self.author_ids:
+            self.stats["quotes_skipped"] += 1
+            return
+
+        tag_names = dict.fromkeys(name for name in map(normalize_tag_name, tag_names) if name)
+        fp = fingerprint(text)
+        self._quotes.append((Quote(quote=text, content_hash=fp.content_hash), author_name, list(tag_names)))
+        self._fingerprints.append(fp)
+        if self.auto_flush and len(self._quotes) >= self.batch_size:
+            self.flush_quotes()
+
+    def flush(self) -> None:
+        self.flush_authors()
+        self.flush_quotes()
+
+    def flush_authors(self) -> None:
+        if not self._authors:
+            return
+
+        if self.update_existing and not self.dry_run:
+            with transaction.atomic():
+                Author.objects.bulk_create(
+                    self._authors,
+                    batch_size=self.batch_size,
+                    update_conflicts=True,
+                    unique_fields=["fullname"],
+                    update_fields=["born_date", "born_location", "description"],
+                )
+            # Upserted rows don't get their primary keys back, so resolve them in one query
+            self.author_ids.update(Author.objects.filter(fullname__in=self._author_names).values_list("fullname", "id"))
+        elif not self.dry_run:
+            with transaction.atomic():
+                Author.objects.bulk_create(self._authors, batch_size=self.batch_size)
+            for author in self._authors:
+                self.author_ids[author.fullname] = author.pk
+
+        if not self.dry_run:
+            bump_version(CATALOG, AUTHOR_NAMES, *map(author_scope, self._author_names))
+        self.stats["authors"] += len(self._authors)
+        self._authors = []
+        self._author_names = set()
+        self._report()
+
+    def flush_quotes(self) -> None:
+        if not self._quotes:
+            return
+
+        self.flush_authors()
+        merged = self._drop_duplicates() if self.skip_duplicates else {}
+        tag_names = dict.fromkeys(chain.from_iterable([names for _, _, names in self._quotes] + list(merged.values())))
+        new_tags = [Tag(name=name) for name in tag_names if name not in self.tag_ids]
+
+        if self.dry_run:
+            self.tag_ids.update((tag.name, None) for tag in new_tags)
+        else:
+            with transaction.atomic():
+                if new_tags:
+                    # A tag added concurrently (e.g. on the add tag page) is taken over, so ids are read back
+                    Tag.objects.bulk_create(new_tags, batch_size=self.batch_size, ignore_conflicts=True)
+                    new_tag_names = [tag.name for tag in new_tags]
+                    tags = Tag.objects.alias(name_lower=Lower("name")).filter(name_lower__in=new_tag_names)
+                    self.tag_ids.update(tags.values_list("name", "id"))
+
+                for quote, author_name, _ in self._quotes:
+                    quote.author_id = self.author_ids[author_name]
+                Quote.objects.bulk_create([quote for quote, _, _ in self._quotes], batch_size=self.batch_size)
+                store_fingerprints(((quote.pk, fp) for (quote, _, _), fp in zip(self._quotes, self._fingerprints)), replace=False)
+
+                through = Quote.tags.through
+                rows = [
+                    through(quote_id=quote.pk, tag_id=self.tag_ids[name]) for quote, _, names in self._quotes for name in names
+                ]
+                through.objects.bulk_create(rows, batch_size=self.batch_size)
+                # bulk_create doesn't send post_save or m2m_changed, so the counters and cards are written here
+                adjust_tag_counts(Counter(row.tag_id for row in rows))
+                QuoteCard.objects.bulk_create(
+                    [build_card(quote, author_name, names) for quote, author_name, names in self._quotes],
+                    batch_size=self.batch_size,
+                )
+                index_cards(QuoteCard.objects.filter(pk__in=[quote.pk for quote, _, _ in self._quotes]))
+                self._merge_tags(merged)
+            bump_version(CATALOG, QUOTE_IDS, *([TAG_NAMES] if new_tags else []), *map(tag_scope, tag_names))
+            self._add_pair_deltas(pair_counts([self.tag_ids[name] for name in names] for _, _, names in self._quotes))
+
+        self.stats["tags"] += len(new_tags)
+        self.stats["quotes"] += len(self._quotes)
+        self._quotes = []
+        self._fingerprints = []
+        self._report()
+
+    def flush_related_tags(self) -> None:
+        """
+        The flush_related_tags function records the tag co-occurrence changes of the quotes written so far
+        as a single journal line (see quoteapp.related), instead of one per batch.
+
+        :return: None
+        """
+        related_tags.record(self._pair_deltas)
+        self._pair_deltas = Counter()
+
+    def _add_pair_deltas(self, deltas: Counter) -> None:
+        # Only once the batch is committed, which may be in the transaction of the caller
+        if deltas:
+            transaction.on_commit(lambda: self._pair_deltas.update(deltas))
+
+    def _drop_duplicates(self) -> Dict[int, List[str]]:
+        """
+        The _drop_duplicates function removes the queued quotes that duplicate a stored quote or an earlier
+        queued one, whoever the author is. The tags of a removed quote go to the quote it duplicates.
+
+        :return: The tag names to add to stored quotes, by quote id
+        """
+        merged: Dict[int, List[str]] = defaultdict(list)
+        queued = FingerprintIndex()
+        quotes, fingerprints = [], []
+        for entry, fp, duplicate in zip(self._quotes, self._fingerprints, find_duplicates(self._fingerprints)):
+            if duplicate is not None:
+                merged[duplicate.quote_id].extend(entry[2])
+            else:
+                match = queued.find(fp)
+                if match is None:
+                    queued.add(len(quotes), fp)
+                    quotes.append(entry)
+                    fingerprints.append(fp)
+                    continue
+                names = quotes[match[0]][2]
+                names.extend(name for name in entry[2] if name not in names)
+            self.stats["quotes_duplicate"] += 1
+        self._quotes, self._fingerprints = quotes, fingerprints
+        return merged
+
+    def _merge_tags(self, merged: Dict[int, List[str]]) -> None:
+        through = Quote.tags.through
+        existing = set(through.objects.filter(quote_id__in=merged).values_list("quote_id", "tag_id"))
+        rows = sorted({(quote_id, self.tag_ids[name]) for quote_id, names in merged.items() for name in names} - existing)
+        if not rows:
+            return
+        through.objects.bulk_create(
+            [through(quote_id=quote_id, tag_id=tag_id) for quote_id, tag_id in rows], batch_size=self.batch_size
+        )
+        adjust_tag_counts(Counter(tag_id for _, tag_id in rows))
+        refresh_cards({quote_id for quote_id, _ in rows})
+        self._add_pair_deltas(tag_change_deltas(rows, added=True))
+
+    def _report(self) -> None:
+        if self.progress:
+            self.progress(self.stats)
@@ -0,0 +1,149 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+from django.template.backends.django import Template as DjangoTemplate
+
+logger = logging.getLogger(__name__)
+
+# The same statement (with different parameters) this many times in one request is reported as a likely N+1
+SIMILAR_QUERY_THRESHOLD = 5
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder:
+    """
+    An execute_wrapper that counts and times the SQL statements of one request.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter = Counter()
+        self.executions: Counter = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+            self.executions[(sql, repr(params))] += 1
+
+    def duplicates(self) -> int:
+        return sum(count - 1 for count in self.executions.values() if count > 1)
+
+    def similar(self) -> List[str]:
+        return [sql for sql, count in self.statements.items() if count >= SIMILAR_QUERY_THRESHOLD]
+
+
+class TemplateTimer:
+    """
+    Accumulated render time of the top-level templates of one request. Templates rendered
+    while another one renders (e.g. render_to_string in a template tag) are not counted twice.
+    """
+
+    def __init__(self):
+        self.duration = 0.0
+        self.depth = 0
+
+
+_template_timer: ContextVar[Optional[TemplateTimer]] = ContextVar("template_timer", default=None)
+_original_render = DjangoTemplate.render
+
+
+def timed_render(self, context=None, request=None):
+    timer = _template_timer.get()
+    if timer is None:
+        return _original_render(self, context, request)
+    timer.depth += 1
+    started = time.perf_counter()
+    try:
+        return _original_render(self, context, request)
+    finally:
+        timer.depth -= 1
+        if timer.depth == 0:
+            timer.duration += time.perf_counter() - started
+
+
+def query_budget(view_name: Optional[str]) -> Optional[int]:
+    return settings.QUERY_BUDGETS.get(view_name) if view_name else None
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Opt-in (REQUEST_INSTRUMENTATION = True) per-request measurements: the number and time of the
+    SQL queries, the template render time and the total time. They are sent as a Server-Timing header
+    and logged as one JSON line per request, together with duplicated and likely N+1 queries.
+    Views listed in QUERY_BUDGETS are checked against their query budget; an exceeded budget is
+    logged as a warning, or raises QueryBudgetExceeded when QUERY_BUDGET_STRICT is set (in tests).
+
+    Queries run by lazy querysets while a template renders count towards both db and tpl.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_INSTRUMENTATION", False):
+            raise MiddlewareNotUsed
+        DjangoTemplate.render = timed_render
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        recorder = QueryRecorder()
+        token = _template_timer.set(TemplateTimer())
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                response = self.get_response(request)
+            template_time = _template_timer.get().duration
+        finally:
+            _template_timer.reset(token)
+        total_time = time.perf_counter() - started
+
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        metrics = {
+            "view": view_name,
+            "path": request.path,
+            "method": request.method,
+            "status": response.status_code,
+            "queries": recorder.count,
+            "db_ms": round(recorder.duration * 1000, 2),
+            "template_ms": round(template_time * 1000, 2),
+            "total_ms": round(total_time * 1000, 2),
+            "duplicate_queries": recorder.duplicates(),
+            "similar_queries": recorder.similar(),
+        }
+        response["Server-Timing"] = self.server_timing(metrics)
+        logger.info(json.dumps(metrics))
+
+        budget = query_budget(view_name)
+        if budget is not None and recorder.count > budget:
+            message = f"{view_name} ran {recorder.count} queries, its budget is {budget}"
+            if getattr(settings, "QUERY_BUDGET_STRICT", False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    @staticmethod
+    def server_timing(metrics: Dict) -> str:
+        return ", ".join(
+            [
+                f'db;dur={metrics["db_ms"]};desc="{metrics["queries"]} queries, {metrics["duplicate_queries"]} duplicates"',
+                f"tpl;dur={metrics['template_ms']}",
+                f"total;dur={metrics['total_ms']}",
+            ]
+        )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from quoteapp.related import related_tags
+
+
+class Command(BaseCommand):
+    help = "Build the tag co-occurrence matrix behind the related tags panel from the Quote.tags table"
+
+    def handle(self, *args, **options):
+        cooccurrence = related_tags.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Saved the co-occurrence of {len(cooccurrence.tag_ids)} tags ({cooccurrence.matrix.nnz // 2} related pairs) "
+                f"to {related_tags.path()}"
+            )
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from quoteapp.similar import BLOCK_BYTES, NEIGHBOURS, similar_quotes
+
+
+class Command(BaseCommand):
+    help = "Compute the TF-IDF nearest neighbours of every quote behind the similar quotes pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--refresh", action="store_true", help="Only add the quotes created since the last build")
+        parser.add_argument("--neighbours", type=int, default=NEIGHBOURS, help="Neighbours kept per quote (full builds)")
+        parser.add_argument(
+            "--memory", type=int, default=BLOCK_BYTES // 2**20, help="Memory budget in MiB of one block of similarities"
+        )
+
+    def handle(self, *args, **options):
+        block_bytes = options["memory"] * 2**20
+        if options["refresh"]:
+            model, added = similar_quotes.refresh(block_bytes)
+            if model is None:
+                raise CommandError("There is nothing to refresh, run build_similar_quotes without --refresh first")
+            self.stdout.write(self.style.SUCCESS(f"Added {added} quotes, {len(model.quote_ids)} quotes in total"))
+            return
+
+        model = similar_quotes.rebuild(options["neighbours"], block_bytes)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Saved {options['neighbours']} neighbours of {len(model.quote_ids)} quotes "
+                f"({len(model.vocabulary)} terms) to {similar_quotes.path()}"
+            )
+        )
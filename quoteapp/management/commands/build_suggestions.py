@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from quoteapp.suggestions import suggestions
+
+
+class Command(BaseCommand):
+    help = "Build the search suggestion index of tag names and author full names from the Tag and Author tables"
+
+    def handle(self, *args, **options):
+        index = suggestions.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f"Saved {len(index)} names ({len(index.keys)} prefix keys) to {suggestions.path()}")
+        )
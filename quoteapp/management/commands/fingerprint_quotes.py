@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from quoteapp.fingerprints import fingerprint_all_quotes
+
+
+class Command(BaseCommand):
+    help = "Compute the content fingerprints used to find duplicate quotes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Recompute the fingerprints of quotes that already have one")
+        parser.add_argument("--batch-size", type=int, default=1000, help="How many quotes to process per batch")
+
+    def handle(self, *args, **options):
+        processed = fingerprint_all_quotes(missing_only=not options["all"], chunk_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Fingerprinted {processed} quotes"))
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from quoteapp.benchmarks import DEFAULT_ZIPF_EXPONENT, generate_corpus
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic authors.json/quotes.json corpus for benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--quotes", type=int, default=10_000, help="Number of quotes, e.g. 10000, 100000 or 1000000")
+        parser.add_argument("--authors", type=int, help="Number of authors (default: quotes / 20)")
+        parser.add_argument("--tags", type=int, help="Size of the tag vocabulary (default: quotes / 50)")
+        parser.add_argument("--zipf", type=float, default=DEFAULT_ZIPF_EXPONENT, help="Exponent of the tag distribution")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed")
+        parser.add_argument("--output-dir", default="benchmarks/corpus", help="Where to write the JSON files")
+
+    def handle(self, *args, **options):
+        output_dir = Path(options["output_dir"])
+        counts = generate_corpus(
+            output_dir,
+            quotes=options["quotes"],
+            authors=options["authors"],
+            tags=options["tags"],
+            exponent=options["zipf"],
+            seed=options["seed"],
+            source_dir=Path(settings.BASE_DIR),
+        )
+        summary = f"{counts['authors']} authors and {counts['quotes']} quotes ({counts['tags']} tags)"
+        self.stdout.write(self.style.SUCCESS(f"Wrote {summary} to {output_dir}"))
@@ -1,43 +1,64 @@
-import json
+import time
+
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from quoteapp.models import Author, Quote, Tag
+from quoteapp.importers import BulkLoader, iter_json_array
+from quoteapp.suggestions import suggestions
 
 
 class Command(BaseCommand):
     help = "Import data from JSON files"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--authors", default="authors.json", help="Path to the authors JSON file")
+        parser.add_argument("--quotes", default="quotes.json", help="Path to the quotes JSON file")
+        parser.add_argument("--batch-size", type=int, default=1000, help="How many rows to write per bulk insert")
+        parser.add_argument("--dry-run", action="store_true", help="Parse and resolve the data without writing to the database")
+        parser.add_argument("--keep-duplicates", action="store_true", help="Insert quotes that duplicate an existing quote")
+
     def handle(self, *args, **options):
         self.stdout.write("Importing data from JSON files")
+        self.started = time.perf_counter()
+        loader = BulkLoader(
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+            skip_duplicates=not options["keep_duplicates"],
+            progress=self.report_progress,
+        )
 
-        with open("authors.json", "r") as authors_file:
-            authors_data = json.load(authors_file)
-
-            for author_data in authors_data:
-                author = Author(
+        with open(options["authors"], "r") as authors_file:
+            for author_data in iter_json_array(authors_file):
+                loader.add_author(
                     fullname=author_data["fullname"],
                     born_date=timezone.make_aware(
                         timezone.datetime.strptime(author_data["born_date"], "%B %d, %Y")
                     ) if author_data["born_date"] else None,
                     born_location=author_data["born_location"],
-                    description=author_data["description"]
+                    description=author_data["description"],
                 )
-                author.save()
+        loader.flush_authors()
 
-        with open("quotes.json", "r") as quotes_file:
-            quotes_data = json.load(quotes_file)
+        with open(options["quotes"], "r") as quotes_file:
+            for quote_data in iter_json_array(quotes_file):
+                loader.add_quote(quote_data["quote"], quote_data["author"], quote_data["tags"])
+        loader.flush()
 
-            # Імпортуємо дані про цитати
-            for quote_data in quotes_data:
-                author_name = quote_data["author"]
-                author = Author.objects.get(fullname=author_name)
-
-                tags = [Tag.objects.get_or_create(name=tag)[0] for tag in quote_data["tags"]]
-                quote = Quote(
-                    quote=quote_data["quote"],
-                    author=author
-                )
-                quote.save()
-                quote.tags.set(tags)
+        stats = loader.stats
+        summary = (
+            f"{stats['authors']} authors, {stats['tags']} tags and {stats['quotes']} quotes "
+            f"({stats['authors_skipped']} existing authors, {stats['quotes_skipped']} quotes without author "
+            f"and {stats['quotes_duplicate']} duplicate quotes skipped)"
+        )
+        if options["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"Dry run, nothing was written: {summary}"))
+        else:
+            loader.flush_related_tags()
+            # Bulk inserts send no signals, so the new names are added to the search suggestions by a rebuild
+            if suggestions.path().exists():
+                suggestions.rebuild()
+            self.stdout.write(self.style.SUCCESS(f"Data imported successfully: {summary}"))
 
-        self.stdout.write(self.style.SUCCESS("Data imported successfully"))
+    def report_progress(self, stats):
+        elapsed = time.perf_counter() - self.started
+        rate = stats["quotes"] / elapsed if elapsed else 0
+        self.stdout.write(f"{stats['authors']} authors, {stats['quotes']} quotes in {elapsed:.1f}s ({rate:.0f} quotes/s)")
@@ -1,49 +1,137 @@
-import connect_mongo
+import time
+
+from bson import ObjectId
+from connect_mongo import get_connection
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
 from models_mongo import AuthorM, QuoteM
-from quoteapp.models import Author, Quote, Tag
+from quoteapp.importers import BulkLoader
+from quoteapp.models import ImportCheckpoint
+from quoteapp.suggestions import suggestions
+
+AUTHORS_CHECKPOINT = "mongo:authors"
+QUOTES_CHECKPOINT = "mongo:quotes"
 
 
 class Command(BaseCommand):
     help = "Import data from MongoDB"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="How many documents to read and write per batch")
+        parser.add_argument("--full", action="store_true", help="Ignore the saved high-water marks and copy everything again")
+        parser.add_argument(
+            "--since",
+            type=lambda value: timezone.datetime.fromisoformat(value),
+            help="Only copy documents created after this ISO date (ObjectId timestamp)",
+        )
+        parser.add_argument("--keep-duplicates", action="store_true", help="Insert quotes that duplicate an existing quote")
+
     def handle(self, *args, **options):
         """
         The handle function is the main function of a command. It takes two arguments:
             args - A list of positional arguments passed to the command.
             options - A dictionary of named options passed to the command.
-        
+
+        Documents are read in _id order with batched cursors and projections. After every
+        batch is written, the last copied _id is stored as a high-water mark in the same
+        transaction, so an interrupted sync resumes where it stopped and re-runs copy only new documents.
+
         :param self: Access the class attributes and methods
         :param *args: Pass a non-keyworded, variable-length argument list to the function
         :param **options: Pass in options to the command
         :return: None
         :doc-author: Trelent
         """
+        get_connection()
         self.stdout.write("Connected to MongoDB")
-        authors_mongo = AuthorM.objects()
-        quotes_mongo = QuoteM.objects()
-
-        for author_mongo in authors_mongo:
-            if author_mongo.fullname:
-                author = Author(
-                    fullname=author_mongo.fullname,
-                    born_date=timezone.make_aware(author_mongo.born_date, timezone=timezone.get_current_timezone()),
-                    born_location=author_mongo.born_location,
-                    description=author_mongo.description,
-                )
-                author.save()
+        self.batch_size = options["batch_size"]
+        self.started = time.perf_counter()
+        self.loader = BulkLoader(
+            batch_size=self.batch_size,
+            update_existing=True,
+            skip_duplicates=not options["keep_duplicates"],
+            # Batches are only written by the flush() next to save_position(), in the same transaction
+            auto_flush=False,
+            progress=self.report_progress,
+        )
+
+        since = ObjectId.from_datetime(options["since"]) if options["since"] else None
+        try:
+            self.sync_authors(self.start_position(AUTHORS_CHECKPOINT, since, options["full"]))
+            self.sync_quotes(self.start_position(QUOTES_CHECKPOINT, since, options["full"]))
+        finally:
+            # The committed batches are kept when a run is interrupted, so are their co-occurrence changes
+            self.loader.flush_related_tags()
 
-        for quote_mongo in quotes_mongo:
-            if quote_mongo.author and quote_mongo.author.fullname:
-                author = Author.objects.get(fullname=quote_mongo.author.fullname)
+        # Bulk inserts send no signals, so the new names are added to the search suggestions by a rebuild
+        if suggestions.path().exists():
+            suggestions.rebuild()
+        duplicates = self.loader.stats["quotes_duplicate"]
+        self.stdout.write(self.style.SUCCESS(f"Data imported successfully ({duplicates} duplicate quotes skipped)"))
 
-                tags = [Tag.objects.get_or_create(name=tag)[0] for tag in quote_mongo.tags]
-                quote = Quote(
-                    quote=quote_mongo.content,
-                    author=author,
+    def sync_authors(self, after):
+        projection = {"fullname": 1, "born_date": 1, "born_location": 1, "description": 1}
+        for batch in self.iter_batches(AuthorM._get_collection(), after, projection):
+            for document in batch:
+                if document.get("fullname"):
+                    born_date = document.get("born_date")
+                    self.loader.add_author(
+                        fullname=document["fullname"],
+                        born_date=timezone.make_aware(born_date, timezone=timezone.get_current_timezone()) if born_date else None,
+                        born_location=document.get("born_location"),
+                        description=document.get("description"),
+                    )
+            with transaction.atomic():
+                self.loader.flush_authors()
+                self.save_position(AUTHORS_CHECKPOINT, batch[-1]["_id"])
+
+    def sync_quotes(self, after):
+        authors = AuthorM._get_collection()
+        author_names = {}
+
+        for batch in self.iter_batches(QuoteM._get_collection(), after, {"content": 1, "author": 1, "tags": 1}):
+            # Dereference all authors of the batch with one query instead of one fetch per quote
+            missing = list({document["author"] for document in batch if document.get("author")} - author_names.keys())
+            if missing:
+                author_names.update(
+                    (author["_id"], author.get("fullname")) for author in authors.find({"_id": {"$in": missing}}, {"fullname": 1})
                 )
-                quote.save()
-                quote.tags.set(tags)
 
-        self.stdout.write(self.style.SUCCESS("Data imported successfully"))
+            for document in batch:
+                author_name = author_names.get(document.get("author"))
+                if author_name:
+                    self.loader.add_quote(document["content"], author_name, document.get("tags", []))
+            with transaction.atomic():
+                self.loader.flush()
+                self.save_position(QUOTES_CHECKPOINT, batch[-1]["_id"])
+
+    def iter_batches(self, collection, after, projection):
+        query = {"_id": {"$gt": after}} if after else {}
+        batch = []
+        for document in collection.find(query, projection).sort("_id", 1).batch_size(self.batch_size):
+            batch.append(document)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def start_position(source, since, full):
+        if full:
+            return since
+        checkpoint = ImportCheckpoint.objects.filter(source=source).first()
+        position = ObjectId(checkpoint.position) if checkpoint else None
+        if since and (position is None or since > position):
+            return since
+        return position
+
+    @staticmethod
+    def save_position(source, object_id):
+        ImportCheckpoint.objects.update_or_create(source=source, defaults={"position": str(object_id)})
+
+    def report_progress(self, stats):
+        elapsed = time.perf_counter() - self.started
+        rate = stats["quotes"] / elapsed if elapsed else 0
+        self.stdout.write(f"{stats['authors']} authors, {stats['quotes']} quotes in {elapsed:.1f}s ({rate:.0f} quotes/s)")
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from quoteapp.models import Tag
+from quoteapp.picks import pick_quote_of_the_day
+from quoteapp.tags import TagEntry
+
+
+class Command(BaseCommand):
+    help = "Store the quotes of the day ahead of time, overall and for the most used tags"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=2, help="Number of days to pick for, starting today")
+        parser.add_argument("--tags", type=int, default=100, help="Also pick for this many of the most used tags")
+
+    def handle(self, *args, **options):
+        tags = [None] + [
+            TagEntry(*row)
+            for row in Tag.objects.filter(quote_count__gt=0)
+            .order_by("-quote_count")
+            .values_list("pk", "name", "quote_count")[: options["tags"]]
+        ]
+        today = timezone.localdate()
+        picked = 0
+        for offset in range(options["days"]):
+            for tag in tags:
+                picked += pick_quote_of_the_day(today + timedelta(days=offset), tag) is not None
+        self.stdout.write(self.style.SUCCESS(f"Picked {picked} quotes of the day for {options['days']} days"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from quoteapp.cards import rebuild_all_cards
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized quote cards used by the listing pages"
+
+    def handle(self, *args, **options):
+        processed = rebuild_all_cards()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the cards of {processed} quotes"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from quoteapp.counters import reconcile_tag_counts
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-tag quote counters from the Quote.tags table"
+
+    def handle(self, *args, **options):
+        fixed = reconcile_tag_counts()
+        self.stdout.write(self.style.SUCCESS(f"Tag counters reconciled, {fixed} tags had drifted"))
@@ -0,0 +1,131 @@
+import json
+import resource
+import secrets
+import time
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+from quoteapp.benchmarks import (
+    BENCHMARK_USERNAME,
+    THROUGHPUT_LABELS,
+    asgi_throughput,
+    benchmark_targets,
+    benchmark_url,
+    compare_results,
+    corpus_counts,
+    wsgi_throughput,
+)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the import commands and every URL of the site, and save the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corpus-dir", help="Import the authors.json and quotes.json of this directory first")
+        parser.add_argument("--mongo", action="store_true", help="Also benchmark a full import_data_from_mongo run")
+        parser.add_argument("--requests", type=int, default=50, help="Timed requests per URL")
+        parser.add_argument("--warmup", type=int, default=5, help="Untimed requests per URL made first")
+        parser.add_argument("--cold", action="store_true", help="Clear the cache before every request")
+        parser.add_argument("--only", nargs="*", help="Only benchmark the URLs with these labels")
+        parser.add_argument(
+            "--throughput", action="store_true", help="Also compare the throughput of the read pages under WSGI and ASGI"
+        )
+        parser.add_argument("--concurrency", type=int, default=64, help="Requests in flight at a time in the throughput runs")
+        parser.add_argument(
+            "--throughput-requests", type=int, default=1000, help="Requests per page and interface in the throughput runs"
+        )
+        parser.add_argument("--output", help="Where to write the results (default: benchmarks/results-<timestamp>.json)")
+        parser.add_argument("--baseline", help="Results of an earlier run to compare against")
+        parser.add_argument("--threshold", type=float, default=0.2, help="Relative p95 slowdown reported as a regression")
+
+    def handle(self, *args, **options):
+        results = {
+            "started_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "options": {key: options[key] for key in ("requests", "warmup", "cold", "concurrency", "throughput_requests")},
+            "imports": {},
+            "urls": {},
+            "throughput": {},
+        }
+
+        if options["corpus_dir"]:
+            corpus_dir = Path(options["corpus_dir"])
+            results["imports"]["json"] = self.time_command(
+                "import_data_from_json", authors=str(corpus_dir / "authors.json"), quotes=str(corpus_dir / "quotes.json")
+            )
+        if options["mongo"]:
+            results["imports"]["mongo"] = self.time_command("import_data_from_mongo", full=True)
+        results["corpus"] = corpus_counts()
+
+        # A fresh user, so deleting it afterwards can't take an existing account (and its data) with it
+        user = User.objects.create(username=f"{BENCHMARK_USERNAME}-{secrets.token_hex(4)}", is_staff=True)
+        client = Client(SERVER_NAME=self.server_name())
+        targets, skipped = benchmark_targets(user)
+        try:
+            for target in targets:
+                if options["only"] and target[0] not in options["only"]:
+                    continue
+                result = benchmark_url(client, user, target, options["requests"], options["warmup"], options["cold"])
+                results["urls"][target[0]] = result
+                self.stdout.write(
+                    f"{target[0]:<24} {result['status']} p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+                    f"p99 {result['p99_ms']:>9.2f} ms  {result['queries']:>3} queries  {result['peak_memory_kib']:>9.1f} KiB"
+                )
+            if options["throughput"]:
+                for label, path, _ in targets:
+                    if label in THROUGHPUT_LABELS and (not options["only"] or label in options["only"]):
+                        results["throughput"][label] = self.compare_interfaces(
+                            label, path, options["concurrency"], options["throughput_requests"]
+                        )
+        finally:
+            user.delete()
+        results["skipped_urls"] = skipped
+        for name in skipped:
+            self.stderr.write(f"No benchmark for URL {name}")
+
+        output = Path(options["output"] or f"benchmarks/results-{timezone.now():%Y%m%d-%H%M%S}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+        if options["baseline"]:
+            regressions = compare_results(results, json.loads(Path(options["baseline"]).read_text()), options["threshold"])
+            for line in regressions:
+                self.stdout.write(self.style.WARNING(f"Regression: {line}"))
+            if regressions:
+                raise CommandError(f"{len(regressions)} regressions against {options['baseline']}")
+
+    def compare_interfaces(self, label, path, concurrency, requests):
+        results = {}
+        for interface, measure in (("wsgi", wsgi_throughput), ("asgi", asgi_throughput)):
+            # Warm the caches with the same requests first, so both interfaces are measured warm
+            measure(path, concurrency, min(requests, concurrency), self.server_name())
+            results[interface] = result = measure(path, concurrency, requests, self.server_name())
+            self.stdout.write(
+                f"{label:<10} {interface} x{concurrency:<5} {result['requests_per_second']:>9.1f} req/s  "
+                f"p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  {result['errors']} errors"
+            )
+        return results
+
+    @staticmethod
+    def time_command(name, **options):
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        call_command(name, stdout=StringIO(), **options)
+        return {
+            "seconds": round(time.perf_counter() - started, 3),
+            # ru_maxrss is the peak of the whole process, so only its growth is attributed to the import
+            "peak_rss_growth_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before,
+        }
+
+    @staticmethod
+    def server_name():
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != "*"]
+        return hosts[0].lstrip(".") if hosts else "localhost"
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("quoteapp", "0002_alter_author_born_date"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("source", models.CharField(max_length=50, unique=True)),
+                ("position", models.CharField(max_length=50)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
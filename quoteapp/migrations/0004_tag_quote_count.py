@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_quotes(apps, schema_editor):
+    Quote = apps.get_model("quoteapp", "Quote")
+    Tag = apps.get_model("quoteapp", "Tag")
+    counts = (
+        Quote.tags.through.objects.filter(tag_id=OuterRef("pk"))
+        .values("tag_id")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    Tag.objects.update(quote_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("quoteapp", "0003_importcheckpoint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tag",
+            name="quote_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="tag",
+            index=models.Index(
+                fields=["-quote_count"], name="quoteapp_tag_quote_count_idx"
+            ),
+        ),
+        migrations.RunPython(count_quotes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_cards(apps, schema_editor):
+    Quote = apps.get_model("quoteapp", "Quote")
+    QuoteCard = apps.get_model("quoteapp", "QuoteCard")
+    quotes = (
+        Quote.objects.select_related("author").prefetch_related("tags").order_by("pk")
+    )
+    cards = []
+    for quote in quotes.iterator(chunk_size=1000):
+        cards.append(
+            QuoteCard(
+                quote_id=quote.pk,
+                text=quote.quote,
+                author_name=quote.author.fullname,
+                tag_names=sorted(tag.name for tag in quote.tags.all()),
+            )
+        )
+        if len(cards) >= 1000:
+            QuoteCard.objects.bulk_create(cards)
+            cards = []
+    QuoteCard.objects.bulk_create(cards)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("quoteapp", "0004_tag_quote_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QuoteCard",
+            fields=[
+                (
+                    "quote",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="card",
+                        serialize=False,
+                        to="quoteapp.quote",
+                    ),
+                ),
+                ("text", models.CharField()),
+                ("author_name", models.CharField(max_length=50)),
+                ("tag_names", models.JSONField(default=list)),
+            ],
+        ),
+        migrations.RunPython(build_cards, migrations.RunPython.noop),
+    ]
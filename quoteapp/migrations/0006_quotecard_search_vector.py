@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:10
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # GIN and tsvector are PostgreSQL only; other databases use the fallback in quoteapp.search
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "CREATE INDEX quoteapp_quotecard_search_idx ON quoteapp_quotecard USING gin (search_vector)"
+    )
+    schema_editor.execute(
+        "UPDATE quoteapp_quotecard SET search_vector = "
+        "setweight(to_tsvector('english', author_name), 'A') || "
+        "setweight(to_tsvector('english', tag_names::text), 'B') || "
+        "setweight(to_tsvector('english', text), 'C')"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS quoteapp_quotecard_search_idx")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("quoteapp", "0005_quotecard"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="quotecard",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("quoteapp", "0006_quotecard_search_vector"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="quotecard",
+            name="version",
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
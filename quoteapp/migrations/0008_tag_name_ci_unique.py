@@ -0,0 +1,92 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:31
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import F
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    """
+    Merges the tags whose names only differ in letter case or surrounding spaces into the one
+    with the lowest id, in set-based SQL: Quote.tags rows are moved to the surviving tag (dropping
+    the rows that would become duplicates), the other tags are deleted, the names are normalized and
+    the quote counts and the cards of the affected quotes, search vectors included, are recomputed.
+    Cards are rebuilt like in migrations 0005 and 0006, the app code can't be used from a migration.
+    """
+    Quote = apps.get_model("quoteapp", "Quote")
+    Tag = apps.get_model("quoteapp", "Tag")
+    QuoteCard = apps.get_model("quoteapp", "QuoteCard")
+    qn = schema_editor.quote_name
+    tag_table = qn(Tag._meta.db_table)
+    through_table = qn(Quote.tags.through._meta.db_table)
+    canonical = "LOWER(TRIM({}.name))"
+    duplicate_tag_ids = (
+        f"SELECT t.id FROM {tag_table} t WHERE EXISTS "
+        f"(SELECT 1 FROM {tag_table} c WHERE {canonical.format('c')} = {canonical.format('t')} AND c.id < t.id)"
+    )
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT quote_id FROM {through_table} WHERE tag_id IN ({duplicate_tag_ids}) "
+            f"OR tag_id IN (SELECT id FROM {tag_table} WHERE name <> LOWER(TRIM(name)))"
+        )
+        quote_ids = [row[0] for row in cursor.fetchall()]
+
+        # A quote tagged with several spellings keeps only the row of the lowest tag id
+        cursor.execute(
+            f"DELETE FROM {through_table} WHERE id IN ("
+            f"SELECT r.id FROM {through_table} r JOIN {tag_table} t ON t.id = r.tag_id WHERE EXISTS ("
+            f"SELECT 1 FROM {through_table} o JOIN {tag_table} c ON c.id = o.tag_id "
+            f"WHERE o.quote_id = r.quote_id AND {canonical.format('c')} = {canonical.format('t')} AND c.id < t.id))"
+        )
+        cursor.execute(
+            f"UPDATE {through_table} SET tag_id = ("
+            f"SELECT MIN(c.id) FROM {tag_table} c JOIN {tag_table} t ON {canonical.format('c')} = {canonical.format('t')} "
+            f"WHERE t.id = {through_table}.tag_id) "
+            f"WHERE tag_id IN ({duplicate_tag_ids})"
+        )
+        cursor.execute(f"DELETE FROM {tag_table} WHERE id IN ({duplicate_tag_ids})")
+        cursor.execute(f"UPDATE {tag_table} SET name = LOWER(TRIM(name)) WHERE name <> LOWER(TRIM(name))")
+        cursor.execute(
+            f"UPDATE {tag_table} SET quote_count = (SELECT COUNT(*) FROM {through_table} r WHERE r.tag_id = {tag_table}.id) "
+            f"WHERE quote_count <> (SELECT COUNT(*) FROM {through_table} r WHERE r.tag_id = {tag_table}.id)"
+        )
+        if schema_editor.connection.vendor == "postgresql":
+            # Run the deferred foreign key checks of the merge now, PostgreSQL won't index a table with pending ones
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+    cards = []
+    quotes = Quote.objects.filter(pk__in=quote_ids).prefetch_related("tags").order_by("pk")
+    for quote in quotes.iterator(chunk_size=1000):
+        cards.append(
+            QuoteCard(quote_id=quote.pk, tag_names=sorted(tag.name for tag in quote.tags.all()), version=F("version") + 1)
+        )
+    QuoteCard.objects.bulk_update(cards, ["tag_names", "version"], batch_size=1000)
+
+    # The tag names are part of the search vector, see migration 0006; PostgreSQL only
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for start in range(0, len(quote_ids), 1000):
+            cursor.execute(
+                f"UPDATE {qn(QuoteCard._meta.db_table)} SET search_vector = "
+                "setweight(to_tsvector('english', author_name), 'A') || "
+                "setweight(to_tsvector('english', tag_names::text), 'B') || "
+                "setweight(to_tsvector('english', text), 'C') "
+                "WHERE quote_id = ANY(%s)",
+                [quote_ids[start : start + 1000]],
+            )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("quoteapp", "0007_quotecard_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="tag",
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower("name"), name="quoteapp_tag_name_ci_unique"),
+        ),
+    ]
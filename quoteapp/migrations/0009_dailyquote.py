@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("quoteapp", "0008_tag_name_ci_unique"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyQuote",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("day", models.DateField()),
+                ("tag_name", models.CharField(blank=True, default="", max_length=50)),
+                ("quote", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="quoteapp.quote")),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="dailyquote",
+            constraint=models.UniqueConstraint(fields=("day", "tag_name"), name="quoteapp_dailyquote_day_tag_unique"),
+        ),
+    ]
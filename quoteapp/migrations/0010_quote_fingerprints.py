@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("quoteapp", "0009_dailyquote"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="quote",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, default="", max_length=64),
+        ),
+        migrations.CreateModel(
+            name="QuoteBucket",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("bucket", models.BigIntegerField(db_index=True)),
+                (
+                    "quote",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="buckets", to="quoteapp.quote"),
+                ),
+            ],
+        ),
+    ]
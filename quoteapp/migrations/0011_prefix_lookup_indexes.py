@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:32
+
+from django.db import migrations, models
+
+
+def create_author_prefix_index(apps, schema_editor):
+    # The author picker looks up lower(fullname) LIKE 'prefix%', which needs a pattern_ops index; PostgreSQL only
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "CREATE INDEX quoteapp_author_fullname_prefix_idx ON quoteapp_author (lower(fullname) text_pattern_ops)"
+    )
+
+
+def drop_author_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS quoteapp_author_fullname_prefix_idx")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("quoteapp", "0010_quote_fingerprints"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="tag",
+            name="name",
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+        migrations.RunPython(create_author_prefix_index, drop_author_prefix_index),
+    ]
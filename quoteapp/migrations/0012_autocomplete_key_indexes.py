@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:05
+
+from django.db import migrations
+
+
+def create_key_indexes(apps, schema_editor):
+    # The pickers match, order and page by (key COLLATE "C", id), see quoteapp.autocomplete; PostgreSQL only
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS quoteapp_author_fullname_prefix_idx")
+    schema_editor.execute(
+        'CREATE INDEX quoteapp_author_fullname_prefix_idx ON quoteapp_author ((lower(fullname) COLLATE "C"), id)'
+    )
+    schema_editor.execute('CREATE INDEX quoteapp_tag_name_prefix_idx ON quoteapp_tag ((name COLLATE "C"), id)')
+
+
+def drop_key_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS quoteapp_tag_name_prefix_idx")
+    schema_editor.execute("DROP INDEX IF EXISTS quoteapp_author_fullname_prefix_idx")
+    schema_editor.execute(
+        "CREATE INDEX quoteapp_author_fullname_prefix_idx ON quoteapp_author (lower(fullname) text_pattern_ops)"
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("quoteapp", "0011_prefix_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_key_indexes, drop_key_indexes),
+    ]
@@ -0,0 +1,98 @@
+"""
+Precomputed NumPy models (related tags, similar quotes) saved to files.
+
+Every process loads a model file once, and again only when another process replaced it. Writers hold an
+exclusive lock on a sibling .lock file, replace the model file atomically and bump the version scope of
+the model, so the pages that show it are revalidated.
+"""
+import fcntl
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Generic, Iterator, Optional, Tuple, TypeVar
+
+import numpy as np
+from django.conf import settings
+
+from .versions import bump_version
+
+M = TypeVar("M")
+
+
+def save_arrays(path: Path, **arrays) -> None:
+    """
+    The save_arrays function writes NumPy arrays to an .npz file through a temporary file,
+    so readers see either the old or the new file, never a partly written one.
+
+    :param path: The file to replace
+    :param **arrays: The arrays to save, by name
+    :return: None
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as fp:
+        np.savez(fp, **arrays)
+    os.replace(fp.name, path)
+
+
+class ModelFile(Generic[M]):
+    """
+    The model of this process, kept in step with the file named by a setting.
+    Models have a version attribute and a save(path) method; load(path) reads one back.
+    """
+
+    def __init__(self, setting: str, load: Callable[[Path], M], scope: str):
+        self.setting = setting
+        self.load = load
+        self.scope = scope
+        self._model: Optional[M] = None
+        self._loaded: Optional[Tuple] = None
+        self._lock = threading.Lock()
+
+    def path(self) -> Path:
+        return Path(getattr(settings, self.setting))
+
+    def current(self) -> Optional[M]:
+        """
+        The current function returns the model of the file, loading it when the file
+        was replaced since the last call. It costs one stat() when nothing changed.
+
+        :return: The model, or None when it was never built
+        """
+        path = self.path()
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        loaded = (str(path), stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            if loaded != self._loaded:
+                self._model = self.load(path)
+                self._loaded = loaded
+            return self._model
+
+    @contextmanager
+    def file_lock(self) -> Iterator[None]:
+        path = self.path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path.with_suffix(".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def replace(self, model: M) -> None:
+        """
+        The replace function saves a new model to the file; callers hold file_lock().
+
+        :param model: The new model
+        :return: None
+        """
+        path = self.path()
+        model.version = time.time_ns()
+        model.save(path)
+        stat = path.stat()
+        with self._lock:
+            self._model = model
+            self._loaded = (str(path), stat.st_ino, stat.st_mtime_ns)
+        bump_version(self.scope)
@@ -1,9 +1,23 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Lower
 from django.utils import timezone
 
 
+def normalize_tag_name(name: str) -> str:
+    """
+    The normalize_tag_name function returns the canonical form of a tag name: stripped and lowercased.
+    Tag names are unique in this form, see the quoteapp_tag_name_ci_unique constraint.
+
+    :param name: A tag name as typed or imported
+    :return: The canonical tag name
+    """
+    return name.strip().lower()
+
+
 # Create your models here.
 class Author(models.Model):
+    # Prefix lookups of the author picker use the (lower(fullname), id) index of migration 0012 on PostgreSQL
     fullname = models.CharField(max_length=50, unique=True, null=False)
     born_date = models.DateTimeField(default=timezone.now)
     born_location = models.CharField(max_length=150, null=False)
@@ -14,16 +28,86 @@ class Author(models.Model):
 
 
 class Tag(models.Model):
-    name = models.CharField(max_length=50, null=False)
+    # Names are stored lowercased, so the prefix lookups of the tag picker use this index
+    # (the (name, id) index of migration 0012 on PostgreSQL), see quoteapp.autocomplete
+    name = models.CharField(max_length=50, null=False, db_index=True)
+    # Maintained by quoteapp.signals and the import commands, see quoteapp.counters
+    quote_count = models.PositiveIntegerField(default=0, null=False)
+
+    class Meta:
+        indexes = [models.Index(fields=["-quote_count"], name="quoteapp_tag_quote_count_idx")]
+        # Also the index of tag lookups by name, see quoteapp.tags
+        constraints = [models.UniqueConstraint(Lower("name"), name="quoteapp_tag_name_ci_unique")]
 
     def __str__(self):
         return f"{self.name}"
 
+    def save(self, *args, **kwargs):
+        self.name = normalize_tag_name(self.name)
+        super().save(*args, **kwargs)
+
 
 class Quote(models.Model):
     quote = models.CharField(null=False)
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
     tags = models.ManyToManyField(Tag)
+    # SHA-256 of the normalized text, see quoteapp.fingerprints
+    content_hash = models.CharField(max_length=64, blank=True, default="", db_index=True)
+
+    def __str__(self):
+        return self.quote
+
+
+class QuoteBucket(models.Model):
+    """
+    A locality-sensitive hash bucket of a quote text; quotes sharing a bucket are near duplicate candidates.
+    Every quote has one row per band, see quoteapp.fingerprints.
+    """
+
+    quote = models.ForeignKey(Quote, on_delete=models.CASCADE, related_name="buckets")
+    bucket = models.BigIntegerField(db_index=True)
+
+
+class QuoteCard(models.Model):
+    """
+    Read model of a quote as it is rendered in the listings: the text, the author name and the
+    tag names in one row, so a page of quotes is a single query. Kept in sync by quoteapp.cards.
+    """
+
+    quote = models.OneToOneField(Quote, on_delete=models.CASCADE, primary_key=True, related_name="card")
+    text = models.CharField(null=False)
+    author_name = models.CharField(max_length=50, null=False)
+    tag_names = models.JSONField(default=list)
+    # Bumped on every change of the card, used to key its cached HTML fragment
+    version = models.PositiveIntegerField(default=1, null=False)
+    # Weighted tsvector for quoteapp.search; its GIN index is created by migration 0006 on PostgreSQL only
+    search_vector = SearchVectorField(null=True)
+
+    def __str__(self):
+        return self.text
+
+
+class ImportCheckpoint(models.Model):
+    source = models.CharField(max_length=50, unique=True, null=False)
+    position = models.CharField(max_length=50, null=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source}: {self.position}"
+
+
+class DailyQuote(models.Model):
+    """
+    The quote of the day, overall (tag_name "") and per tag. Picks are deterministic for a day and
+    stored once, so they don't change when quotes are added during the day, see quoteapp.picks.
+    """
+
+    day = models.DateField(null=False)
+    tag_name = models.CharField(max_length=50, blank=True, default="", null=False)
+    quote = models.ForeignKey(Quote, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["day", "tag_name"], name="quoteapp_dailyquote_day_tag_unique")]
 
     def __str__(self):
-        return self.quote
\ No newline at end of file
+        return f"{self.day} {self.tag_name}: {self.quote_id}"
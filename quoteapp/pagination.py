@@ -0,0 +1,214 @@
+import base64
+import binascii
+import json
+from typing import Dict, List, Optional, Type
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.db.models import Model, QuerySet
+
+PER_PAGE = 10
+
+
+def encode_cursor(**payload) -> str:
+    """
+    The encode_cursor function packs a pagination position into an opaque, URL-safe token.
+
+    :param **payload: The position, e.g. after=<id> or before=<id>
+    :return: The token
+    """
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: Optional[str]) -> dict:
+    """
+    The decode_cursor function unpacks a token made by encode_cursor.
+    Missing or malformed tokens are treated as the first page.
+
+    :param token: The token from the query string
+    :return: The position as a dict, empty for the first page
+    """
+    if not token:
+        return {}
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (binascii.Error, ValueError):
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+def estimate_count(model: Type[Model]) -> Optional[int]:
+    """
+    The estimate_count function returns a cheap row count for a whole table.
+    On PostgreSQL it reads the planner statistics from pg_class instead of running COUNT(*); a table that was
+    never analyzed (reltuples is -1 since PostgreSQL 14) has no estimate. Other databases fall back to an exact count.
+
+    :param model: The model whose table to count
+    :return: The (estimated) number of rows, or None when there is no estimate
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row and row[0] >= 0 else None
+    return model.objects.count()
+
+
+async def aestimate_count(model: Type[Model]) -> Optional[int]:
+    if connection.vendor == "postgresql":
+        return await sync_to_async(estimate_count)(model)
+    return await model.objects.acount()
+
+
+class CursorPage:
+    """
+    One page of a KeysetPaginator, with opaque tokens for the neighbouring pages.
+    """
+
+    def __init__(
+        self, object_list: List, next_cursor: Optional[str], previous_cursor: Optional[str], estimated_total: Optional[int]
+    ):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.estimated_total = estimated_total
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by its primary key instead of LIMIT/OFFSET.
+    Every page is a single index range scan of per_page + 1 rows, so deep pages cost
+    the same as the first one and no COUNT(*) is needed.
+    """
+
+    def __init__(self, queryset: QuerySet, per_page: int = PER_PAGE, estimated_total: Optional[int] = None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.estimated_total = estimated_total
+
+    def get_page(self, cursor: Optional[str]) -> CursorPage:
+        """
+        The get_page function returns the page that the cursor token points at.
+        An "after" cursor reads forwards from the given id, a "before" cursor reads backwards
+        and reverses the rows, so both directions use the same index.
+
+        :param cursor: A token from a previous page, or None for the first page
+        :return: The page
+        """
+        position = decode_cursor(cursor)
+        before = position.get("before")
+        after = position.get("after")
+
+        if isinstance(before, int):
+            rows = list(self._before(before))
+            if rows:
+                return self._before_page(rows)
+            after = None
+
+        return self._after_page(list(self._after(after)), after)
+
+    async def aget_page(self, cursor: Optional[str]) -> CursorPage:
+        """
+        The aget_page function is get_page with the async ORM API.
+
+        :param cursor: A token from a previous page, or None for the first page
+        :return: The page
+        """
+        position = decode_cursor(cursor)
+        before = position.get("before")
+        after = position.get("after")
+
+        if isinstance(before, int):
+            rows = [row async for row in self._before(before)]
+            if rows:
+                return self._before_page(rows)
+            after = None
+
+        return self._after_page([row async for row in self._after(after)], after)
+
+    def cursor_for_page(self, number: int) -> Optional[str]:
+        """
+        The cursor_for_page function translates an old page number into a cursor.
+        It only scans the primary key index, so it is meant for redirecting legacy /<page> links.
+
+        :param number: The 1-based page number
+        :return: The cursor of that page, or None for the first (or a non-existent) page
+        """
+        if number <= 1:
+            return None
+        offset = (number - 1) * self.per_page
+        last_ids = list(self.queryset.order_by("pk").values_list("pk", flat=True)[offset - 1 : offset])
+        return encode_cursor(after=last_ids[0]) if last_ids else None
+
+    def _before(self, before: int) -> QuerySet:
+        return self.queryset.filter(pk__lt=before).order_by("-pk")[: self.per_page + 1]
+
+    def _after(self, after) -> QuerySet:
+        queryset = self.queryset.filter(pk__gt=after) if isinstance(after, int) else self.queryset
+        return queryset.order_by("pk")[: self.per_page + 1]
+
+    def _before_page(self, rows: List) -> CursorPage:
+        has_previous = len(rows) > self.per_page
+        return self._page(rows[: self.per_page][::-1], has_next=True, has_previous=has_previous)
+
+    def _after_page(self, rows: List, after) -> CursorPage:
+        has_next = len(rows) > self.per_page
+        return self._page(rows[: self.per_page], has_next=has_next, has_previous=isinstance(after, int) and bool(rows))
+
+    def _page(self, rows: List, has_next: bool, has_previous: bool) -> CursorPage:
+        return CursorPage(
+            rows,
+            next_cursor=encode_cursor(after=rows[-1].pk) if has_next and rows else None,
+            previous_cursor=encode_cursor(before=rows[0].pk) if has_previous and rows else None,
+            estimated_total=self.estimated_total,
+        )
+
+
+class IdListPaginator:
+    """
+    Paginates an already ordered list of ids, e.g. ranked search results.
+    The cursor holds the position in the list and only the ids of the current page are loaded.
+    """
+
+    def __init__(self, ids: List[int], queryset: QuerySet, per_page: int = PER_PAGE):
+        self.ids = ids
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def get_page(self, cursor: Optional[str]) -> CursorPage:
+        offset = self._offset(cursor)
+        page_ids = self.ids[offset : offset + self.per_page]
+        return self._page(offset, page_ids, self.queryset.in_bulk(page_ids))
+
+    async def aget_page(self, cursor: Optional[str]) -> CursorPage:
+        offset = self._offset(cursor)
+        page_ids = self.ids[offset : offset + self.per_page]
+        return self._page(offset, page_ids, await self.queryset.ain_bulk(page_ids))
+
+    def _offset(self, cursor: Optional[str]) -> int:
+        offset = decode_cursor(cursor).get("offset")
+        return offset if isinstance(offset, int) and 0 <= offset < len(self.ids) else 0
+
+    def _page(self, offset: int, page_ids: List[int], objects: Dict) -> CursorPage:
+        has_next = offset + self.per_page < len(self.ids)
+        return CursorPage(
+            [objects[pk] for pk in page_ids if pk in objects],
+            next_cursor=encode_cursor(offset=offset + self.per_page) if has_next else None,
+            previous_cursor=encode_cursor(offset=max(offset - self.per_page, 0)) if offset else None,
+            estimated_total=len(self.ids),
+        )
+
+    def cursor_for_page(self, number: int) -> Optional[str]:
+        return encode_cursor(offset=(number - 1) * self.per_page) if number > 1 else None
@@ -0,0 +1,132 @@
+"""
+Random quotes and quotes of the day in constant time.
+
+Every process keeps dense NumPy arrays of quote ids, one of all quotes and one per recently used tag, so a pick
+is an index into an array plus a primary key lookup of the card. An array is reloaded when the version scope of
+its quotes moves: QUOTE_IDS is bumped when quotes are created or deleted, a tag scope whenever the quotes of the
+tag change. An array read from a replica right after a change is used but not kept, see quotes.routers.
+
+The quote of the day is a deterministic function of the day, the tag and the array, stored in DailyQuote the
+first time it is needed (or ahead of time by the pick_quotes_of_the_day command), so it stays the same all day.
+"""
+import hashlib
+import random
+from collections import OrderedDict
+from datetime import date
+from threading import Lock
+from typing import Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from quotes.routers import may_be_stale
+
+from .models import DailyQuote, Quote, QuoteCard
+from .tags import TagEntry
+from .versions import QUOTE_IDS, get_versions, tag_scope
+
+# A random pick retries when the quote was deleted after the ids were loaded in this process
+PICK_ATTEMPTS = 3
+
+
+class QuoteIdPools:
+    """
+    A process-local LRU cache of dense quote id arrays: all quotes (key None) and the quotes of a tag (key tag id).
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._pools: OrderedDict[Optional[int], Tuple[Tuple[int, float], np.ndarray]] = OrderedDict()
+        self._lock = Lock()
+
+    def ids(self, tag: Optional[TagEntry] = None) -> np.ndarray:
+        """
+        The ids function returns the ids of all quotes, or of the quotes of a tag, in ascending order.
+
+        :param tag: The tag, None for all quotes
+        :return: The quote ids
+        """
+        key = tag.id if tag else None
+        scope = tag_scope(tag.name) if tag else QUOTE_IDS
+        version = get_versions([scope])[scope]
+        with self._lock:
+            cached = self._pools.get(key)
+            if cached and cached[0] == version:
+                self._pools.move_to_end(key)
+                return cached[1]
+
+        if tag is None:
+            rows = QuoteCard.objects.order_by("pk").values_list("pk", flat=True)
+        else:
+            rows = Quote.tags.through.objects.filter(tag_id=tag.id).order_by("quote_id").values_list("quote_id", flat=True)
+        ids = np.fromiter(rows.iterator(chunk_size=10000), dtype=np.int64)
+        if may_be_stale(version[1]):
+            return ids
+
+        with self._lock:
+            self._pools[key] = (version, ids)
+            self._pools.move_to_end(key)
+            while len(self._pools) > self.max_size:
+                self._pools.popitem(last=False)
+        return ids
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pools.clear()
+
+
+quote_id_pools = QuoteIdPools(getattr(settings, "QUOTE_ID_POOLS", 256))
+
+
+def random_quote(tag: Optional[TagEntry] = None) -> Optional[QuoteCard]:
+    """
+    The random_quote function returns the card of a uniformly random quote, optionally of a tag.
+
+    :param tag: The tag to pick from, None for all quotes
+    :return: The card, or None when there are no quotes
+    """
+    for _ in range(PICK_ATTEMPTS):
+        ids = quote_id_pools.ids(tag)
+        if not len(ids):
+            return None
+        card = QuoteCard.objects.filter(pk=int(ids[random.randrange(len(ids))])).first()
+        if card is not None:
+            return card
+    return None
+
+
+def daily_index(day: date, tag_name: str, size: int) -> int:
+    digest = hashlib.sha256(f"{day.isoformat()}:{tag_name}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") % size
+
+
+def pick_quote_of_the_day(day: date, tag: Optional[TagEntry] = None) -> Optional[int]:
+    """
+    The pick_quote_of_the_day function stores the quote of the day of a tag (or overall), unless it already is.
+    When two processes pick at the same time the first stored pick wins.
+
+    :param day: The day
+    :param tag: The tag, None for the overall quote of the day
+    :return: The id of the picked quote, or None when there are no quotes
+    """
+    ids = quote_id_pools.ids(tag)
+    if not len(ids):
+        return None
+    tag_name = tag.name if tag else ""
+    quote_id = int(ids[daily_index(day, tag_name, len(ids))])
+    DailyQuote.objects.bulk_create([DailyQuote(day=day, tag_name=tag_name, quote_id=quote_id)], ignore_conflicts=True)
+    return quote_id
+
+
+def quote_of_the_day(day: date, tag: Optional[TagEntry] = None) -> Optional[QuoteCard]:
+    """
+    The quote_of_the_day function returns the card of the quote of the day, picking it on first use.
+
+    :param day: The day
+    :param tag: The tag, None for the overall quote of the day
+    :return: The card, or None when there are no quotes
+    """
+    cards = QuoteCard.objects.filter(quote__dailyquote__day=day, quote__dailyquote__tag_name=tag.name if tag else "")
+    card = cards.first()
+    if card is None and pick_quote_of_the_day(day, tag) is not None:
+        card = cards.first()
+    return card
@@ -0,0 +1,268 @@
+"""
+Related tags from a precomputed tag co-occurrence matrix.
+
+The matrix counts, for every pair of tags, the quotes tagged with both. It is built from the Quote.tags table
+by the build_related_tags command and saved to RELATED_TAGS_FILE, see quoteapp.modelfiles. Changes of quote
+tags are appended as pair count deltas to a journal next to the file once their transaction commits, one line
+per change (or per import run), so the matrix file itself is only written by a rebuild. Every process adds the
+new lines of the journal to its copy of the matrix when it reads it; rebuilding folds the journal in.
+Until the file has been built nothing is recorded.
+"""
+import json
+import os
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from itertools import chain, permutations
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+import numpy as np
+from django.db import transaction
+from scipy import sparse
+
+from .modelfiles import ModelFile, save_arrays
+from .models import Quote
+from .versions import RELATED_TAGS, bump_version
+
+PairCounts = Mapping[Tuple[int, int], int]
+
+
+class CooccurrenceMatrix:
+    """
+    Symmetric tag x tag matrix of the number of quotes two tags share, with an empty diagonal.
+    Row and column i belong to the tag tag_ids[i]. Instances are never modified, so readers need no lock.
+    """
+
+    def __init__(self, tag_ids: np.ndarray, matrix: sparse.csr_matrix, version: int = 0):
+        self.tag_ids = tag_ids
+        self.matrix = matrix
+        self.version = version
+        self.index: Dict[int, int] = {tag_id: i for i, tag_id in enumerate(tag_ids.tolist())}
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, int]]) -> "CooccurrenceMatrix":
+        """
+        The from_rows function builds the matrix from (quote id, tag id) rows as X.T @ X,
+        where X is the sparse quote x tag incidence matrix.
+
+        :param rows: The rows of the Quote.tags table
+        :return: The co-occurrence matrix
+        """
+        pairs = np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(-1, 2)
+        _, quote_index = np.unique(pairs[:, 0], return_inverse=True)
+        tag_ids, tag_index = np.unique(pairs[:, 1], return_inverse=True)
+        incidence = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.int32), (quote_index, tag_index)), shape=(quote_index.max(initial=-1) + 1, len(tag_ids))
+        )
+        matrix = (incidence.T @ incidence).tocsr()
+        matrix.setdiag(0)
+        matrix.eliminate_zeros()
+        return cls(tag_ids, matrix)
+
+    @classmethod
+    def load(cls, path: Path) -> "CooccurrenceMatrix":
+        with np.load(path) as data:
+            size = len(data["tag_ids"])
+            matrix = sparse.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=(size, size))
+            return cls(data["tag_ids"], matrix, int(data["version"]))
+
+    def save(self, path: Path) -> None:
+        save_arrays(
+            path,
+            tag_ids=self.tag_ids,
+            data=self.matrix.data,
+            indices=self.matrix.indices,
+            indptr=self.matrix.indptr,
+            version=np.int64(self.version),
+        )
+
+    def top_k(self, tag_id: int, k: int) -> List[Tuple[int, int]]:
+        """
+        The top_k function returns the tags sharing the most quotes with a tag, most shared first.
+
+        :param tag_id: The id of the tag
+        :param k: How many tags to return at most
+        :return: A list of (tag id, number of shared quotes)
+        """
+        i = self.index.get(tag_id)
+        if i is None or k <= 0:
+            return []
+        start, end = self.matrix.indptr[i], self.matrix.indptr[i + 1]
+        counts, columns = self.matrix.data[start:end], self.matrix.indices[start:end]
+        top = np.argpartition(-counts, k)[:k] if len(counts) > k else np.arange(len(counts))
+        related_ids, related_counts = self.tag_ids[columns[top]], counts[top]
+        order = np.lexsort((related_ids, -related_counts))
+        return [(int(related_ids[j]), int(related_counts[j])) for j in order]
+
+    def apply(self, deltas: PairCounts) -> "CooccurrenceMatrix":
+        """
+        The apply function returns a new matrix with the pair count deltas added. Tags that
+        aren't in the matrix yet get new rows and columns.
+
+        :param deltas: A mapping of (tag id, other tag id) to the change of their shared quote count; both orders are expected
+        :return: The updated matrix
+        """
+        new_ids = sorted({tag_id for pair in deltas for tag_id in pair} - self.index.keys())
+        tag_ids = np.concatenate([self.tag_ids, np.array(new_ids, dtype=self.tag_ids.dtype)])
+        index = {**self.index, **{tag_id: len(self.tag_ids) + i for i, tag_id in enumerate(new_ids)}}
+        size = len(tag_ids)
+
+        matrix = self.matrix.copy()
+        matrix.resize((size, size))
+        rows, columns, data = [], [], []
+        for (tag_id, other_id), delta in deltas.items():
+            if delta:
+                rows.append(index[tag_id])
+                columns.append(index[other_id])
+                data.append(delta)
+        matrix = (matrix + sparse.csr_matrix((data, (rows, columns)), shape=(size, size), dtype=matrix.dtype)).tocsr()
+        # A matrix built before a concurrent change could drift below zero
+        np.maximum(matrix.data, 0, out=matrix.data)
+        matrix.eliminate_zeros()
+        return CooccurrenceMatrix(tag_ids, matrix, self.version)
+
+
+def pair_counts(tag_sets: Iterable[Iterable[int]]) -> Counter:
+    """
+    The pair_counts function counts the ordered pairs of distinct tags over the tag sets of some quotes.
+
+    :param tag_sets: The tag ids of every quote
+    :return: A Counter of (tag id, other tag id)
+    """
+    counts = Counter()
+    for tag_ids in tag_sets:
+        counts.update(permutations(set(tag_ids), 2))
+    return counts
+
+
+class RelatedTags(ModelFile[CooccurrenceMatrix]):
+    """
+    The co-occurrence matrix of this process, kept in step with RELATED_TAGS_FILE and its journal.
+    """
+
+    def __init__(self):
+        super().__init__("RELATED_TAGS_FILE", CooccurrenceMatrix.load, RELATED_TAGS)
+        # The matrix of the file with the journal read so far added
+        self._merged: Optional[CooccurrenceMatrix] = None
+        # (journal inode, matrix file version, bytes read)
+        self._journal_position: Tuple[int, int, int] = (0, 0, 0)
+        self._journal_lock = threading.Lock()
+
+    def journal_path(self) -> Path:
+        return self.path().with_suffix(".journal")
+
+    def current(self) -> Optional[CooccurrenceMatrix]:
+        """
+        The current function returns the matrix of the file with the journaled deltas added, reading the lines
+        appended since the last call. It costs two stat() calls when nothing changed. The version of the result
+        is the version of the file plus the length of the journal read, so it changes with every new line.
+
+        :return: The matrix, or None when it was never built
+        """
+        snapshot = super().current()
+        if snapshot is None:
+            return None
+        try:
+            stat = self.journal_path().stat()
+        except FileNotFoundError:
+            return snapshot
+        with self._journal_lock:
+            inode, version, position = self._journal_position
+            if (inode, version) != (stat.st_ino, snapshot.version) or stat.st_size < position or self._merged is None:
+                self._merged, position = snapshot, 0
+            if stat.st_size > position:
+                with open(self.journal_path(), "rb") as journal:
+                    journal.seek(position)
+                    data = journal.read(stat.st_size - position)
+                # A line being appended right now is read next time
+                data = data[: data.rfind(b"\n") + 1]
+                if data:
+                    deltas = Counter()
+                    for line in data.splitlines():
+                        for tag_id, other_id, delta in json.loads(line):
+                            deltas[(tag_id, other_id)] += delta
+                    position += len(data)
+                    self._merged = self._merged.apply(deltas)
+                    self._merged.version = snapshot.version + position
+            self._journal_position = (stat.st_ino, snapshot.version, position)
+            return self._merged
+
+    def rebuild(self) -> CooccurrenceMatrix:
+        """
+        The rebuild function builds the matrix from the whole Quote.tags table, replaces the model file
+        and starts an empty journal.
+        A change committed while the table is read may be counted twice until the next rebuild.
+
+        :return: The new matrix
+        """
+        rows = Quote.tags.through.objects.values_list("quote_id", "tag_id").iterator(chunk_size=10000)
+        with self.file_lock():
+            matrix = CooccurrenceMatrix.from_rows(rows)
+            self.replace(matrix)
+            # A new file rather than a truncated one, so readers see a new inode and start over
+            with tempfile.NamedTemporaryFile(dir=self.path().parent, suffix=".tmp", delete=False) as fp:
+                pass
+            os.replace(fp.name, self.journal_path())
+        return matrix
+
+    def record(self, deltas: PairCounts) -> None:
+        """
+        The record function appends pair count deltas to the journal as one line, unless the matrix was never built.
+
+        :param deltas: A mapping of (tag id, other tag id) to the change of their shared quote count
+        :return: None
+        """
+        line = [[tag_id, other_id, delta] for (tag_id, other_id), delta in deltas.items() if delta]
+        if not line or not self.path().exists():
+            return
+        with self.file_lock():
+            with open(self.journal_path(), "a", encoding="utf-8") as journal:
+                journal.write(json.dumps(line) + "\n")
+        bump_version(self.scope)
+
+    def record_on_commit(self, deltas: PairCounts) -> None:
+        if deltas and self.path().exists():
+            transaction.on_commit(lambda: self.record(deltas))
+
+
+related_tags = RelatedTags()
+
+
+def record_tag_changes(rows: List[Tuple[int, int]], added: bool) -> None:
+    """
+    The record_tag_changes function queues the co-occurrence changes caused by added or removed Quote.tags rows.
+
+    :param rows: The (quote id, tag id) rows that were added or removed
+    :param added: True when the rows were added, False when they were removed
+    :return: None
+    """
+    related_tags.record_on_commit(tag_change_deltas(rows, added))
+
+
+def tag_change_deltas(rows: List[Tuple[int, int]], added: bool) -> Counter:
+    """
+    The tag_change_deltas function computes the pair count deltas caused by added or removed Quote.tags rows.
+    The tags the quotes have now are read back, so several tags added to a quote at once are paired with each other too.
+
+    :param rows: The (quote id, tag id) rows that were added or removed
+    :param added: True when the rows were added, False when they were removed
+    :return: A Counter of (tag id, other tag id), empty when the matrix was never built
+    """
+    if not rows or not related_tags.path().exists():
+        return Counter()
+    after: Dict[int, Set[int]] = defaultdict(set)
+    current_rows = Quote.tags.through.objects.filter(quote_id__in={quote_id for quote_id, _ in rows})
+    for quote_id, tag_id in current_rows.values_list("quote_id", "tag_id"):
+        after[quote_id].add(tag_id)
+    before = {quote_id: set(tag_ids) for quote_id, tag_ids in after.items()}
+    for quote_id, tag_id in rows:
+        before.setdefault(quote_id, set())
+        if added:
+            before[quote_id].discard(tag_id)
+        else:
+            before[quote_id].add(tag_id)
+
+    deltas = pair_counts(after.values())
+    deltas.subtract(pair_counts(before.values()))
+    return deltas
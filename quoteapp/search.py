@@ -0,0 +1,148 @@
+import re
+from collections import OrderedDict
+from functools import reduce
+from operator import add, and_
+from threading import Lock
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Q, QuerySet, TextField, Value, When
+from django.db.models.functions import Cast
+from quotes.routers import may_be_stale
+
+from .models import QuoteCard
+from .versions import CATALOG, get_versions
+
+SEARCH_CONFIG = "english"
+SEARCH_RESULT_LIMIT = 1000
+
+# Author names weigh the most, then tags, then the quote text itself
+SEARCH_VECTOR = (
+    SearchVector("author_name", weight="A", config=SEARCH_CONFIG)
+    + SearchVector(Cast("tag_names", TextField()), weight="B", config=SEARCH_CONFIG)
+    + SearchVector("text", weight="C", config=SEARCH_CONFIG)
+)
+
+
+def full_text_search_enabled() -> bool:
+    return connection.vendor == "postgresql"
+
+
+def search_terms(query: str) -> List[str]:
+    """
+    The search_terms function splits the user input into plain word terms.
+    Everything that is not a word character is dropped, so the input can safely be turned into a tsquery.
+
+    :param query: The raw search input
+    :return: The lowercase terms
+    """
+    return re.findall(r"\w+", query.lower())
+
+
+def normalize_query(query: str) -> str:
+    """
+    The normalize_query function returns the canonical form of a search query.
+    Queries that differ only in case, punctuation or spacing have the same results,
+    so they share one canonical URL and one cache entry.
+
+    :param query: The raw search input
+    :return: The normalized query
+    """
+    return " ".join(search_terms(query))
+
+
+def index_cards(cards: QuerySet) -> None:
+    """
+    The index_cards function recomputes the search vector of the given quote cards.
+    It is called whenever cards are written; without PostgreSQL there is nothing to maintain.
+
+    :param cards: The QuoteCard queryset to reindex
+    :return: None
+    """
+    if full_text_search_enabled():
+        cards.update(search_vector=SEARCH_VECTOR)
+
+
+def search_quotes(query: str, limit: int = SEARCH_RESULT_LIMIT) -> List[int]:
+    """
+    The search_quotes function returns the ids of the quote cards that match the query, best match first.
+    On PostgreSQL every term is matched as a prefix against the weighted tsvector (GIN index) and the
+    results are ordered by ts_rank. Other databases fall back to case-insensitive substring matching
+    with a fixed weight per field, which is enough for tests and local development.
+
+    :param query: The raw search input
+    :param limit: The maximum number of results
+    :return: The ranked quote ids
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    if full_text_search_enabled():
+        search_query = SearchQuery(" & ".join(f"{term}:*" for term in terms), search_type="raw", config=SEARCH_CONFIG)
+        cards = QuoteCard.objects.filter(search_vector=search_query).annotate(rank=SearchRank(F("search_vector"), search_query))
+    else:
+        matches = [Q(author_name__icontains=term) | Q(tag_names__icontains=term) | Q(text__icontains=term) for term in terms]
+        weights = [
+            Case(When(**{f"{field}__icontains": term}, then=Value(weight)), default=Value(0), output_field=IntegerField())
+            for term in terms
+            for field, weight in (("author_name", 4), ("tag_names", 2), ("text", 1))
+        ]
+        cards = QuoteCard.objects.filter(reduce(and_, matches)).annotate(rank=reduce(add, weights))
+
+    return list(cards.order_by("-rank", "pk").values_list("pk", flat=True)[:limit])
+
+
+class SearchResultCache:
+    """
+    A process-local LRU cache of ranked search results (lists of quote ids).
+    Keys include the catalog version, so entries computed before a write are never returned
+    again and are eventually evicted by newer entries.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[Tuple[str, int], List[int]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Tuple[str, int]) -> Optional[List[int]]:
+        with self._lock:
+            ids = self._entries.get(key)
+            if ids is not None:
+                self._entries.move_to_end(key)
+            return ids
+
+    def set(self, key: Tuple[str, int], ids: List[int]) -> None:
+        with self._lock:
+            self._entries[key] = ids
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+search_cache = SearchResultCache(getattr(settings, "SEARCH_CACHE_SIZE", 1024))
+
+
+def cached_search_quotes(query: str) -> List[int]:
+    """
+    The cached_search_quotes function returns the ranked ids for a query from the result cache,
+    running the search only on a miss. Paging through a result set then only loads the cards of each page.
+    Results a lagging replica may have missed the latest change for are returned but not cached, see quotes.routers.
+
+    :param query: The search input
+    :return: The ranked quote ids
+    """
+    version, modified = get_versions([CATALOG])[CATALOG]
+    key = (normalize_query(query), version)
+    ids = search_cache.get(key)
+    if ids is None:
+        ids = search_quotes(key[0])
+        if not may_be_stale(modified):
+            search_cache.set(key, ids)
+    return ids
@@ -0,0 +1,132 @@
+from collections import Counter
+from itertools import chain
+
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .cards import refresh_cards
+from .counters import adjust_tag_counts
+from .fingerprints import fingerprint, store_fingerprints
+from .models import Author, Quote, QuoteCard, Tag
+from .related import pair_counts, record_tag_changes, related_tags
+from .search import index_cards
+from .suggestions import AUTHOR, TAG, suggestions
+from .versions import AUTHOR_NAMES, CATALOG, QUOTE_IDS, TAG_NAMES, TOP_TAGS, author_scope, bump_version, tag_scope
+
+
+@receiver(m2m_changed, sender=Quote.tags.through)
+def quote_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    The quote_tags_changed function keeps Tag.quote_count and the quote cards in step with the Quote.tags table.
+    It handles both sides of the relation (quote.tags.add(...) and tag.quote_set.add(...)).
+    For removals and clears the rows that really exist are looked up in the pre_* step,
+    because Django reports the requested ids rather than the deleted ones.
+
+    :param sender: The Quote.tags through model
+    :param instance: The Quote (or the Tag, when reverse) whose relation changed
+    :param action: The m2m_changed action
+    :param reverse: True when the change was made from the Tag side
+    :param pk_set: The primary keys that were added or removed
+    :return: None
+    """
+    if action in ("pre_remove", "pre_clear"):
+        rows = sender.objects.filter(**{"tag_id" if reverse else "quote_id": instance.pk})
+        if action == "pre_remove":
+            rows = rows.filter(**{"quote_id__in" if reverse else "tag_id__in": pk_set})
+        instance._removed_rows = list(rows.values_list("quote_id", "tag_id"))
+        return
+
+    if action == "post_add" and pk_set:
+        rows = [(quote_id, instance.pk) for quote_id in pk_set] if reverse else [(instance.pk, tag_id) for tag_id in pk_set]
+        delta = 1
+    elif action in ("post_remove", "post_clear"):
+        rows = getattr(instance, "_removed_rows", [])
+        instance._removed_rows = []
+        delta = -1
+    else:
+        return
+
+    adjust_tag_counts({tag_id: delta * count for tag_id, count in Counter(tag_id for _, tag_id in rows).items()})
+    refresh_cards({quote_id for quote_id, _ in rows})
+    record_tag_changes(rows, added=delta > 0)
+    bump_version(CATALOG)
+
+
+@receiver(pre_delete, sender=Quote)
+def release_tag_counts(sender, instance, **kwargs):
+    """
+    The release_tag_counts function decrements the counters of a quote's tags before the quote is deleted,
+    as well as their co-occurrence counts.
+    It runs on pre_delete because the Quote.tags rows are already gone by post_delete.
+
+    :param sender: The Quote model
+    :param instance: The quote being deleted
+    :return: None
+    """
+    tags = list(instance.tags.values_list("pk", "name"))
+    adjust_tag_counts({tag_id: -1 for tag_id, _ in tags})
+    related_tags.record_on_commit({pair: -count for pair, count in pair_counts([[tag_id for tag_id, _ in tags]]).items()})
+    bump_version(*(tag_scope(name) for _, name in tags))
+
+
+@receiver(pre_save, sender=Quote)
+def fingerprint_quote(sender, instance, **kwargs):
+    fp = fingerprint(instance.quote)
+    # Quotes read from the database carry the hash of their stored text, so an unchanged text keeps its buckets
+    instance._fingerprint = fp if fp.content_hash != instance.content_hash or instance.pk is None else None
+    instance.content_hash = fp.content_hash
+
+
+@receiver(post_save, sender=Quote)
+def quote_saved(sender, instance, created, **kwargs):
+    if getattr(instance, "_fingerprint", None):
+        store_fingerprints([(instance.pk, instance._fingerprint)])
+        instance._fingerprint = None
+    refresh_cards([instance.pk])
+    bump_version(CATALOG, *([QUOTE_IDS] if created else []))
+
+
+@receiver(post_delete, sender=Quote)
+def quote_deleted(sender, instance, **kwargs):
+    bump_version(CATALOG, QUOTE_IDS)
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, **kwargs):
+    suggestions.record_on_commit([(AUTHOR, instance.pk, None, 0)])
+    bump_version(CATALOG, AUTHOR_NAMES, author_scope(instance.fullname))
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, **kwargs):
+    scopes = [CATALOG, AUTHOR_NAMES, author_scope(instance.fullname)]
+    if not created:
+        cards = QuoteCard.objects.filter(quote__author=instance)
+        if cards.exclude(author_name=instance.fullname).update(author_name=instance.fullname, version=F("version") + 1):
+            index_cards(cards)
+            scopes.extend(map(tag_scope, set(chain.from_iterable(cards.values_list("tag_names", flat=True)))))
+    if suggestions.path().exists():
+        popularity = 0 if created else Quote.objects.filter(author=instance).count()
+        suggestions.record_on_commit([(AUTHOR, instance.pk, instance.fullname, popularity)])
+    bump_version(*scopes)
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, **kwargs):
+    if not created:
+        refresh_cards(Quote.objects.filter(tags=instance).values_list("pk", flat=True).iterator())
+    suggestions.record_on_commit([(TAG, instance.pk, instance.name, instance.quote_count)])
+    bump_version(CATALOG, TOP_TAGS, TAG_NAMES, tag_scope(instance.name))
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleting(sender, instance, **kwargs):
+    instance._quote_ids = list(Quote.objects.filter(tags=instance).values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    refresh_cards(getattr(instance, "_quote_ids", []))
+    suggestions.record_on_commit([(TAG, instance.pk, None, 0)])
+    bump_version(CATALOG, TOP_TAGS, TAG_NAMES, tag_scope(instance.name))
@@ -0,0 +1,356 @@
+"""
+"Similar quotes" from precomputed TF-IDF nearest neighbours.
+
+Every quote card is a TF-IDF vector over the words of its text and its tags (tags weigh TAG_WEIGHT of a word),
+normalized so a dot product is the cosine similarity. The build_similar_quotes command computes the
+NEIGHBOURS most similar quotes of every quote, a block of rows at a time so the dense similarity block
+stays within a memory budget, and saves them to SIMILAR_QUOTES_FILE (see quoteapp.modelfiles) as fixed-size
+arrays: a lookup is an index into a dense quote id -> row table plus a row slice. The web workers only load
+these neighbour lists; the vectors, vocabulary and weights go to a sibling .vectors.npz file that only
+the build command reads.
+
+Quotes added later are vectorized with the stored vocabulary and merged in by build_similar_quotes --refresh,
+which also lets them displace the weakest neighbours of the existing quotes. Edited quotes and the
+vocabulary itself are only updated by a full build.
+"""
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.utils.html import strip_tags
+from scipy import sparse
+
+from .modelfiles import ModelFile, save_arrays
+from .models import QuoteCard
+from .versions import SIMILAR_QUOTES
+
+NEIGHBOURS = 20
+TAG_WEIGHT = 0.5
+BLOCK_BYTES = 64 * 1024 * 1024
+TOKEN_RE = re.compile(r"\w\w+")
+
+Row = Tuple[int, str, Sequence[str]]
+
+
+def quote_terms(text: str, tag_names: Iterable[str]) -> Counter:
+    """
+    The quote_terms function returns the term counts of a quote: its lowercase words, and its tags as "#name".
+
+    :param text: The quote text, which may contain HTML
+    :param tag_names: The names of the quote tags
+    :return: A Counter of terms
+    """
+    terms = Counter(TOKEN_RE.findall(strip_tags(text).lower()))
+    terms.update(f"#{name}" for name in tag_names)
+    return terms
+
+
+def card_rows(cards=None) -> Iterable[Row]:
+    cards = QuoteCard.objects.all() if cards is None else cards
+    return cards.order_by("pk").values_list("pk", "text", "tag_names").iterator(chunk_size=10000)
+
+
+def block_rows(columns: int, block_bytes: int = BLOCK_BYTES) -> int:
+    # The dense similarity block is rows x columns float32 values
+    return max(1, block_bytes // (4 * max(columns, 1)))
+
+
+def top_k(neighbours: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The top_k function keeps the k best scored candidates of every row, best first.
+    Candidates with a score of zero or less are dropped (their neighbour is -1).
+
+    :param neighbours: A rows x candidates array of neighbour row numbers
+    :param scores: The matching similarity scores
+    :param k: The number of neighbours to keep
+    :return: The rows x k neighbours and scores
+    """
+    if scores.shape[1] > k:
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        neighbours, scores = np.take_along_axis(neighbours, best, axis=1), np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    neighbours, scores = np.take_along_axis(neighbours, order, axis=1), np.take_along_axis(scores, order, axis=1)
+    if scores.shape[1] < k:
+        missing = k - scores.shape[1]
+        neighbours = np.pad(neighbours, ((0, 0), (0, missing)), constant_values=-1)
+        scores = np.pad(scores, ((0, 0), (0, missing)))
+    neighbours = np.where(scores > 0, neighbours, -1).astype(np.int32)
+    return neighbours, np.maximum(scores, 0).astype(np.float32)
+
+
+def nearest(queries: sparse.csr_matrix, vectors: sparse.csr_matrix, query_rows: np.ndarray, k: int, block_bytes: int):
+    """
+    The nearest function finds the k most similar vectors of every query, a block of queries at a time.
+
+    :param queries: The query vectors
+    :param vectors: All vectors, the queries among them
+    :param query_rows: The row of every query in vectors, so a quote isn't its own neighbour
+    :param k: The number of neighbours
+    :param block_bytes: The memory budget of one dense similarity block
+    :return: The queries x k neighbour rows and scores
+    """
+    neighbours = np.full((queries.shape[0], k), -1, dtype=np.int32)
+    scores = np.zeros((queries.shape[0], k), dtype=np.float32)
+    step = block_rows(vectors.shape[0], block_bytes)
+    candidates = np.arange(vectors.shape[0], dtype=np.int32)
+    for start in range(0, queries.shape[0], step):
+        end = min(start + step, queries.shape[0])
+        block = (queries[start:end] @ vectors.T).toarray()
+        block[np.arange(end - start), query_rows[start:end]] = 0
+        neighbours[start:end], scores[start:end] = top_k(np.broadcast_to(candidates, block.shape), block, k)
+    return neighbours, scores
+
+
+def vectors_path(path: Path) -> Path:
+    return path.with_suffix(".vectors.npz")
+
+
+class NeighbourLists:
+    """
+    The neighbour lists of the quotes, all the web workers load. Row i belongs to the quote quote_ids[i];
+    neighbours[i] holds the rows of its most similar quotes, best first, padded with -1.
+    """
+
+    def __init__(self, quote_ids: np.ndarray, neighbours: np.ndarray, scores: np.ndarray, version: int = 0):
+        self.quote_ids = quote_ids
+        self.neighbours = neighbours
+        self.scores = scores
+        self.version = version
+        self.row_of = np.full(int(quote_ids.max(initial=-1)) + 1, -1, dtype=np.int32)
+        self.row_of[quote_ids] = np.arange(len(quote_ids), dtype=np.int32)
+
+    def similar_ids(self, quote_id: int, limit: int) -> List[int]:
+        """
+        The similar_ids function returns the ids of the quotes most similar to a quote, most similar first.
+
+        :param quote_id: The id of the quote
+        :param limit: How many ids to return at most
+        :return: The quote ids, empty when the quote isn't in the model
+        """
+        row = self.row_of[quote_id] if 0 <= quote_id < len(self.row_of) else -1
+        if row < 0:
+            return []
+        neighbours = self.neighbours[row, :limit]
+        return self.quote_ids[neighbours[neighbours >= 0]].tolist()
+
+    def similar_to_many(self, quote_ids: Iterable[int], limit: int) -> List[int]:
+        """
+        The similar_to_many function returns the quotes most similar to a group of quotes (e.g. all quotes of
+        an author), ranked by their summed similarity and leaving out the group itself.
+
+        :param quote_ids: The ids of the quotes
+        :param limit: How many ids to return at most
+        :return: The quote ids, most similar first
+        """
+        quote_ids = set(quote_ids)
+        totals = Counter()
+        for quote_id in quote_ids:
+            row = self.row_of[quote_id] if 0 <= quote_id < len(self.row_of) else -1
+            if row >= 0:
+                for neighbour, score in zip(self.neighbours[row].tolist(), self.scores[row].tolist()):
+                    if neighbour >= 0:
+                        totals[int(self.quote_ids[neighbour])] += score
+        ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+        return [quote_id for quote_id, _ in ranked if quote_id not in quote_ids][:limit]
+
+    @classmethod
+    def load(cls, path: Path) -> "NeighbourLists":
+        with np.load(path) as data:
+            return cls(data["quote_ids"], data["neighbours"], data["scores"].astype(np.float32), int(data["version"]))
+
+    def save(self, path: Path) -> None:
+        save_arrays(
+            path,
+            quote_ids=self.quote_ids,
+            neighbours=self.neighbours,
+            # Half precision is plenty to rank and halves the size of the lists
+            scores=self.scores.astype(np.float16),
+            version=np.int64(self.version),
+        )
+
+
+class SimilarQuotes(NeighbourLists):
+    """
+    The neighbour lists together with the TF-IDF vectors, vocabulary and term weights they were computed from,
+    which are needed to add new quotes. Only the build command loads them.
+    """
+
+    def __init__(
+        self,
+        quote_ids: np.ndarray,
+        vocabulary: np.ndarray,
+        weights: np.ndarray,
+        vectors: sparse.csr_matrix,
+        neighbours: np.ndarray,
+        scores: np.ndarray,
+        version: int = 0,
+    ):
+        super().__init__(quote_ids, neighbours, scores, version)
+        self.vocabulary = vocabulary
+        self.weights = weights
+        self.vectors = vectors
+        self.columns: Dict[str, int] = {term: i for i, term in enumerate(vocabulary.tolist())}
+
+    @classmethod
+    def build(cls, rows: Iterable[Row], k: int = NEIGHBOURS, block_bytes: int = BLOCK_BYTES) -> "SimilarQuotes":
+        """
+        The build function vectorizes all quotes and computes the neighbours of every one of them.
+
+        :param rows: (quote id, text, tag names) rows of every quote card
+        :param k: The number of neighbours kept per quote
+        :param block_bytes: The memory budget of one dense similarity block
+        :return: The model
+        """
+        columns: Dict[str, int] = {}
+        quote_ids, indptr, indices, counts = [], [0], [], []
+        for quote_id, text, tag_names in rows:
+            for term, count in quote_terms(text, tag_names).items():
+                indices.append(columns.setdefault(term, len(columns)))
+                counts.append(count)
+            indptr.append(len(indices))
+            quote_ids.append(quote_id)
+
+        vocabulary = np.array(list(columns), dtype=str)
+        document_frequency = np.bincount(np.array(indices, dtype=np.int64), minlength=len(columns))
+        idf = np.log((1 + len(quote_ids)) / (1 + document_frequency)) + 1
+        is_tag = np.char.startswith(vocabulary, "#") if len(vocabulary) else np.zeros(0, dtype=bool)
+        weights = (idf * np.where(is_tag, TAG_WEIGHT, 1.0)).astype(np.float32)
+
+        term_counts = sparse.csr_matrix(
+            (np.array(counts, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+            shape=(len(quote_ids), len(columns)),
+        )
+        vectors = cls.weigh(term_counts, weights)
+        quote_ids = np.array(quote_ids, dtype=np.int64)
+        neighbours, scores = nearest(vectors, vectors, np.arange(len(quote_ids)), k, block_bytes)
+        return cls(quote_ids, vocabulary, weights, vectors, neighbours, scores)
+
+    @staticmethod
+    def weigh(term_counts: sparse.csr_matrix, weights: np.ndarray) -> sparse.csr_matrix:
+        # Sublinear term frequency times the term weight, then unit length rows
+        vectors = term_counts.copy()
+        vectors.data = (1 + np.log(vectors.data)).astype(np.float32)
+        vectors = sparse.csr_matrix(vectors.multiply(weights.reshape(1, -1)), dtype=np.float32)
+        norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.csr_matrix(sparse.diags(1 / norms) @ vectors, dtype=np.float32)
+
+    def vectorize(self, rows: Sequence[Row]) -> sparse.csr_matrix:
+        """
+        The vectorize function turns new quotes into vectors with the stored vocabulary and weights.
+        Terms the vocabulary doesn't know are left out.
+
+        :param rows: (quote id, text, tag names) rows
+        :return: One vector per row
+        """
+        indptr, indices, counts = [0], [], []
+        for _, text, tag_names in rows:
+            for term, count in quote_terms(text, tag_names).items():
+                if term in self.columns:
+                    indices.append(self.columns[term])
+                    counts.append(count)
+            indptr.append(len(indices))
+        term_counts = sparse.csr_matrix(
+            (np.array(counts, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+            shape=(len(rows), len(self.vocabulary)),
+        )
+        return self.weigh(term_counts, self.weights)
+
+    def refresh(self, rows: Sequence[Row], block_bytes: int = BLOCK_BYTES) -> "SimilarQuotes":
+        """
+        The refresh function returns a model that also covers new quotes. Their neighbours are searched
+        among all quotes, and every existing quote takes a new quote as neighbour when it beats its weakest one.
+
+        :param rows: (quote id, text, tag names) rows of quotes the model doesn't cover yet
+        :param block_bytes: The memory budget of one dense similarity block
+        :return: The new model
+        """
+        rows = [row for row in rows if row[0] >= len(self.row_of) or self.row_of[row[0]] < 0]
+        if not rows:
+            return self
+        size, k = len(self.quote_ids), self.neighbours.shape[1]
+        new_vectors = self.vectorize(rows)
+        vectors = sparse.vstack([self.vectors, new_vectors], format="csr")
+        new_neighbours, new_scores = nearest(new_vectors, vectors, size + np.arange(len(rows)), k, block_bytes)
+
+        neighbours, scores = self.neighbours.copy(), self.scores.copy()
+        candidates = size + np.arange(len(rows), dtype=np.int32)
+        step = block_rows(len(rows), block_bytes)
+        for start in range(0, size, step):
+            end = min(start + step, size)
+            block = (self.vectors[start:end] @ new_vectors.T).toarray()
+            neighbours[start:end], scores[start:end] = top_k(
+                np.hstack([neighbours[start:end], np.broadcast_to(candidates, block.shape)]),
+                np.hstack([scores[start:end], block]),
+                k,
+            )
+
+        quote_ids = np.concatenate([self.quote_ids, np.array([row[0] for row in rows], dtype=np.int64)])
+        return SimilarQuotes(
+            quote_ids,
+            self.vocabulary,
+            self.weights,
+            vectors,
+            np.vstack([neighbours, new_neighbours]),
+            np.vstack([scores, new_scores]),
+            self.version,
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "SimilarQuotes":
+        lists = NeighbourLists.load(path)
+        # A file saved before the vectors got a file of their own holds them itself
+        with np.load(vectors_path(path) if vectors_path(path).exists() else path) as data:
+            vectors = sparse.csr_matrix(
+                (data["data"], data["indices"], data["indptr"]), shape=(len(lists.quote_ids), len(data["vocabulary"]))
+            )
+            return cls(
+                lists.quote_ids, data["vocabulary"], data["weights"], vectors, lists.neighbours, lists.scores, lists.version
+            )
+
+    def save(self, path: Path) -> None:
+        # The vectors first, the lists the web workers watch replace the previous ones last
+        save_arrays(
+            vectors_path(path),
+            vocabulary=self.vocabulary,
+            weights=self.weights,
+            data=self.vectors.data,
+            indices=self.vectors.indices,
+            indptr=self.vectors.indptr,
+        )
+        super().save(path)
+
+
+class SimilarQuotesFile(ModelFile[NeighbourLists]):
+    def __init__(self):
+        super().__init__("SIMILAR_QUOTES_FILE", NeighbourLists.load, SIMILAR_QUOTES)
+
+    def rebuild(self, k: int = NEIGHBOURS, block_bytes: int = BLOCK_BYTES) -> SimilarQuotes:
+        with self.file_lock():
+            model = SimilarQuotes.build(card_rows(), k, block_bytes)
+            self.replace(model)
+        return model
+
+    def refresh(self, block_bytes: int = BLOCK_BYTES) -> Tuple[Optional[SimilarQuotes], int]:
+        """
+        The refresh function adds the quotes that are newer than the model to it.
+
+        :param block_bytes: The memory budget of one dense similarity block
+        :return: The model (None when it was never built) and the number of quotes added
+        """
+        with self.file_lock():
+            if not self.path().exists():
+                return None, 0
+            model = SimilarQuotes.load(self.path())
+            covered = len(model.quote_ids)
+            # Quote ids only grow, so the new quotes are the ones after the newest quote of the model
+            rows = list(card_rows(QuoteCard.objects.filter(pk__gt=int(model.quote_ids.max(initial=0)))))
+            refreshed = model.refresh(rows, block_bytes)
+            if refreshed is not model:
+                self.replace(refreshed)
+        return refreshed, len(refreshed.quote_ids) - covered
+
+
+similar_quotes = SimilarQuotesFile()
@@ -0,0 +1,58 @@
+// Autocomplete pickers for the selects rendered by quoteapp.widgets. A search box above the select loads the
+// choices starting with the typed text from the URL in the select's data-autocomplete-url attribute, a page at a
+// time. Selected choices stay in the select, so they are submitted whatever is typed next.
+(() => {
+  "use strict";
+
+  const DELAY_MS = 250;
+
+  const setUp = (select) => {
+    const input = document.createElement("input");
+    input.type = "search";
+    input.className = "form-control mb-1";
+    input.placeholder = "Type to search";
+    input.setAttribute("aria-label", `Search ${select.name}`);
+    select.before(input);
+
+    const more = document.createElement("button");
+    more.type = "button";
+    more.className = "btn btn-link btn-sm";
+    more.textContent = "More";
+    more.hidden = true;
+    select.after(more);
+
+    let timer = null;
+    let next = null;
+    let latest = 0;
+
+    const load = async (url, append) => {
+      const request = ++latest;
+      const response = await fetch(url, { headers: { Accept: "application/json" } });
+      if (!response.ok || request !== latest) {
+        return;
+      }
+      const data = await response.json();
+      if (!append) {
+        Array.from(select.options)
+          .filter((option) => option.value && !option.selected)
+          .forEach((option) => option.remove());
+      }
+      const present = new Set(Array.from(select.options, (option) => option.value));
+      data.results
+        .filter((choice) => !present.has(String(choice.id)))
+        .forEach((choice) => select.add(new Option(choice.text, choice.id)));
+      next = data.next;
+      more.hidden = !next;
+    };
+
+    input.addEventListener("input", () => {
+      clearTimeout(timer);
+      timer = setTimeout(() => load(`${select.dataset.autocompleteUrl}?q=${encodeURIComponent(input.value)}`, false), DELAY_MS);
+    });
+    more.addEventListener("click", () => next && load(next, true));
+  };
+
+  document.addEventListener("DOMContentLoaded", () => {
+    document.querySelectorAll("select[data-autocomplete-url]").forEach(setUp);
+  });
+})();
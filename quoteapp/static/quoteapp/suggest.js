@@ -0,0 +1,58 @@
+// Suggestions of the navbar search box. Every keystroke fetches the tags and authors matching the typed text from
+// the URL in the input's data-suggest-url attribute (see quoteapp.suggestions) and lists them as links under the
+// box; submitting the form still runs the full search.
+(() => {
+  "use strict";
+
+  const setUp = (input) => {
+    const menu = document.createElement("ul");
+    menu.className = "dropdown-menu";
+    menu.style.top = "100%";
+    input.after(menu);
+
+    let latest = 0;
+
+    const hide = () => menu.classList.remove("show");
+
+    const load = async () => {
+      const request = ++latest;
+      const query = input.value.trim();
+      if (!query) {
+        hide();
+        return;
+      }
+      const response = await fetch(`${input.dataset.suggestUrl}?q=${encodeURIComponent(query)}`, {
+        headers: { Accept: "application/json" },
+      });
+      if (!response.ok || request !== latest) {
+        return;
+      }
+      const data = await response.json();
+      menu.replaceChildren(
+        ...data.results.map((suggestion) => {
+          const link = document.createElement("a");
+          link.className = "dropdown-item";
+          link.href = suggestion.url;
+          link.textContent = suggestion.text;
+          const kind = document.createElement("small");
+          kind.className = "text-muted ms-2";
+          kind.textContent = suggestion.kind;
+          link.append(kind);
+          const item = document.createElement("li");
+          item.append(link);
+          return item;
+        })
+      );
+      menu.classList.toggle("show", data.results.length > 0);
+    };
+
+    input.addEventListener("input", load);
+    input.addEventListener("keydown", (event) => event.key === "Escape" && hide());
+    // Wait for a click on a suggestion to follow its link before hiding the menu
+    input.addEventListener("blur", () => setTimeout(hide, 150));
+  };
+
+  document.addEventListener("DOMContentLoaded", () => {
+    document.querySelectorAll("input[data-suggest-url]").forEach(setUp);
+  });
+})();
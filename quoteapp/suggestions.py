@@ -0,0 +1,443 @@
+"""
+Search-as-you-type suggestions of tags and authors from an in-process index.
+
+The index is a snapshot of every tag name and author full name with its popularity (the number of quotes),
+built by the build_suggestions command into SUGGESTIONS_FILE and loaded by every process on first use, see
+quoteapp.modelfiles. Its arrays hold:
+
+- every word suffix of every normalized name ("albert einstein", "einstein") in sorted order, packed into one UTF-8
+  buffer with their offsets, so the names with a word starting with the typed prefix are a contiguous range found
+  by binary search over the offsets, without a Python string per suffix. The most popular entries of
+  the prefixes of up to SHORT_PREFIX_LENGTH characters, whose ranges are the largest, are stored precomputed;
+  longer prefixes rank their range with a partial sort;
+- the entries of every trigram of the names as posting lists, for fuzzy matches of mistyped queries when there
+  are too few prefix matches.
+
+Tags and authors added, renamed or deleted afterwards are appended to a journal next to the snapshot once their
+transaction commits. Every process reads the new lines of the journal (one stat() per query when there are none)
+into a small overlay that is searched along with the snapshot. Rebuilding folds the journal in and refreshes the
+popularity, which the journal only records for the changed names; the import commands rebuild after importing.
+"""
+import bisect
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count
+
+from .modelfiles import ModelFile, save_arrays
+from .models import Author, Tag
+from .versions import SUGGESTIONS
+
+WORD_RE = re.compile(r"\w+")
+AUTHOR, TAG = 0, 1
+KINDS = ("author", "tag")
+# Matches are ranked among this many times the limit of candidates, as the journal may hide some of them
+POOL_FACTOR = 4
+SHORT_PREFIX_LENGTH = 2
+# How many of the most popular entries of the short prefixes are stored
+SHORT_PREFIX_POOL = 64
+# Fuzzy matches contain at least this part of the trigrams of the query, like pg_trgm's word_similarity,
+# so a mistyped last name still matches a full name
+TRIGRAM_SIMILARITY = 0.5
+# Fuzzy lookups read the posting lists of the rarest trigrams of the query up to this many entries in all,
+# and check the similarity of the CANDIDATES entries found in most of them
+MAX_POSTINGS = 10000
+CANDIDATES = 32
+
+# (kind, id, name, popularity) of a changed name, name is None when it was deleted
+Change = Tuple[int, int, Optional[str], int]
+
+
+class Suggestion(NamedTuple):
+    kind: str
+    id: int
+    name: str
+    popularity: int
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(WORD_RE.findall(name.lower()))
+
+
+def word_suffixes(normalized: str) -> List[str]:
+    starts = [0] + [i + 1 for i, char in enumerate(normalized) if char == " "]
+    return [normalized[start:] for start in starts] if normalized else []
+
+
+def trigrams(normalized: str) -> Set[str]:
+    # Every word padded like pg_trgm does, so the first letters weigh more than the others
+    return {f"  {word} "[i : i + 3] for word in normalized.split() for i in range(len(word) + 1)}
+
+
+def join_lines(strings: List[str]) -> np.ndarray:
+    # Normalized names, and so their keys and trigrams, never contain a newline
+    return np.frombuffer("\n".join(strings).encode(), dtype=np.uint8)
+
+
+def split_lines(blob: np.ndarray) -> List[str]:
+    return blob.tobytes().decode().split("\n") if len(blob) else []
+
+
+def pack(strings: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in strings], out=offsets[1:])
+    return np.frombuffer(b"".join(strings), dtype=np.uint8), offsets
+
+
+class PackedStrings(Sequence[bytes]):
+    """
+    The strings packed by pack(), read as a sequence of UTF-8 bytes that bisect can search.
+    Only the strings that are looked at are sliced out of the buffer.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob, self.offsets = blob.tobytes(), offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.blob[self.offsets[i] : self.offsets[i + 1]]
+
+
+def csr(groups: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    indptr = np.zeros(len(groups) + 1, dtype=np.int64)
+    np.cumsum([len(group) for group in groups], out=indptr[1:])
+    values = np.fromiter((value for group in groups for value in group), dtype=np.int32, count=int(indptr[-1]))
+    return indptr, values
+
+
+class SuggestionIndex:
+    """
+    The names of the snapshot, their sorted word suffixes and their trigrams as flat arrays, see the module docstring.
+    Entry i is the name of kinds[i] (AUTHOR or TAG) with id ids[i]. Instances are never modified, so readers need no lock.
+    """
+
+    ARRAYS = (
+        "kinds",
+        "ids",
+        "popularity",
+        "names",
+        "name_offsets",
+        "keys",
+        "key_offsets",
+        "key_entries",
+        "short_prefixes",
+        "short_indptr",
+        "short_entries",
+        "trigrams",
+        "trigram_indptr",
+        "trigram_postings",
+    )
+
+    def __init__(self, arrays: Dict[str, np.ndarray], version: int = 0):
+        self.arrays = arrays
+        self.version = version
+        self.kinds, self.ids, self.popularity = arrays["kinds"], arrays["ids"], arrays["popularity"]
+        self.names, self.name_offsets = arrays["names"].tobytes(), arrays["name_offsets"]
+        self.keys = PackedStrings(arrays["keys"], arrays["key_offsets"])
+        self.key_entries = arrays["key_entries"]
+        self.key_popularity = self.popularity[self.key_entries]
+        self.short_prefixes = {prefix: i for i, prefix in enumerate(split_lines(arrays["short_prefixes"]))}
+        self.short_indptr, self.short_entries = arrays["short_indptr"], arrays["short_entries"]
+        self.trigram_ids = {trigram: i for i, trigram in enumerate(split_lines(arrays["trigrams"]))}
+        self.trigram_indptr, self.trigram_postings = arrays["trigram_indptr"], arrays["trigram_postings"]
+
+    @classmethod
+    def build(cls, entries: Iterable[Tuple[int, int, str, int]]) -> "SuggestionIndex":
+        """
+        The build function builds the index from (kind, id, name, popularity) rows.
+
+        :param entries: The names to suggest
+        :return: The index
+        """
+        entries = [entry for entry in entries if normalize_name(entry[2])]
+        normalized = [normalize_name(name) for _, _, name, _ in entries]
+        names, name_offsets = pack([name.encode() for _, _, name, _ in entries])
+        popularity = np.array([entry[3] for entry in entries], dtype=np.int64)
+
+        # UTF-8 keeps the order of the code points, so the encoded keys are sorted too
+        keyed = sorted((suffix, i) for i, name in enumerate(normalized) for suffix in word_suffixes(name))
+        keys = [key.encode() for key, _ in keyed]
+        key_entries = np.array([i for _, i in keyed], dtype=np.int32)
+
+        short_prefixes = sorted({key[:length] for key, _ in keyed for length in range(1, SHORT_PREFIX_LENGTH + 1)})
+        short_entries = []
+        for prefix in short_prefixes:
+            lo, hi = prefix_range(keys, prefix)
+            short_entries.append(best_entries(key_entries[lo:hi], popularity, SHORT_PREFIX_POOL))
+
+        postings: Dict[str, List[int]] = defaultdict(list)
+        for i, name in enumerate(normalized):
+            for gram in trigrams(name):
+                postings[gram].append(i)
+        sorted_trigrams = sorted(postings)
+
+        short_indptr, short_values = csr(short_entries)
+        trigram_indptr, trigram_postings = csr([postings[gram] for gram in sorted_trigrams])
+        keys, key_offsets = pack(keys)
+        arrays = {
+            "kinds": np.array([entry[0] for entry in entries], dtype=np.int8),
+            "ids": np.array([entry[1] for entry in entries], dtype=np.int64),
+            "popularity": popularity,
+            "names": names,
+            "name_offsets": name_offsets,
+            "keys": keys,
+            "key_offsets": key_offsets,
+            "key_entries": key_entries,
+            "short_prefixes": join_lines(short_prefixes),
+            "short_indptr": short_indptr,
+            "short_entries": short_values,
+            "trigrams": join_lines(sorted_trigrams),
+            "trigram_indptr": trigram_indptr,
+            "trigram_postings": trigram_postings,
+        }
+        return cls(arrays)
+
+    @classmethod
+    def load(cls, path: Path) -> "SuggestionIndex":
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in cls.ARRAYS if name in data}
+            version = int(data["version"])
+        if "key_offsets" not in arrays:
+            # A file saved before the keys got offsets separates them with newlines
+            arrays["keys"], arrays["key_offsets"] = pack([key.encode() for key in split_lines(arrays["keys"])])
+        return cls(arrays, version)
+
+    def save(self, path: Path) -> None:
+        save_arrays(path, version=np.int64(self.version), **self.arrays)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def entry(self, i: int) -> Suggestion:
+        name = self.names[self.name_offsets[i] : self.name_offsets[i + 1]].decode()
+        return Suggestion(KINDS[self.kinds[i]], int(self.ids[i]), name, int(self.popularity[i]))
+
+    def prefix_matches(self, prefix: str, pool: int) -> List[int]:
+        """
+        The prefix_matches function returns the entries with a word starting with a normalized prefix,
+        most popular first.
+
+        :param prefix: The normalized prefix
+        :param pool: How many entries to return at most
+        :return: The entry indexes
+        """
+        short = self.short_prefixes.get(prefix)
+        if short is not None:
+            return self.short_entries[self.short_indptr[short] : self.short_indptr[short + 1]][:pool].tolist()
+        lo, hi = prefix_range(self.keys, prefix)
+        return best_entries(self.key_entries[lo:hi], self.popularity, pool, self.key_popularity[lo:hi])
+
+    def fuzzy_matches(self, grams: Set[str], pool: int) -> List[Tuple[float, int]]:
+        """
+        The fuzzy_matches function returns the entries containing enough of the trigrams of a query,
+        most similar first, then most popular first. Candidates are read from the rarest trigrams of the query.
+
+        :param grams: The trigrams of the normalized query
+        :param pool: How many entries to return at most
+        :return: (similarity, entry index) tuples
+        """
+        found = [self.trigram_ids[gram] for gram in grams if gram in self.trigram_ids]
+        spans = sorted((self.trigram_indptr[j + 1] - self.trigram_indptr[j], self.trigram_indptr[j]) for j in found)
+        lists, read = [], 0
+        for length, start in spans:
+            if lists and read + length > MAX_POSTINGS:
+                break
+            lists.append(self.trigram_postings[start : start + length])
+            read += length
+        if not lists:
+            return []
+        entries, shared = np.unique(np.concatenate(lists), return_counts=True)
+        if len(entries) > CANDIDATES:
+            entries = entries[np.argpartition(-shared, CANDIDATES)[:CANDIDATES]]
+        matches = []
+        for i in entries.tolist():
+            similarity = len(grams & trigrams(normalize_name(self.entry(i).name))) / len(grams)
+            if similarity >= TRIGRAM_SIMILARITY:
+                matches.append((similarity, i))
+        matches.sort(key=lambda match: (-match[0], -self.popularity[match[1]]))
+        return matches[:pool]
+
+
+def prefix_range(keys: Sequence[bytes], prefix: str) -> Tuple[int, int]:
+    # No UTF-8 sequence contains the byte 0xff, so it sorts after every key starting with the prefix
+    encoded = prefix.encode()
+    return bisect.bisect_left(keys, encoded), bisect.bisect_left(keys, encoded + b"\xff")
+
+
+def best_entries(
+    entries: np.ndarray, popularity: np.ndarray, pool: int, entry_popularity: Optional[np.ndarray] = None
+) -> List[int]:
+    """
+    The best_entries function returns the most popular of some entries, without duplicates.
+
+    :param entries: Entry indexes, a name appears once per word matching the prefix
+    :param popularity: The popularity of every entry
+    :param pool: How many entries to return at most
+    :param entry_popularity: popularity[entries], when it is at hand
+    :return: The entry indexes, most popular first
+    """
+    if len(entries) > pool:
+        scores = popularity[entries] if entry_popularity is None else entry_popularity
+        # A few more, in case some names match with more than one word
+        candidates = min(len(entries) - 1, pool * 2)
+        entries = entries[np.argpartition(-scores, candidates)[: candidates + 1]]
+    entries = np.unique(entries)
+    return entries[np.lexsort((entries, -popularity[entries]))][:pool].tolist()
+
+
+class OverlayEntry(NamedTuple):
+    name: str
+    popularity: int
+    suffixes: Tuple[str, ...]
+    trigrams: frozenset
+
+
+class Suggestions(ModelFile[SuggestionIndex]):
+    """
+    The suggestion index of this process, kept in step with SUGGESTIONS_FILE and its journal.
+    """
+
+    def __init__(self):
+        super().__init__("SUGGESTIONS_FILE", SuggestionIndex.load, SUGGESTIONS)
+        # (kind, id) -> the latest journaled state of the name, None when it was deleted
+        self._overlay: Dict[Tuple[int, int], Optional[OverlayEntry]] = {}
+        # (journal inode, index version, bytes read)
+        self._journal_position: Tuple[int, int, int] = (0, 0, 0)
+        self._overlay_lock = threading.Lock()
+
+    def journal_path(self) -> Path:
+        return self.path().with_suffix(".journal")
+
+    def rebuild(self) -> SuggestionIndex:
+        """
+        The rebuild function builds the index from the Tag and Author tables, replaces the model file
+        and starts an empty journal.
+
+        :return: The new index
+        """
+        with self.file_lock():
+            authors = Author.objects.annotate(popularity=Count("quote")).order_by("pk")
+            authors = authors.values_list("pk", "fullname", "popularity")
+            tags = Tag.objects.order_by("pk").values_list("pk", "name", "quote_count")
+            index = SuggestionIndex.build(
+                [(AUTHOR, *row) for row in authors.iterator(chunk_size=10000)]
+                + [(TAG, *row) for row in tags.iterator(chunk_size=10000)]
+            )
+            self.replace(index)
+            # A new file rather than a truncated one, so readers see a new inode and start over
+            with tempfile.NamedTemporaryFile(dir=self.path().parent, suffix=".tmp", delete=False) as fp:
+                pass
+            os.replace(fp.name, self.journal_path())
+        return index
+
+    def record(self, changes: List[Change]) -> None:
+        """
+        The record function appends changed names to the journal, unless the index was never built.
+
+        :param changes: (kind, id, name, popularity) tuples, name None for a deleted one
+        :return: None
+        """
+        if not changes or not self.path().exists():
+            return
+        lines = "".join(json.dumps(change) + "\n" for change in changes)
+        with self.file_lock():
+            with open(self.journal_path(), "a", encoding="utf-8") as journal:
+                journal.write(lines)
+
+    def record_on_commit(self, changes: List[Change]) -> None:
+        if changes and self.path().exists():
+            transaction.on_commit(lambda: self.record(changes))
+
+    def overlay(self, index: SuggestionIndex) -> Dict[Tuple[int, int], Optional[OverlayEntry]]:
+        """
+        The overlay function returns the names journaled since the snapshot of the index, reading the lines
+        appended since the last call. It costs one stat() when there are none.
+
+        :param index: The current index
+        :return: The changed names, by (kind, id)
+        """
+        try:
+            stat = self.journal_path().stat()
+        except FileNotFoundError:
+            return {}
+        with self._overlay_lock:
+            inode, version, position = self._journal_position
+            if (inode, version) != (stat.st_ino, index.version) or stat.st_size < position:
+                self._overlay, position = {}, 0
+            if stat.st_size > position:
+                with open(self.journal_path(), "rb") as journal:
+                    journal.seek(position)
+                    data = journal.read(stat.st_size - position)
+                # A line being appended right now is read next time
+                data = data[: data.rfind(b"\n") + 1]
+                overlay = dict(self._overlay)
+                for line in data.splitlines():
+                    kind, pk, name, popularity = json.loads(line)
+                    normalized = normalize_name(name) if name else ""
+                    overlay[(kind, pk)] = (
+                        OverlayEntry(name, popularity, tuple(word_suffixes(normalized)), frozenset(trigrams(normalized)))
+                        if normalized
+                        else None
+                    )
+                self._overlay, position = overlay, position + len(data)
+            self._journal_position = (stat.st_ino, index.version, position)
+            return self._overlay
+
+    def suggest(self, query: str, limit: int) -> List[Suggestion]:
+        """
+        The suggest function returns the tags and authors with a word starting with the query, most popular first.
+        When there are fewer than limit of them, the names most similar to the query follow.
+
+        :param query: The typed text
+        :param limit: How many suggestions to return at most
+        :return: The suggestions
+        """
+        index = self.current()
+        prefix = normalize_name(query)
+        if index is None or not prefix:
+            return []
+        overlay = self.overlay(index)
+
+        def visible(i: int) -> bool:
+            return (int(index.kinds[i]), int(index.ids[i])) not in overlay
+
+        matches = [index.entry(i) for i in index.prefix_matches(prefix, limit * POOL_FACTOR) if visible(i)]
+        matches += [
+            Suggestion(KINDS[kind], pk, entry.name, entry.popularity)
+            for (kind, pk), entry in overlay.items()
+            if entry is not None and any(suffix.startswith(prefix) for suffix in entry.suffixes)
+        ]
+        matches = sorted(matches, key=lambda match: -match.popularity)[:limit]
+        if len(matches) == limit:
+            return matches
+
+        grams = trigrams(prefix)
+        similar = [
+            (similarity, index.entry(i)) for similarity, i in index.fuzzy_matches(grams, limit * POOL_FACTOR) if visible(i)
+        ]
+        for (kind, pk), entry in overlay.items():
+            if entry is not None and entry.trigrams:
+                similarity = len(grams & entry.trigrams) / len(grams)
+                if similarity >= TRIGRAM_SIMILARITY:
+                    similar.append((similarity, Suggestion(KINDS[kind], pk, entry.name, entry.popularity)))
+        found = {(match.kind, match.id) for match in matches}
+        for _, match in sorted(similar, key=lambda item: (-item[0], -item[1].popularity)):
+            if len(matches) == limit:
+                break
+            if (match.kind, match.id) not in found:
+                found.add((match.kind, match.id))
+                matches.append(match)
+        return matches
+
+
+suggestions = Suggestions()
@@ -0,0 +1,68 @@
+import threading
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from django.db.models.functions import Lower
+from quotes.routers import may_be_stale
+
+from .models import Tag, normalize_tag_name
+from .versions import TOP_TAGS, get_versions
+
+# Names of unknown tags are remembered too; the whole map is dropped when it grows past this size
+MAX_CACHED_TAGS = 10000
+
+
+class TagEntry(NamedTuple):
+    id: int
+    name: str
+    quote_count: int
+
+
+class TagRegistry:
+    """
+    Process-local map of canonical tag names to their ids and quote counts, so hot tag lookups skip the database.
+    Every tag write (a save, a delete or a quote count change) bumps the TOP_TAGS version, which drops the map
+    in every process; misses are then resolved one by one on the case-insensitive unique index of Tag.name.
+    The modification time is part of the version, because version numbers start over when the cache is flushed.
+    A miss read from a replica right after a change isn't stored, see quotes.routers.
+    """
+
+    def __init__(self, max_size: int = MAX_CACHED_TAGS):
+        self.max_size = max_size
+        self._entries: Dict[str, Optional[TagEntry]] = {}
+        self._version: Optional[Tuple[int, float]] = None
+        self._lock = threading.Lock()
+
+    def lookup(self, name: str) -> Optional[TagEntry]:
+        """
+        The lookup function returns the tag with the given name, in any letter case.
+
+        :param name: The tag name
+        :return: The tag entry, or None when there is no such tag
+        """
+        name = normalize_tag_name(name)
+        version = get_versions([TOP_TAGS])[TOP_TAGS]
+        with self._lock:
+            if version != self._version:
+                self._entries = {}
+                self._version = version
+            if name in self._entries:
+                return self._entries[name]
+
+        row = Tag.objects.alias(name_lower=Lower("name")).filter(name_lower=name).values_list("pk", "name", "quote_count").first()
+        entry = TagEntry(*row) if row else None
+        stale = may_be_stale(version[1])
+        with self._lock:
+            # Don't store a result read under an older version than the map's, or one a replica may not have caught up on
+            if version == self._version and not stale:
+                if len(self._entries) >= self.max_size:
+                    self._entries = {}
+                self._entries[name] = entry
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = {}
+            self._version = None
+
+
+tag_registry = TagRegistry()
@@ -0,0 +1,86 @@
+from collections import Counter
+from threading import Lock
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from quotes.routers import may_be_stale
+
+from ..versions import get_versions
+
+register = template.Library()
+
+FRAGMENT_KEY = "quoteapp:fragment:{}:{}"
+# The latest modification time of the content versions read by the template, see content_version
+CONTENT_MODIFIED = "quoteapp:content_modified"
+
+_stats = Counter()
+_stats_lock = Lock()
+
+
+def fragment_cache_stats() -> dict:
+    """
+    The fragment_cache_stats function returns the hit and miss counters of this process,
+    per fragment name, e.g. {"quote_card": {"hits": 10, "misses": 2}}.
+
+    :return: The counters
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    names = {name for name, _ in stats}
+    return {name: {"hits": stats.get((name, "hits"), 0), "misses": stats.get((name, "misses"), 0)} for name in sorted(names)}
+
+
+def reset_fragment_cache_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+
+def fragment_key(name: str, *key_parts) -> str:
+    return FRAGMENT_KEY.format(name, ":".join(map(str, key_parts)))
+
+
+class CachedFragmentNode(template.Node):
+    def __init__(self, nodelist, name, key_parts):
+        self.nodelist = nodelist
+        self.name = name
+        self.key_parts = key_parts
+
+    def render(self, context):
+        key = fragment_key(self.name, *(part.resolve(context) for part in self.key_parts))
+        html = cache.get(key)
+        with _stats_lock:
+            _stats[self.name, "misses" if html is None else "hits"] += 1
+        if html is None:
+            html = self.nodelist.render(context)
+            modified = context.render_context.get(CONTENT_MODIFIED)
+            # Rendered from a replica that may not have the change behind the version yet, see quotes.routers
+            if modified is None or not may_be_stale(modified):
+                cache.set(key, html, getattr(settings, "FRAGMENT_CACHE_TIMEOUT", 24 * 60 * 60))
+        return html
+
+
+@register.tag
+def cachedfragment(parser, token):
+    """
+    Caches the rendered HTML of the enclosed block under its name plus the given key parts::
+
+        {% cachedfragment quote_card quote.pk quote.version %} ... {% endcachedfragment %}
+
+    The key parts must include a content version, so any change of the content
+    produces a new key and a stale fragment is never served. Versions of a scope are read with content_version,
+    which lets a fragment rendered right after a change skip the cache.
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a fragment name and at least one key part")
+    nodelist = parser.parse(("endcachedfragment",))
+    parser.delete_first_token()
+    return CachedFragmentNode(nodelist, bits[1], [parser.compile_filter(bit) for bit in bits[2:]])
+
+
+@register.simple_tag(takes_context=True)
+def content_version(context, scope):
+    version, modified = get_versions([scope])[scope]
+    context.render_context[CONTENT_MODIFIED] = max(modified, context.render_context.get(CONTENT_MODIFIED, 0))
+    return version
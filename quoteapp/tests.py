@@ -1 +1,941 @@
-# Create your tests here.
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+
+import numpy as np
+from asgiref.sync import ThreadSensitiveContext, async_to_sync, iscoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.db import IntegrityError, connections, transaction
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+from quotes.profiling import Profiler, ProfilingASGIMiddleware, ProfilingWSGIMiddleware, StackSampler
+from quotes.routers import PIN_COOKIE, PrimaryPinningMiddleware, ReplicaHealth, ReplicaRouter, pin_scope, replica_health
+
+from .benchmarks import BENCHMARK_USERNAME
+from .counters import reconcile_tag_counts
+from .fingerprints import find_duplicates, fingerprint
+from .forms import QuoteForm
+from .importers import BulkLoader
+from .picks import quote_id_pools
+from .related import related_tags
+from .instrumentation import QueryBudgetExceeded
+from .modelfiles import save_arrays
+from .models import Author, DailyQuote, ImportCheckpoint, Quote, QuoteBucket, QuoteCard, Tag
+from .search import cached_search_quotes, search_cache
+from .similar import SimilarQuotes, SimilarQuotesFile, card_rows
+from .suggestions import SuggestionIndex, join_lines, suggestions
+from .tags import tag_registry
+from .templatetags.fragments import fragment_cache_stats, reset_fragment_cache_stats
+from .versions import CATALOG, bump_version, get_versions, tag_scope
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class TagQuoteCountTests(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(fullname="Albert Einstein", born_location="Ulm", description="Physicist")
+        self.life, self.love = Tag.objects.create(name="life"), Tag.objects.create(name="love")
+        self.quote = Quote.objects.create(quote="Life is like riding a bicycle.", author=self.author)
+
+    def assertCounts(self, life, love):
+        self.life.refresh_from_db()
+        self.love.refresh_from_db()
+        self.assertEqual((self.life.quote_count, self.love.quote_count), (life, love))
+
+    def test_counts_follow_tag_changes(self):
+        self.quote.tags.add(self.life, self.love)
+        self.assertCounts(1, 1)
+        self.quote.tags.add(self.life)
+        self.assertCounts(1, 1)
+        self.love.quote_set.remove(self.quote)
+        self.assertCounts(1, 0)
+        self.quote.tags.set([self.love])
+        self.assertCounts(0, 1)
+        self.quote.delete()
+        self.assertCounts(0, 0)
+
+    def test_reconcile_fixes_drift(self):
+        self.quote.tags.add(self.life)
+        Tag.objects.update(quote_count=7)
+        self.assertEqual(reconcile_tag_counts(), 2)
+        self.assertCounts(1, 0)
+
+
+class TagRegistryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.life = Tag.objects.create(name=" Life ")
+
+    def test_names_are_unique_case_insensitively(self):
+        self.assertEqual(self.life.name, "life")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Tag.objects.bulk_create([Tag(name="LIFE")])
+
+        self.assertRedirects(self.client.post("/add_tag/", {"name": "LiFe"}), "/", fetch_redirect_response=False)
+        self.assertEqual(Tag.objects.count(), 1)
+
+    def test_lookups_are_cached_until_a_tag_changes(self):
+        self.assertEqual(tag_registry.lookup("LIFE"), (self.life.pk, "life", 0))
+        self.assertIsNone(tag_registry.lookup("love"))
+        with self.assertNumQueries(0):
+            self.assertEqual(tag_registry.lookup("life").id, self.life.pk)
+            self.assertIsNone(tag_registry.lookup("Love"))
+
+        Tag.objects.create(name="love")
+        with self.assertNumQueries(1):
+            self.assertEqual(tag_registry.lookup("love").name, "love")
+
+    def test_tag_page_redirects_to_the_canonical_name(self):
+        self.assertRedirects(self.client.get("/tag/Life"), "/tag/life", status_code=301, fetch_redirect_response=False)
+        self.assertEqual(self.client.get("/tag/love").status_code, 404)
+
+    def test_imported_tag_names_are_normalized(self):
+        author = Author.objects.create(fullname="Albert Einstein", born_location="Ulm", description="Physicist")
+        loader = BulkLoader()
+        loader.add_quote("Life is like riding a bicycle.", author.fullname, ["LIFE", "life ", "Love"])
+        loader.flush()
+        quote = Quote.objects.get()
+        self.assertEqual(sorted(quote.tags.values_list("name", flat=True)), ["life", "love"])
+        self.assertEqual(quote.card.tag_names, ["life", "love"])
+
+
+class RelatedTagsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings = override_settings(RELATED_TAGS_FILE=Path(self.media) / "related_tags.npz")
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        author = Author.objects.create(fullname="Albert Einstein", born_location="Ulm", description="Physicist")
+        self.life, self.love, self.hope, self.truth = [
+            Tag.objects.create(name=name) for name in ("life", "love", "hope", "truth")
+        ]
+        for tags in ([self.life, self.love], [self.life, self.love, self.hope], [self.life, self.hope], [self.truth]):
+            Quote.objects.create(quote="A quote", author=author).tags.set(tags)
+
+    def test_build_and_top_k(self):
+        self.assertIsNone(related_tags.current())
+        call_command("build_related_tags", stdout=StringIO())
+        cooccurrence = related_tags.current()
+        self.assertEqual(cooccurrence.top_k(self.life.pk, 5), [(self.love.pk, 2), (self.hope.pk, 2)])
+        self.assertEqual(cooccurrence.top_k(self.love.pk, 1), [(self.life.pk, 2)])
+        self.assertEqual(cooccurrence.top_k(self.truth.pk, 5), [])
+
+    def test_incremental_updates(self):
+        call_command("build_related_tags", stdout=StringIO())
+        built = related_tags.path().stat()
+        quote = Quote.objects.get(tags=self.truth)
+        with self.captureOnCommitCallbacks(execute=True):
+            quote.tags.add(self.life, self.hope)
+        self.assertEqual(
+            related_tags.current().top_k(self.life.pk, 5), [(self.hope.pk, 3), (self.love.pk, 2), (self.truth.pk, 1)]
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Quote.objects.filter(tags=self.love).first().delete()
+            self.life.quote_set.remove(quote)
+        incremental = related_tags.current().top_k(self.life.pk, 5)
+        # The changes went to the journal, the matrix file is only written by the rebuild
+        self.assertEqual(related_tags.path().stat().st_mtime_ns, built.st_mtime_ns)
+        self.assertEqual(len(related_tags.journal_path().read_text().splitlines()), 3)
+        self.assertEqual(incremental, related_tags.rebuild().top_k(self.life.pk, 5))
+        self.assertEqual(incremental, [(self.hope.pk, 2), (self.love.pk, 1)])
+        self.assertEqual(related_tags.journal_path().read_text(), "")
+
+    def test_import_records_its_changes_once(self):
+        call_command("build_related_tags", stdout=StringIO())
+        loader = BulkLoader(batch_size=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            loader.add_quote("Love is the answer.", "Albert Einstein", ["love", "hope"])
+            loader.add_quote("Life is a journey.", "Albert Einstein", ["life", "hope"])
+            loader.add_quote("A quote", "Albert Einstein", ["life", "truth"])
+            loader.flush()
+        self.assertFalse(related_tags.journal_path().read_text())
+
+        loader.flush_related_tags()
+        self.assertEqual(len(related_tags.journal_path().read_text().splitlines()), 1)
+        self.assertEqual(related_tags.current().top_k(self.life.pk, 5), related_tags.rebuild().top_k(self.life.pk, 5))
+
+    def test_tag_page_panel(self):
+        self.assertNotContains(self.client.get("/tag/life"), "Related tags")
+        call_command("build_related_tags", stdout=StringIO())
+        response = self.client.get("/tag/life")
+        self.assertEqual([tag.name for tag in response.context["related_tags"]()], ["love", "hope"])
+        self.assertContains(response, 'title="2 quotes in common"', count=2)
+
+
+class SimilarQuotesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings = override_settings(SIMILAR_QUOTES_FILE=Path(self.media) / "similar_quotes.npz")
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.einstein = Author.objects.create(fullname="Albert Einstein", born_location="Ulm", description="Physicist")
+        self.austen = Author.objects.create(fullname="Jane Austen", born_location="Steventon", description="Novelist")
+        life = Tag.objects.create(name="life")
+        for author, text in (
+            (self.einstein, "Life is like riding a bicycle."),
+            (self.austen, "A lady's imagination is very rapid."),
+            (self.austen, "Life is a bicycle ride, keep riding."),
+            (self.einstein, "Imagination is more important than knowledge."),
+        ):
+            Quote.objects.create(quote=text, author=author).tags.add(life)
+        self.bicycle, self.lady, self.ride, self.imagination = Quote.objects.order_by("pk")
+
+    def test_blocks_give_the_same_neighbours(self):
+        rows = list(card_rows())
+        whole, blocked = SimilarQuotes.build(rows, k=2), SimilarQuotes.build(rows, k=2, block_bytes=1)
+        self.assertEqual(whole.neighbours.tolist(), blocked.neighbours.tolist())
+        self.assertEqual(whole.similar_ids(self.bicycle.pk, 1), [self.ride.pk])
+        self.assertEqual(whole.similar_ids(self.imagination.pk, 1), [self.lady.pk])
+
+    def test_pages(self):
+        self.assertEqual(self.client.get(f"/quote/{self.bicycle.pk}/similar").context["quotes"], [])
+        call_command("build_similar_quotes", stdout=StringIO())
+
+        response = self.client.get(f"/quote/{self.bicycle.pk}/similar")
+        self.assertEqual(response.context["quotes"][0].pk, self.ride.pk)
+        self.assertEqual(self.client.get("/quote/0/similar").status_code, 404)
+        response = self.client.get("/author/Albert Einstein")
+        self.assertEqual([card.pk for card in response.context["similar_quotes"]], [self.ride.pk, self.lady.pk])
+
+    def test_refresh_adds_new_quotes(self):
+        call_command("build_similar_quotes", "--neighbours", "1", stdout=StringIO())
+        unicycle = Quote.objects.create(quote="Life is like riding a bicycle, or a unicycle.", author=self.austen)
+        call_command("build_similar_quotes", "--refresh", stdout=StringIO())
+
+        # Like a web worker, which only loads the neighbour lists
+        model = SimilarQuotesFile().current()
+        self.assertFalse(hasattr(model, "vectors"))
+        self.assertEqual(len(model.quote_ids), 5)
+        self.assertEqual(model.similar_ids(unicycle.pk, 1), [self.bicycle.pk])
+        self.assertEqual(model.similar_ids(self.bicycle.pk, 1), [unicycle.pk])
+
+
+class PickTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = Author.objects.create(fullname="Albert Einstein", born_location="Ulm", description="Physicist")
+        self.life = Tag.objects.create(name="life")
+        self.quotes = [Quote.objects.create(quote=f"Quote number {i}", author=author) for i in range(6)]
+        self.life.quote_set.add(*self.quotes[:2])
+
+    def test_random_quote(self):
+        self.client.get("/random/")
+        # The id array is cached, so a pick is a single primary key lookup
+        with self.assertNumQueries(1):
+            response = self.client.get("/random/")
+        self.assertIn(response.context["quote"].pk, [quote.pk for quote in self.quotes])
+        self.assertEqual(response["Cache-Control"], "max-age=0, no-cache, no-store, must-revalidate, private")
+
+        for _ in range(10):
+            self.assertIn(
+                self.client.get("/random/", {"tag": "Life"}).context["quote"].pk, [self.quotes[0].pk, self.quotes[1].pk]
+            )
+        self.assertEqual(self.client.get("/random/", {"tag": "love"}).status_code, 404)
+
+    def test_id_arrays_follow_writes(self):
+        self.assertEqual(len(quote_id_pools.ids()), 6)
+        self.quotes[0].delete()
+        Quote.objects.create(quote="Another quote", author=self.quotes[1].author).tags.add(self.life)
+        self.assertEqual(len(quote_id_pools.ids()), 6)
+        self.assertNotIn(self.quotes[0].pk, quote_id_pools.ids())
+        self.assertEqual(len(quote_id_pools.ids(tag_registry.lookup("life"))), 2)
+
+    def test_quote_of_the_day_is_stored_once(self):
+        call_command("pick_quotes_of_the_day", "--days", "1", stdout=StringIO())
+        self.assertEqual(DailyQuote.objects.count(), 2)
+        daily = self.client.get("/today/").context["quote"]
+        Quote.objects.create(quote="A new quote", author=self.quotes[0].author)
+        self.assertEqual(self.client.get("/today/").context["quote"], daily)
+        self.assertIn(self.client.get("/today/", {"tag": "life"}).context["quote"].pk, [self.quotes[0].pk, self.quotes[1].pk])
+        self.assertEqual(DailyQuote.objects.count(), 2)
+
+
+class DuplicateQuoteTests(TestCase):
+    TEXT = "The world as we have created it is a process of our thinking. It cannot be changed without changing our thinking."
+
+    def setUp(self):
+        self.author = Author.objects.create(fullname="Albert Einstein", born_location="Ulm", description="Physicist")
+        self.quote = Quote.objects.create(quote=self.TEXT, author=self.author)
+
+    def test_fingerprints_find_exact_and_near_duplicates(self):
+        self.assertEqual(QuoteBucket.objects.filter(quote=self.quote).count(), 16)
+        exact = fingerprint(f"<p>{self.TEXT.upper()}</p>  ")
+        near = fingerprint(self.TEXT.replace("created", "made"))
+        other = fingerprint("Life is like riding a bicycle. To keep your balance you must keep moving.")
+        self.assertEqual(exact.content_hash, self.quote.content_hash)
+
+        with self.assertNumQueries(3):
+            duplicates = find_duplicates([exact, near, other])
+        self.assertEqual(duplicates[0], (self.quote.pk, 1.0))
+        self.assertEqual(duplicates[1].quote_id, self.quote.pk)
+        self.assertLess(duplicates[1].similarity, 1.0)
+        self.assertIsNone(duplicates[2])
+        self.assertEqual(find_duplicates([exact], exclude=self.quote.pk), [None])
+
+    def test_import_skips_duplicates_and_merges_their_tags(self):
+        loader = BulkLoader()
+        loader.add_quote(self.TEXT.replace("thinking", "Thinking!"), "Albert Einstein", ["change"])
+        loader.add_quote("Imagination is more important than knowledge.", "Albert Einstein", ["imagination"])
+        loader.add_quote("Imagination is more important than knowledge!", "Albert Einstein", ["knowledge"])
+        loader.flush()
+
+        self.assertEqual(loader.stats["quotes"], 1)
+        self.assertEqual(loader.stats["quotes_duplicate"], 2)
+        self.assertEqual(Quote.objects.count(), 2)
+        self.assertEqual(QuoteCard.objects.get(pk=self.quote.pk).tag_names, ["change"])
+        imagination = Quote.objects.get(quote__startswith="Imagination")
+        self.assertEqual(sorted(imagination.tags.values_list("name", flat=True)), ["imagination", "knowledge"])
+        self.assertEqual(Tag.objects.get(name="change").quote_count, 1)
+
+    def test_quote_form_warns_before_saving_a_duplicate(self):
+        data = {"quote": self.TEXT.replace("created", "made"), "author": self.author.pk}
+        form = QuoteForm(data)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.duplicate.pk, self.quote.pk)
+        self.assertTrue(QuoteForm({**data, "save_anyway": "on"}).is_valid())
+        self.assertTrue(QuoteForm({**data, "quote": "Life is like riding a bicycle."}).is_valid())
+
+
+class ListingQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        authors = [Author.objects.create(fullname=f"Author {i}", born_location="Kyiv", description="Writer") for i in range(3)]
+        tags = [Tag.objects.create(name=f"tag{i}") for i in range(4)]
+        for i in range(25):
+            quote = Quote.objects.create(quote=f"Quote number {i}", author=authors[i % 3])
+            quote.tags.set(tags[: i % 4 + 1])
+
+    def setUp(self):
+        cache.clear()
+        search_cache.clear()
+        reset_fragment_cache_stats()
+
+    def test_main_page(self):
+        with self.assertNumQueries(3):
+            response = self.client.get("/")
+        self.assertEqual(len(response.context["quotes"]), 10)
+
+    def test_cached_fragments(self):
+        self.client.get("/")
+        with self.assertNumQueries(2):
+            response = self.client.get("/")
+        self.assertContains(response, "Quote number 9")
+        self.assertEqual(fragment_cache_stats()["quote_card"], {"hits": 10, "misses": 10})
+        self.assertEqual(fragment_cache_stats()["top_tags"], {"hits": 1, "misses": 1})
+
+        Quote.objects.get(quote="Quote number 0").tags.clear()
+        self.client.get("/")
+        self.assertEqual(fragment_cache_stats()["quote_card"], {"hits": 19, "misses": 11})
+        self.assertEqual(fragment_cache_stats()["top_tags"], {"hits": 1, "misses": 2})
+
+    def test_deep_main_page(self):
+        cursor = self.client.get("/").context["quotes"].next_cursor
+        # The tag cloud is already cached by the first request
+        with self.assertNumQueries(2):
+            response = self.client.get("/", {"cursor": cursor})
+        self.assertEqual(len(response.context["quotes"]), 10)
+
+    def test_tag_page(self):
+        with self.assertNumQueries(3):
+            response = self.client.get("/tag/tag3")
+        self.assertEqual(len(response.context["quotes"]), 6)
+
+    def test_search_page(self):
+        # Every quote matches, "Quote number N"
+        with self.assertNumQueries(3):
+            response = self.client.get("/search/", {"q": "quote"})
+        self.assertEqual(len(response.context["quotes"]), 10)
+        self.assertEqual(response.context["quotes"].estimated_total, 25)
+
+        # The next page reuses the cached result ids and tag cloud and only loads its cards
+        with self.assertNumQueries(1):
+            response = self.client.get("/search/", {"q": "quote", "cursor": response.context["quotes"].next_cursor})
+        self.assertEqual(len(response.context["quotes"]), 10)
+
+    def test_search_cache_is_invalidated_by_writes(self):
+        self.assertEqual(self.client.get("/search/", {"q": "bicycle"}).context["quotes"].estimated_total, 0)
+        Quote.objects.create(quote="Life is like riding a bicycle.", author=Author.objects.first())
+        self.assertEqual(self.client.get("/search/", {"q": "bicycle"}).context["quotes"].estimated_total, 1)
+
+    def test_old_search_urls_redirect(self):
+        response = self.client.post("/search_data/None/1", {"search_input": " Author  1!"})
+        self.assertRedirects(response, "/search/?q=author%201", fetch_redirect_response=False)
+
+    def test_cards_follow_writes(self):
+        quote = Quote.objects.get(quote="Quote number 3")
+        author = quote.author
+        author.fullname = "Renamed Author"
+        author.save()
+        tag = Tag.objects.get(name="tag0")
+        tag.name = "first"
+        tag.save()
+        quote.tags.remove(Tag.objects.get(name="tag3"))
+
+        card = QuoteCard.objects.get(pk=quote.pk)
+        self.assertEqual(card.author_name, "Renamed Author")
+        self.assertEqual(card.tag_names, ["first", "tag1", "tag2"])
+
+    def test_conditional_get(self):
+        with mock.patch("quoteapp.conditional.time") as clock:
+            # The pages are read a second after the quotes were written
+            clock.time.return_value = time.time() + 1
+            response = self.client.get("/tag/tag3")
+            etag, last_modified = response["ETag"], response["Last-Modified"]
+            self.assertIn("Cookie", response["Vary"])
+
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get("/tag/tag3", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                self.assertEqual(self.client.get("/tag/tag3", HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+            self.assertNotEqual(self.client.get("/tag/tag2")["ETag"], etag)
+
+        # Writes that don't touch the tag's quotes keep its page valid, the others change the ETag
+        quote = Quote.objects.get(quote="Quote number 0")
+        quote.quote = "Edited quote"
+        quote.save()
+        self.assertEqual(self.client.get("/tag/tag3", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Quote.objects.get(quote="Quote number 3").tags.remove(Tag.objects.get(name="tag3"))
+        self.assertEqual(self.client.get("/tag/tag3", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Within the second of a change another one could follow with the same Last-Modified
+        with mock.patch("quoteapp.conditional.time") as clock:
+            clock.time.return_value = get_versions([tag_scope("tag3")])[tag_scope("tag3")][1]
+            response = self.client.get("/tag/tag3", HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header("Last-Modified"))
+            self.assertEqual(self.client.get("/tag/tag3", HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_evicted_versions_change_the_etag(self):
+        etag = self.client.get("/tag/tag3")["ETag"]
+        # The versions are lost (evicted, or the cache restarted) and the quote is edited meanwhile
+        cache.clear()
+        Quote.objects.filter(quote="Quote number 3").update(quote="Edited quote")
+        self.assertEqual(self.client.get("/tag/tag3", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = Author.objects.create(fullname="Albert Einstein", born_location="Ulm", description="Physicist")
+        quote = Quote.objects.create(quote="Life is like riding a bicycle.", author=author)
+        quote.tags.add(Tag.objects.create(name="life"))
+
+    async def test_asgi_requests_get_the_async_views(self):
+        for path in ["/", "/tag/life", "/author/Albert Einstein", "/search/?q=bicycle"]:
+            sync_response = await sync_to_async(self.client.get)(path)
+            response = await self.async_client.get(path)
+            self.assertTrue(iscoroutinefunction(resolve(path.split("?")[0], urlconf=response.asgi_request.urlconf).func))
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, "Albert Einstein")
+            self.assertEqual(response["ETag"], sync_response["ETag"])
+            not_modified = await self.async_client.get(path, headers={"If-None-Match": response["ETag"]})
+            self.assertEqual(not_modified.status_code, 304)
+
+        response = await self.async_client.get("/search_data/bicycle")
+        self.assertRedirects(response, "/search/?q=bicycle", status_code=301, fetch_redirect_response=False)
+        self.assertEqual((await self.async_client.get("/tag/Life")).status_code, 301)
+
+    def test_top_tags_are_only_read_when_their_fragment_is_stale(self):
+        async def get(path, data=None):
+            return await self.async_client.get(path, data)
+
+        with self.assertNumQueries(3):
+            response = async_to_sync(get)("/")
+        self.assertContains(response, "/tag/life")
+        # The page and the estimated count; the tag cloud comes from the fragment cache
+        with self.assertNumQueries(2):
+            async_to_sync(get)("/", {"cursor": "x"})
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            Author.objects.create(fullname=name, born_location="Earth", description="Scientist")
+            for name in ("Albert Einstein", "Alan Turing", "Marie Curie")
+        ]
+        cls.tags = [Tag.objects.create(name=f"life-{i:02}") for i in range(25)] + [Tag.objects.create(name="love")]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_choices_are_prefix_matches_paged_and_cached(self):
+        data = self.client.get("/api/tags/choices/", {"q": " LIF"}).json()
+        self.assertEqual([choice["text"] for choice in data["results"]], [f"life-{i:02}" for i in range(20)])
+        data = self.client.get(data["next"]).json()
+        self.assertEqual([choice["text"] for choice in data["results"]], [f"life-{i:02}" for i in range(20, 25)])
+        self.assertIsNone(data["next"])
+
+        data = self.client.get("/api/authors/choices/", {"q": "al"}).json()
+        expected = [{"id": self.authors[1].pk, "text": "Alan Turing"}, {"id": self.authors[0].pk, "text": "Albert Einstein"}]
+        self.assertEqual(data["results"], expected)
+        with self.assertNumQueries(0):
+            self.client.get("/api/authors/choices/", {"q": "Al"})
+        Author.objects.create(fullname="Alice Ball", born_location="Seattle", description="Chemist")
+        data = self.client.get("/api/authors/choices/", {"q": "al"}).json()
+        self.assertEqual([choice["text"] for choice in data["results"]], ["Alan Turing", "Albert Einstein", "Alice Ball"])
+
+    def test_names_that_only_differ_in_case_are_paged_by_id(self):
+        names = [f"Zed {i:02}" for i in range(19)] + ["Zed Tie", "ZED TIE", "zed tie"]
+        for name in names:
+            Author.objects.create(fullname=name, born_location="Earth", description="Writer")
+        data = self.client.get("/api/authors/choices/", {"q": "zed"}).json()
+        texts = [choice["text"] for choice in data["results"]]
+        data = self.client.get(data["next"]).json()
+        self.assertEqual(texts + [choice["text"] for choice in data["results"]], names)
+        self.assertIsNone(data["next"])
+
+    def test_quote_form_only_reads_the_selected_choices(self):
+        response = self.client.get("/add_quote/")
+        self.assertContains(response, 'data-autocomplete-url="/api/tags/choices/"')
+        self.assertNotContains(response, "Marie Curie")
+        self.assertNotContains(response, "life-00")
+
+        tag_ids = [self.tags[0].pk, self.tags[-1].pk]
+        data = {"quote": "Nothing in life is to be feared.", "author": self.authors[2].pk, "tags": tag_ids}
+        form = QuoteForm(data)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(form.fields["tags"].clean(data["tags"])), [self.tags[0], self.tags[-1]])
+        # An unknown tag id: the form is shown again with the selected tags only
+        response = self.client.post("/add_quote/", {**data, "tags": [self.tags[0].pk, 0]})
+        self.assertContains(response, "life-00")
+        self.assertNotContains(response, "life-01")
+
+        self.assertRedirects(self.client.post("/add_quote/", data), "/", fetch_redirect_response=False)
+        quote = Quote.objects.get(quote=data["quote"])
+        self.assertEqual((quote.author, set(quote.tags.all())), (self.authors[2], {self.tags[0], self.tags[-1]}))
+
+
+class SuggestionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings = override_settings(SUGGESTIONS_FILE=Path(self.media) / "suggestions.npz")
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.einstein, self.camus, self.austen = [
+            Author.objects.create(fullname=name, born_location="Earth", description="Writer")
+            for name in ("Albert Einstein", "Albert Camus", "Jane Austen")
+        ]
+        self.life, self.love, self.literature = [Tag.objects.create(name=name) for name in ("life", "love", "literature")]
+        for author, tags in ((self.einstein, [self.life]), (self.einstein, [self.life, self.love]), (self.austen, [self.life])):
+            Quote.objects.create(quote="A quote", author=author).tags.set(tags)
+
+    def suggest(self, query, limit=3):
+        return [suggestion.name for suggestion in suggestions.suggest(query, limit)]
+
+    def test_prefix_matches_are_ranked_by_popularity(self):
+        self.assertEqual(self.suggest("al"), [])
+        call_command("build_suggestions", stdout=StringIO())
+        self.assertEqual(self.suggest("Al"), ["Albert Einstein", "Albert Camus"])
+        self.assertEqual(self.suggest("l"), ["life", "love", "literature"])
+        # The other Albert follows as a fuzzy match
+        self.assertEqual(self.suggest(" albert  EIN"), ["Albert Einstein", "Albert Camus"])
+        self.assertEqual(self.suggest("aust", limit=1), ["Jane Austen"])
+        # Fuzzy matches follow the prefix matches
+        self.assertEqual(self.suggest("einstien"), ["Albert Einstein"])
+        self.assertEqual(self.suggest("lov"), ["love"])
+        self.assertEqual(self.suggest("xyz"), [])
+
+    def test_long_prefixes_are_found_in_the_packed_keys(self):
+        Author.objects.create(fullname="Émile Zola", born_location="Paris", description="Writer")
+        Tag.objects.create(name="élan")
+        index = suggestions.rebuild()
+        self.assertEqual(self.suggest("émi", limit=1), ["Émile Zola"])
+        self.assertEqual(self.suggest("ÉLA", limit=1), ["élan"])
+        self.assertEqual(self.suggest("albert ca", limit=1), ["Albert Camus"])
+
+        # A file saved before the keys got offsets
+        arrays = {name: array for name, array in index.arrays.items() if name != "key_offsets"}
+        arrays["keys"] = join_lines([key.decode() for key in index.keys])
+        path = Path(self.media) / "old.npz"
+        save_arrays(path, version=np.int64(index.version), **arrays)
+        old = SuggestionIndex.load(path)
+        self.assertEqual(list(old.keys), list(index.keys))
+        self.assertEqual(old.prefix_matches("émi", 3), index.prefix_matches("émi", 3))
+
+    def test_changes_are_journaled(self):
+        call_command("build_suggestions", stdout=StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name="liberty")
+            self.camus.fullname = "Albert Camus-Sintes"
+            self.camus.save()
+            self.life.delete()
+        self.assertEqual(self.suggest("li"), ["literature", "liberty"])
+        self.assertEqual(self.suggest("albert c", limit=1), ["Albert Camus-Sintes"])
+        self.assertEqual(self.suggest("sintes"), ["Albert Camus-Sintes"])
+
+        suggestions.rebuild()
+        self.assertEqual(suggestions.journal_path().stat().st_size, 0)
+        self.assertEqual(self.suggest("li"), ["literature", "liberty"])
+        self.assertEqual(self.suggest("albert c", limit=1), ["Albert Camus-Sintes"])
+
+    def test_endpoint(self):
+        self.assertEqual(self.client.get("/api/suggestions/", {"q": "ein"}).json(), {"results": []})
+        call_command("build_suggestions", stdout=StringIO())
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/suggestions/", {"q": "ein"})
+        self.assertEqual(
+            response.json(), {"results": [{"kind": "author", "text": "Albert Einstein", "url": "/author/Albert%20Einstein"}]}
+        )
+        self.assertEqual(response["Cache-Control"], "public, max-age=60")
+        results = self.client.get("/api/suggestions/", {"q": "lo"}).json()["results"]
+        self.assertEqual(results[0], {"kind": "tag", "text": "love", "url": "/tag/love"})
+        self.assertContains(self.client.get("/"), 'data-suggest-url="/api/suggestions/"')
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        authors = [Author.objects.create(fullname=f"Author {i}", born_location="Kyiv", description="Writer") for i in range(2)]
+        life, love = Tag.objects.create(name="life"), Tag.objects.create(name="love")
+        for i in range(5):
+            quote = Quote.objects.create(quote=f"Quote number {i}", author=authors[i % 2])
+            quote.tags.set([life, love] if i % 2 else [life])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_quotes_pages_and_filters(self):
+        # The tag lookup (cached afterwards), the page and its prefetched tags
+        with self.assertNumQueries(3):
+            data = self.client.get("/api/quotes/", {"tag": "Love", "limit": 1}).json()
+        quote = Quote.objects.get(quote="Quote number 1")
+        expected = {"id": quote.pk, "quote": "Quote number 1", "author": "Author 1", "tags": ["life", "love"]}
+        self.assertEqual(data["results"], [expected])
+
+        data = self.client.get(data["next"]).json()
+        self.assertEqual([quote["quote"] for quote in data["results"]], ["Quote number 3"])
+        self.assertIsNone(data["next"])
+
+        with self.assertNumQueries(1):
+            data = self.client.get("/api/quotes/", {"author": "Author 0", "fields": "quote"}).json()
+        self.assertEqual(data["results"], [{"quote": f"Quote number {i}"} for i in (0, 2, 4)])
+        self.assertEqual(self.client.get("/api/quotes/", {"fields": "quote,secret"}).status_code, 400)
+
+    def test_export_streams_ndjson(self):
+        response = self.client.get("/api/export.ndjson")
+        records = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([record["type"] for record in records], ["author"] * 2 + ["tag"] * 2 + ["quote"] * 5)
+        self.assertEqual(records[2], {"type": "tag", "id": records[2]["id"], "name": "life", "quote_count": 5})
+
+
+@override_settings(REQUEST_INSTRUMENTATION=True, QUERY_BUDGET_STRICT=True)
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(fullname="Albert Einstein", born_location="Ulm", description="Physicist")
+        Quote.objects.create(quote="Life is like riding a bicycle.", author=author).tags.add(Tag.objects.create(name="life"))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_timings_are_reported(self):
+        with self.assertLogs("quoteapp.instrumentation", "INFO") as logs:
+            response = self.client.get("/tag/life")
+        timing = r'^db;dur=[\d.]+;desc="3 queries, 0 duplicates", tpl;dur=[\d.]+, total;dur=[\d.]+$'
+        self.assertRegex(response["Server-Timing"], timing)
+        metrics = json.loads(logs.records[0].getMessage())
+        self.assertEqual((metrics["view"], metrics["status"], metrics["queries"]), ("quoteapp:look_for_tag", 200, 3))
+
+    def test_pages_stay_within_their_query_budgets(self):
+        for path in ("/", "/tag/life", "/author/Albert Einstein", "/search/?q=life", "/api/quotes/", "/api/tags/"):
+            self.assertEqual(self.client.get(path).status_code, 200)
+
+        with override_settings(QUERY_BUDGETS={"quoteapp:main": 1}):
+            cache.clear()
+            with self.assertRaisesMessage(QueryBudgetExceeded, "quoteapp:main ran 3 queries, its budget is 1"):
+                self.client.get("/")
+
+
+def busy_wsgi_app(environ, start_response):
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+    start_response("200 OK", [])
+    return [b"done"]
+
+
+def busy_loop(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+async def busy_asgi_app(scope, receive, send):
+    # Like Django's ASGIHandler: request_started and the sync code of the request run on one thread per request
+    async with ThreadSensitiveContext():
+        await sync_to_async(request_started.send, thread_sensitive=True)(sender=None, scope=scope)
+        await sync_to_async(busy_loop, thread_sensitive=True)(0.05)
+
+
+def unrelated_work():
+    busy_loop(0.2)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.output_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        self.sampler = StackSampler(interval=0.001, output_dir=self.output_dir)
+
+    def request(self, application, **environ):
+        body = application({"PATH_INFO": "/", **environ}, lambda status, headers: None)
+        b"".join(body)
+        if hasattr(body, "close"):
+            body.close()
+
+    def test_token_requests_are_profiled_per_view(self):
+        application = ProfilingWSGIMiddleware(busy_wsgi_app, Profiler(self.sampler, 0.0, "secret", max_concurrent=1))
+        self.request(application, HTTP_X_PROFILE_TOKEN="wrong")
+        self.request(application, HTTP_X_PROFILE_TOKEN="secret")
+        self.sampler.flush()
+
+        stacks = (self.output_dir / "quoteapp.main.folded").read_text().splitlines()
+        self.assertTrue(stacks)
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in stacks))
+        self.assertTrue(any("quoteapp.tests:busy_wsgi_app" in line for line in stacks))
+        self.assertEqual(len(list(self.output_dir.iterdir())), 1)
+
+    def test_asgi_requests_only_sample_their_own_thread(self):
+        application = ProfilingASGIMiddleware(busy_asgi_app, Profiler(self.sampler, 0.0, "secret", max_concurrent=1))
+        other = threading.Thread(target=unrelated_work)
+        other.start()
+        self.addCleanup(other.join)
+        scope = {"type": "http", "path": "/", "headers": [(b"x-profile-token", b"secret")]}
+        async_to_sync(application)(scope, None, None)
+        self.sampler.flush()
+
+        stacks = (self.output_dir / "quoteapp.main.folded").read_text()
+        self.assertIn("quoteapp.tests:busy_loop", stacks)
+        self.assertNotIn("quoteapp.tests:unrelated_work", stacks)
+
+    def test_unsampled_requests_are_not_profiled(self):
+        application = ProfilingWSGIMiddleware(busy_wsgi_app, Profiler(self.sampler, 0.0, "", max_concurrent=1))
+        self.request(application)
+        self.sampler.flush()
+        self.assertEqual(list(self.output_dir.iterdir()), [])
+
+
+@override_settings(DATABASE_REPLICAS={"replica1": 3, "replica2": 1}, REPLICA_HEALTH_CHECK_INTERVAL=60)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.healthy = {"replica1": True, "replica2": True}
+        patcher = mock.patch.object(ReplicaHealth, "check", side_effect=lambda alias: self.healthy[alias])
+        self.check = patcher.start()
+        self.addCleanup(patcher.stop)
+        replica_health.clear()
+        self.addCleanup(replica_health.clear)
+        self.router = ReplicaRouter()
+
+    def run_in_context(self, func, *args):
+        # Like a request of its own, a write only pins the rest of its scope to the primary
+        with pin_scope():
+            return func(*args)
+
+    def reads(self, count=1):
+        return Counter(self.router.db_for_read(Quote) for _ in range(count))
+
+    def test_reads_are_spread_over_the_replicas_by_weight(self):
+        random.seed(0)
+        reads = self.run_in_context(self.reads, 1000)
+        self.assertEqual(set(reads), {"replica1", "replica2"})
+        self.assertGreater(reads["replica1"], 2 * reads["replica2"])
+        self.assertEqual(self.check.call_count, 2)
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        def write_then_read():
+            self.assertEqual(self.router.db_for_write(Quote), "default")
+            return self.reads(10)
+
+        self.assertEqual(self.run_in_context(write_then_read), {"default": 10})
+        self.assertNotIn("default", self.run_in_context(self.reads, 10))
+
+    def test_results_read_right_after_a_change_are_not_cached(self):
+        cache.clear()
+        search_cache.clear()
+        bump_version(CATALOG)
+        reads = []
+
+        def read(*args):
+            reads.append(self.router.db_for_read(Quote))
+            return [reads[-1]]
+
+        fragment = Template(
+            '{% load fragments %}{% content_version "catalog" as version %}'
+            "{% cachedfragment test version %}{{ read }}{% endcachedfragment %}"
+        )
+        with mock.patch("quoteapp.search.search_quotes", side_effect=read):
+            for _ in range(2):
+                self.run_in_context(cached_search_quotes, "life")
+                self.run_in_context(fragment.render, Context({"read": read}))
+            self.assertEqual(len(reads), 4)
+            # Once the change is older than the replication lag, results from the replicas are cached
+            with override_settings(REPLICA_MAX_LAG=0):
+                for _ in range(2):
+                    self.run_in_context(cached_search_quotes, "life")
+                    self.run_in_context(fragment.render, Context({"read": read}))
+            self.assertEqual(len(reads), 6)
+        self.assertNotIn("default", reads)
+
+    def test_unhealthy_replicas_are_out_of_rotation(self):
+        self.healthy["replica1"] = False
+        with self.assertLogs("quotes.routers", "WARNING"):
+            self.assertEqual(self.run_in_context(self.reads, 20), {"replica2": 20})
+        self.healthy["replica2"] = False
+        with override_settings(REPLICA_HEALTH_CHECK_INTERVAL=0), self.assertLogs("quotes.routers", "WARNING"):
+            self.assertEqual(self.run_in_context(self.reads), {"default": 1})
+            self.healthy["replica1"] = True
+            self.assertEqual(self.run_in_context(self.reads), {"replica1": 1})
+
+    def test_requests_are_pinned_to_the_primary_after_a_write(self):
+        def view(write):
+            def get_response(request):
+                if write:
+                    self.router.db_for_write(Quote)
+                return HttpResponse(self.router.db_for_read(Quote))
+
+            return PrimaryPinningMiddleware(get_response)
+
+        factory = RequestFactory()
+        response = view(False)(factory.get("/"))
+        self.assertTrue(response.content.startswith(b"replica"))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+        response = view(True)(factory.post("/add_quote/"))
+        self.assertEqual(response.content, b"default")
+        self.assertEqual(response.cookies[PIN_COOKIE]["max-age"], settings.REPLICA_PIN_SECONDS)
+
+        pinned = factory.get("/")
+        pinned.COOKIES[PIN_COOKIE] = "1"
+        self.assertEqual(view(False)(pinned).content, b"default")
+        # The pins of earlier requests don't leak into the next one
+        self.assertTrue(view(False)(factory.get("/")).content.startswith(b"replica"))
+
+
+@skipUnless("replica1" in settings.DATABASES, "set REPLICA_DATABASE_URLS to test against a replica")
+class ReplicaDatabaseTests(TestCase):
+    databases = "__all__"
+
+    def test_pages_read_from_the_replica(self):
+        replica_health.clear()
+        with self.settings(DATABASE_REPLICAS={"replica1": 1}), CaptureQueriesContext(connections["replica1"]) as queries:
+            # The test case wraps every test in a transaction on the primary, so reads stay there unless it's left out
+            with mock.patch.object(connections["default"], "in_atomic_block", False):
+                self.assertEqual(self.client.get("/api/tags/").status_code, 200)
+        self.assertTrue(queries.captured_queries)
+
+
+class BenchmarkTests(TestCase):
+    def test_corpus_has_zipf_tags_and_imports(self):
+        output_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, output_dir)
+        call_command("generate_corpus", quotes=500, output_dir=str(output_dir), stdout=StringIO())
+        quotes = json.loads((output_dir / "quotes.json").read_text())
+        self.assertEqual(len(quotes), 500)
+        (_, top), *_, (_, tail) = Counter(tag for quote in quotes for tag in quote["tags"]).most_common()
+        self.assertGreater(top, 20 * tail)
+
+        existing = User.objects.create(username=BENCHMARK_USERNAME)
+        results_file = output_dir / "results.json"
+        call_command(
+            "run_benchmarks",
+            corpus_dir=str(output_dir),
+            only=["main", "api_quotes"],
+            requests=3,
+            warmup=0,
+            output=str(results_file),
+            stdout=StringIO(),
+            stderr=StringIO(),
+        )
+        results = json.loads(results_file.read_text())
+        self.assertEqual(results["corpus"]["quotes"], 500)
+        self.assertEqual(set(results["urls"]), {"main", "api_quotes"})
+        self.assertEqual(results["urls"]["main"]["status"], 200)
+        self.assertEqual(results["skipped_urls"], [])
+        self.assertIn("seconds", results["imports"]["json"])
+        self.assertEqual(list(User.objects.values_list("pk", flat=True)), [existing.pk])
+
+
+@skipUnless(mongomock, "mongomock is not installed")
+class ImportDataFromMongoTests(TestCase):
+    def setUp(self):
+        import connect_mongo
+
+        connect_mongo.close_connection()
+        connect_mongo.get_connection(host="mongodb://localhost", mongo_client_class=mongomock.MongoClient)
+        self.addCleanup(connect_mongo.close_connection)
+
+    def test_sync_copies_only_new_documents(self):
+        from models_mongo import AuthorM, QuoteM
+
+        einstein = AuthorM(fullname="Albert Einstein", born_location="in Ulm, Germany", description="Physicist").save()
+        QuoteM(content="Imagination is more important than knowledge.", author=einstein, tags=["imagination"]).save()
+        QuoteM(content="Orphan quote", tags=["lost"]).save()
+
+        call_command("import_data_from_mongo", batch_size=1, stdout=StringIO())
+        self.assertEqual(Author.objects.count(), 1)
+        self.assertEqual(Quote.objects.count(), 1)
+        self.assertTrue(ImportCheckpoint.objects.filter(source="mongo:quotes").exists())
+
+        QuoteM(content="Life is like riding a bicycle.", author=einstein, tags=["life", "imagination"]).save()
+        call_command("import_data_from_mongo", batch_size=1, stdout=StringIO())
+
+        self.assertEqual(Quote.objects.count(), 2)
+        quote = Quote.objects.get(quote__startswith="Life")
+        self.assertEqual(quote.author.fullname, "Albert Einstein")
+        self.assertEqual(sorted(quote.tags.values_list("name", flat=True)), ["imagination", "life"])
+
+    def test_interrupted_sync_resumes_after_the_last_committed_batch(self):
+        from models_mongo import AuthorM, QuoteM
+        from quoteapp.management.commands.import_data_from_mongo import QUOTES_CHECKPOINT, Command
+
+        einstein = AuthorM(fullname="Albert Einstein", born_location="in Ulm, Germany", description="Physicist").save()
+        for text in ("Imagination is more important than knowledge.", "Life is like riding a bicycle."):
+            QuoteM(content=text, author=einstein, tags=["life"]).save()
+
+        save_position = Command.save_position
+
+        def killed_before_second_checkpoint(source, object_id):
+            if source == QUOTES_CHECKPOINT and ImportCheckpoint.objects.filter(source=source).exists():
+                raise RuntimeError("killed")
+            save_position(source, object_id)
+
+        killed = mock.patch.object(Command, "save_position", staticmethod(killed_before_second_checkpoint))
+        with killed, self.assertRaises(RuntimeError):
+            call_command("import_data_from_mongo", batch_size=1, keep_duplicates=True, stdout=StringIO())
+        # The second batch was rolled back together with its checkpoint
+        self.assertEqual(list(Quote.objects.values_list("quote", flat=True)), ["Imagination is more important than knowledge."])
+
+        call_command("import_data_from_mongo", batch_size=1, keep_duplicates=True, stdout=StringIO())
+        self.assertEqual(
+            sorted(Quote.objects.values_list("quote", flat=True)),
+            ["Imagination is more important than knowledge.", "Life is like riding a bicycle."],
+        )
@@ -1,18 +1,30 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 app_name = "quoteapp"
 
 urlpatterns = [
     path("", views.main, name="main"),
     path("<int:page>", views.main, name="main"),
+    path("random/", views.random_quote, name="random_quote"),
+    path("today/", views.quote_of_the_day, name="quote_of_the_day"),
     path("author/<str:author>", views.get_info_author, name="get_info_author"),
+    path("quote/<int:quote_id>/similar", views.similar, name="similar_quotes"),
     path("tag/<str:tag_name>/<int:page>", views.look_for_tag, name="look_for_tag"),
     path("tag/<str:tag_name>", views.look_for_tag, name="look_for_tag"),
     path("add_tag/", views.add_tag, name="add_tag"),
     path("add_author/", views.add_author, name="add_author"),
     path("add_quote/", views.add_quote, name="add_quote"),
+    path("search/", views.search, name="search"),
+    path("api/quotes/", api.quotes, name="api_quotes"),
+    path("api/authors/", api.authors, name="api_authors"),
+    path("api/tags/", api.tags, name="api_tags"),
+    path("api/authors/choices/", api.author_choices, name="api_author_choices"),
+    path("api/tags/choices/", api.tag_choices, name="api_tag_choices"),
+    path("api/suggestions/", api.suggestions, name="api_suggestions"),
+    path("api/export.ndjson", api.export, name="api_export"),
+    path("stats/fragments/", views.fragment_stats, name="fragment_stats"),
     path("search_data/<str:data>", views.search_data, name="search_data"),
     path("search_data/<str:data>/<int:page>", views.search_data, name="search_data"),
 ]
@@ -0,0 +1,89 @@
+import hashlib
+import time
+from typing import Dict, Iterable, Tuple
+
+from django.core.cache import cache
+
+CATALOG = "catalog"
+TOP_TAGS = "top_tags"
+RELATED_TAGS = "related_tags"
+SIMILAR_QUOTES = "similar_quotes"
+# Bumped when quotes are created or deleted, not when they change
+QUOTE_IDS = "quote_ids"
+# Bumped when authors or tags are created, renamed or deleted, see quoteapp.autocomplete
+AUTHOR_NAMES = "author_names"
+TAG_NAMES = "tag_names"
+SUGGESTIONS = "suggestions"
+VERSION_KEY = "quoteapp:version:{}"
+MODIFIED_KEY = "quoteapp:modified:{}"
+
+
+def tag_scope(name: str) -> str:
+    return f"tag:{hashlib.md5(name.encode()).hexdigest()}"
+
+
+def author_scope(fullname: str) -> str:
+    return f"author:{hashlib.md5(fullname.encode()).hexdigest()}"
+
+
+def new_version() -> int:
+    # A scope whose version was evicted (or whose cache restarted) starts over from the current time rather than
+    # from 1, so it never gets back a version that ETags and cache keys from before the eviction were built from
+    return time.time_ns()
+
+
+def get_version(scope: str = CATALOG) -> int:
+    """
+    The get_version function returns the current content version of a scope.
+    Versions live in the Django cache, so every worker process sees the same value
+    and caches keyed by a version are invalidated everywhere by a single bump.
+
+    :param scope: The name of the scope, e.g. "catalog"
+    :return: The version number
+    """
+    key = VERSION_KEY.format(scope)
+    version = cache.get(key)
+    if version is None:
+        version = new_version()
+        cache.add(key, version, timeout=None)
+        version = cache.get(key, version)
+    return version
+
+
+def get_versions(scopes: Iterable[str]) -> Dict[str, Tuple[int, float]]:
+    """
+    The get_versions function returns the version and the last modification time of several scopes
+    with a single cache round trip. Scopes that were never bumped (or were evicted) start now.
+
+    :param scopes: The names of the scopes
+    :return: A mapping of scope to (version, modified timestamp)
+    """
+    scopes = list(scopes)
+    keys = [VERSION_KEY.format(scope) for scope in scopes] + [MODIFIED_KEY.format(scope) for scope in scopes]
+    values = cache.get_many(keys)
+
+    missing = {key: new_version() if key.startswith("quoteapp:version:") else time.time() for key in keys if key not in values}
+    if missing:
+        for key, value in missing.items():
+            cache.add(key, value, timeout=None)
+        values.update(cache.get_many(missing))
+        values.update((key, value) for key, value in missing.items() if key not in values)
+
+    return {scope: (values[VERSION_KEY.format(scope)], values[MODIFIED_KEY.format(scope)]) for scope in scopes}
+
+
+def bump_version(*scopes: str) -> None:
+    """
+    The bump_version function moves the given scopes to a new version and records when they changed.
+
+    :param *scopes: The names of the scopes that changed
+    :return: None
+    """
+    now = time.time()
+    for scope in scopes:
+        key = VERSION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, new_version(), timeout=None)
+    cache.set_many({MODIFIED_KEY.format(scope): now for scope in scopes}, timeout=None)
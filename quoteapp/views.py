@@ -1,88 +1,287 @@
-from typing import List, Tuple
-
-from django.core.paginator import Paginator
-from django.db.models import Count
-from django.http import HttpRequest
+import os
+from functools import partial
+from typing import Callable, List, Optional, Tuple, Union
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.contrib.auth.decorators import user_passes_test
+from django.db import IntegrityError, transaction
+from django.db.models import QuerySet
+from django.http import Http404, HttpRequest, HttpResponsePermanentRedirect, HttpResponseRedirect, JsonResponse
 from django.shortcuts import redirect, render
 from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.cache import never_cache
 
+from . import picks
+from .conditional import versioned_page
 from .forms import AuthorForm, QuoteForm, TagForm
-from .models import Author, Quote, Tag
+from .models import Author, QuoteCard, Tag
+from .pagination import PER_PAGE, CursorPage, IdListPaginator, KeysetPaginator, estimate_count
+from .related import CooccurrenceMatrix, related_tags
+from .search import cached_search_quotes, normalize_query
+from .similar import similar_quotes
+from .tags import TagEntry, tag_registry
+from .templatetags.fragments import fragment_cache_stats
+from .versions import CATALOG, RELATED_TAGS, SIMILAR_QUOTES, TOP_TAGS, author_scope, tag_scope
+
+MIN_TAG_FONT_SIZE = 12
+MAX_TAG_FONT_SIZE = 28
 
 
+@versioned_page(lambda page=1: [CATALOG, TOP_TAGS])
 def main(request: HttpRequest, page: int = 1) -> TemplateResponse:
     """
     The main function is the main view for the quoteapp. It displays a list of quotes,
-    and allows users to navigate through them using pagination. The top tags are also displayed.
+    and allows users to navigate through them using cursor pagination. The top tags are also displayed.
+    Old page-numbered links are redirected to the matching cursor.
 
     :param request: Pass the request object to the view
-    :param page: Determine which page of the paginated list to display
+    :param page: The page number of an old /<page> link
     :return: A rendered template with the quotes and top tags
     """
-    quotes = Quote.objects.all()
-    page_object, top_tags = get_page_and_top_tags(quotes, page)
+    quotes = QuoteCard.objects.all()
+    if page > 1:
+        return redirect_to_cursor(KeysetPaginator(quotes, per_page=PER_PAGE), page, reverse("quoteapp:main"))
+
+    page_object, top_tags = get_page_and_top_tags(quotes, request.GET.get("cursor"), estimate_count(QuoteCard))
     return render(request, "quoteapp/index.html", {"quotes": page_object, "top_tags": top_tags})
 
 
+@versioned_page(lambda author: [author_scope(author), CATALOG, SIMILAR_QUOTES])
 def get_info_author(request: HttpRequest, author) -> TemplateResponse:
     """
     The get_info_author function takes a request and an author name as arguments.
     It then uses the Author model to get the author object with that fullname,
-    and renders it in a template called 'quoteapp/author_detail.html'
+    and renders it in a template called 'quoteapp/author_detail.html' together with
+    the quotes of other authors that are most similar to the author's quotes.
 
     :param request: Get the request from the user
     :param author: Get the author object from the database
     :return: The author_detail
     """
     author = Author.objects.get(fullname=author)
-    return render(request, "quoteapp/author_detail.html", {"author": author})
+    model = similar_quotes.current()
+    if model is None:
+        similar_cards = []
+    else:
+        quote_ids = author.quote_set.values_list("pk", flat=True)
+        similar_cards = get_cards(model.similar_to_many(quote_ids, settings.SIMILAR_QUOTES_LIMIT))
+    return render(request, "quoteapp/author_detail.html", {"author": author, "similar_quotes": similar_cards})
+
+
+@versioned_page(lambda quote_id: [CATALOG, SIMILAR_QUOTES])
+def similar(request: HttpRequest, quote_id: int) -> TemplateResponse:
+    """
+    The similar function shows a quote together with the quotes most similar to it.
+    The neighbours are precomputed by the build_similar_quotes command (see quoteapp.similar),
+    so the page is a lookup in the neighbour lists and one query for the cards.
+
+    :param request: Pass the request object to the view
+    :param quote_id: The id of the quote
+    :return: A page with the quote and its similar quotes
+    """
+    model = similar_quotes.current()
+    similar_ids = model.similar_ids(quote_id, settings.SIMILAR_QUOTES_LIMIT) if model else []
+    cards = QuoteCard.objects.in_bulk([quote_id, *similar_ids])
+    if quote_id not in cards:
+        raise Http404(f"No quote with id {quote_id}")
+    context = {"quote": cards[quote_id], "quotes": [cards[pk] for pk in similar_ids if pk in cards]}
+    return render(request, "quoteapp/similar.html", context)
 
 
+def get_cards(quote_ids: List[int]) -> List[QuoteCard]:
+    """
+    The get_cards function returns the cards of the given quotes in the given order, skipping deleted quotes.
+
+    :param quote_ids: The ids of the quotes
+    :return: The quote cards
+    """
+    cards = QuoteCard.objects.in_bulk(quote_ids)
+    return [cards[pk] for pk in quote_ids if pk in cards]
+
+
+@versioned_page(lambda tag_name, page=1: [tag_scope(tag_name), TOP_TAGS, RELATED_TAGS])
 def look_for_tag(request: HttpRequest, tag_name: str, page: int = 1) -> TemplateResponse:
     """
     The look_for_tag function takes a request and tag_name as arguments.
-    It then gets the Tag object with the name of tag_name, and uses it to filter
+    It then looks the tag up in the process-local tag registry, and uses it to filter
     the quotes that have that tag. It then calls get_page_and_top tags on those quotes,
     and returns a render call with the page object (a list of quotes) and top tags.
+    Tag names are case-insensitive, links with another spelling are redirected to the canonical one.
 
     :param request: Pass the request object to the view
     :param tag_name: Get the tag object from the database
-    :param page: Determine which page of the quotes to display
+    :param page: The page number of an old tag/<tag_name>/<page> link
     :return: A page with all quotes that have the tag_name
     """
 
-    tag = Tag.objects.get(name=tag_name)
-    quotes_with_tag = Quote.objects.filter(tags=tag)
-    page_object, top_tags = get_page_and_top_tags(quotes_with_tag, page)
-    return render(request, "quoteapp/look_for_tag.html", {"tag_name": tag_name, "quotes": page_object, "top_tags": top_tags})
+    tag = tag_registry.lookup(tag_name)
+    if tag is None:
+        raise Http404(f"No tag named {tag_name}")
+    if tag.name != tag_name:
+        url = reverse("quoteapp:look_for_tag", args=[tag.name])
+        return redirect(f"{url}?{request.GET.urlencode()}" if request.GET else url, permanent=True)
+
+    quotes_with_tag = QuoteCard.objects.filter(quote__tags=tag.id)
+    if page > 1:
+        url = reverse("quoteapp:look_for_tag", args=[tag_name])
+        return redirect_to_cursor(KeysetPaginator(quotes_with_tag, per_page=PER_PAGE), page, url)
+
+    page_object, top_tags = get_page_and_top_tags(quotes_with_tag, request.GET.get("cursor"), tag.quote_count)
+    return render(request, "quoteapp/look_for_tag.html", tag_page_context(tag, page_object, top_tags))
+
+
+def tag_page_context(tag: TagEntry, page_object: CursorPage, top_tags: Union[List[Tag], Callable[[], List[Tag]]]) -> dict:
+    """
+    The tag_page_context function returns the template context of a page of a tag's quotes.
+    The related tags panel gets a callable, so they are only looked up when its cached fragment is stale.
+
+    :param tag: The tag
+    :param page_object: The page of quotes
+    :param top_tags: The top tags, or a callable returning them
+    :return: The context
+    """
+    cooccurrence = related_tags.current()
+    return {
+        "tag_name": tag.name,
+        "tag_id": tag.id,
+        "quotes": page_object,
+        "top_tags": top_tags,
+        "related_version": cooccurrence.version if cooccurrence else None,
+        "related_tags": partial(get_related_tags, cooccurrence, tag.id),
+    }
+
+
+@never_cache
+def random_quote(request: HttpRequest) -> TemplateResponse:
+    """
+    The random_quote function shows a random quote, optionally of the tag given as ?tag=.
+    The quote is picked from a dense array of quote ids cached in this process (see quoteapp.picks),
+    so there is no ORDER BY random() or OFFSET scan, only a primary key lookup.
+
+    :param request: Pass the request object to the view
+    :return: A page with the random quote
+    """
+    tag = get_tag_filter(request)
+    context = {"quote": picks.random_quote(tag), "tag": tag, "title": "Random quote"}
+    return render(request, "quoteapp/quote_pick.html", context)
+
+
+def quote_of_the_day(request: HttpRequest) -> TemplateResponse:
+    """
+    The quote_of_the_day function shows the quote of the day, optionally of the tag given as ?tag=.
+    The pick is deterministic for the day and stored on first use, see quoteapp.picks.
+
+    :param request: Pass the request object to the view
+    :return: A page with the quote of the day
+    """
+    tag = get_tag_filter(request)
+    context = {"quote": picks.quote_of_the_day(timezone.localdate(), tag), "tag": tag, "title": "Quote of the day"}
+    return render(request, "quoteapp/quote_pick.html", context)
+
+
+def get_tag_filter(request: HttpRequest) -> Optional[TagEntry]:
+    """
+    The get_tag_filter function returns the tag named by the ?tag= parameter, if any.
+
+    :param request: The request
+    :return: The tag, or None when the parameter is missing
+    """
+    if not request.GET.get("tag"):
+        return None
+    tag = tag_registry.lookup(request.GET["tag"])
+    if tag is None:
+        raise Http404(f"No tag named {request.GET['tag']}")
+    return tag
 
 
 def get_top_tags() -> List[Tag]:
     """
     The get_top_tags function returns the top 10 tags in the database.
-    It does this by first querying for all tags, and then annotating each tag with a count of how many quotes it has.
-    Then it orders those tags by their quote counts (descending), and slices off the first 10.
+    It reads them from the index on the maintained Tag.quote_count counter instead of counting
+    the Quote.tags table, and gives every tag a font_size proportional to its number of quotes.
 
     :return: The top 10 tags, based on the number of quotes associated with each tag
     """
-    top_tags = Tag.objects.alias(num_quotes=Count("quote")).order_by("-num_quotes")[:10]
+    return set_font_sizes(list(top_tags_queryset()))
+
+
+def top_tags_queryset() -> QuerySet:
+    return Tag.objects.filter(quote_count__gt=0).order_by("-quote_count")[:10]
+
+
+def set_font_sizes(top_tags: List[Tag]) -> List[Tag]:
+    if top_tags:
+        max_count = top_tags[0].quote_count
+        for tag in top_tags:
+            tag.font_size = round(MIN_TAG_FONT_SIZE + (MAX_TAG_FONT_SIZE - MIN_TAG_FONT_SIZE) * tag.quote_count / max_count)
     return top_tags
 
 
-def get_page_and_top_tags(quotes: List[Quote], page: int) -> Tuple[Paginator, List[Tag]]:
+def get_related_tags(cooccurrence: Optional[CooccurrenceMatrix], tag_id: int) -> List[Tag]:
     """
-    The get_page_and_top_tags function takes a list of quotes and a page number,
-    and returns the paginated quotes for that page as well as the top tags.
-
+    The get_related_tags function returns the tags that share the most quotes with a tag.
+    They are a top-k lookup in the precomputed co-occurrence matrix (see quoteapp.related) plus one
+    query for their names; like the top tags, the template only calls it when its cached panel is stale.
 
-    :param quotes: Pass the quotes list to the paginator
-    :param page: Get the current page of quotes
+    :param cooccurrence: The co-occurrence matrix, None when it was never built
+    :param tag_id: The id of the tag
+    :return: The related tags, each with the number of quotes it shares with the tag as shared_quotes
+    """
+    if cooccurrence is None:
+        return []
+    shared = dict(cooccurrence.top_k(tag_id, settings.RELATED_TAGS_LIMIT))
+    tags = sorted(Tag.objects.filter(pk__in=shared).only("name"), key=lambda tag: (-shared[tag.pk], tag.pk))
+    for tag in tags:
+        tag.shared_quotes = shared[tag.pk]
+    return tags
+
+
+def get_page_and_top_tags(
+    quotes: QuerySet, cursor: Optional[str], estimated_total: Optional[int] = None
+) -> Tuple[CursorPage, Callable[[], List[Tag]]]:
+    """
+    The get_page_and_top_tags function takes a queryset of quote cards and a cursor token,
+    and returns the page of quotes the cursor points at as well as the top tags.
+    Quote cards carry the author name and tag names, so rendering the page needs no further queries.
+    The top tags are returned as a callable that the template only calls when the cached
+    tag cloud fragment is stale.
+
+    :param quotes: Pass the quote cards queryset to the paginator
+    :param cursor: The opaque cursor of the current page, None for the first page
+    :param estimated_total: A cheap estimate of the number of quotes, if one is known
     :return: A tuple of two objects:
     """
-    paginator = Paginator(quotes, per_page=10)
-    page_object = paginator.get_page(page)
-    top_tags = get_top_tags()
-    return page_object, top_tags
+    page_object = KeysetPaginator(quotes, per_page=PER_PAGE, estimated_total=estimated_total).get_page(cursor)
+    return page_object, get_top_tags
+
+
+def redirect_to_cursor(paginator: Union[KeysetPaginator, IdListPaginator], page: int, url: str) -> HttpResponsePermanentRedirect:
+    """
+    The redirect_to_cursor function permanently redirects an old page-numbered URL to its cursor URL,
+    so links and crawlers move over to the flat-cost cursor pages.
+
+    :param paginator: The paginator of the listing the page number refers to
+    :param page: The old page number
+    :param url: The URL of the first page of the listing
+    :return: A permanent redirect
+    """
+    cursor = paginator.cursor_for_page(page)
+    return HttpResponsePermanentRedirect(f"{url}?{urlencode({'cursor': cursor})}" if cursor else url)
+
+
+@user_passes_test(lambda user: user.is_staff)
+def fragment_stats(request: HttpRequest) -> JsonResponse:
+    """
+    The fragment_stats function reports the hit and miss counters of the fragment cache
+    of the worker process that served the request.
+
+    :param request: HttpRequest: Get the request object from the view
+    :return: The counters as JSON
+    """
+    return JsonResponse({"pid": os.getpid(), "fragments": fragment_cache_stats()})
 
 
 def add_tag(request: HttpRequest) -> TemplateResponse:
@@ -97,9 +296,15 @@ def add_tag(request: HttpRequest) -> TemplateResponse:
     if request.method == "POST":
         form = TagForm(request.POST)
         if form.is_valid():
-            tag_name = form.cleaned_data['name']
-            if not Tag.objects.filter(name=tag_name).exists():
-                form.save()
+            try:
+                with transaction.atomic():
+                    form.save()
+            except IntegrityError:
+                # The same tag was added concurrently
+                pass
+            return redirect(to="quoteapp:main")
+        elif "name" in form.cleaned_data and tag_registry.lookup(form.cleaned_data["name"]):
+            # Adding a tag that already exists, in any letter case, changes nothing
             return redirect(to="quoteapp:main")
         else:
             return render(request, "quoteapp/add_tag.html", {"form": form})
@@ -130,55 +335,66 @@ def add_author(request: HttpRequest) -> TemplateResponse:
 def add_quote(request: HttpRequest) -> TemplateResponse:
     """
     The add_quote function is a view that allows the user to add a quote.
-    The function first gets all of the tags from the database and passes them into
-    the template. If there is POST data, it creates an instance of QuoteForm with
-    that data and checks if it's valid. If so, it saves that form as new_quote, then
-    gets all of the tags selected by using request.POST to get their primary keys (pks)
-    and filters Tag objects for those pks in choice_tags; finally, we set new_quote's tags to be choice_tags.
+    If there is POST data, it creates an instance of QuoteForm with that data and checks if it's valid.
+    If so, it saves the quote together with its tags, which the form resolves from the submitted ids.
+    The author and tag pickers of the form only render the selected choices and look up the others
+    while the user types, see quoteapp.autocomplete.
 
     :param request: Get the request object from the view
     :return: A redirect to the main page
     """
-    tags = Tag.objects.all()
-
     if request.method == "POST":
         form = QuoteForm(request.POST)
         if form.is_valid():
-            new_quote = form.save()
-
-            choice_tags = Tag.objects.filter(pk__in=request.POST.getlist("tags"))
-            new_quote.tags.set(choice_tags)
-
+            form.save()
             return redirect(to="quoteapp:main")
         else:
-            return render(request, "quoteapp/add_quote.html", {"tags": tags, "form": form})
+            return render(request, "quoteapp/add_quote.html", {"form": form})
 
-    return render(request, "quoteapp/add_quote.html", {"tags": tags, "form": QuoteForm()})
+    return render(request, "quoteapp/add_quote.html", {"form": QuoteForm()})
 
 
-def search_data(request: HttpRequest, data: str, page: int = 1) -> TemplateResponse:
+@versioned_page(lambda: [CATALOG, TOP_TAGS])
+def search(request: HttpRequest) -> TemplateResponse:
     """
-    The search_data function takes in a request and data, which is the search query.
-    It then searches for tags that start with the search query, and finds all quotes that have those tags.
-    Then it searches for authors whose fullname contains the search query, and finds all quotes by those authors.
-    Finally it combines these two sets of quotes into one set of unique quotes (no duplicates),
-    and returns a TemplateResponse object containing this set of unique quotes.
+    The search function is the canonical, cacheable search view (GET /search/?q=...).
+    It runs a full-text search over the quote text, the author names and the tag names
+    (see quoteapp.search) and pages through the ids of the matching quotes, best match first.
+    The ranked ids come from the search result cache, so paging only loads the cards of the page.
+    Queries that are not in their normalized form are redirected to it.
 
     :param request: HttpRequest: Get the request object from the view
-    :param data: str: Pass the search data from one page to another
-    :param page: int: Determine which page of the paginator to display
     :return: A templateresponse object
     """
+    data = request.GET.get("q", "")
+    query = normalize_query(data)
+    if query != data:
+        return redirect_to_search(query, request.GET.get("cursor"))
+
+    paginator = IdListPaginator(cached_search_quotes(query), QuoteCard.objects.all(), per_page=PER_PAGE)
+    page_object = paginator.get_page(request.GET.get("cursor"))
+    return render(request, "quoteapp/search.html", {"quotes": page_object, "top_tags": get_top_tags, "data": query})
+
+
+def search_data(request: HttpRequest, data: str, page: int = 1) -> HttpResponseRedirect:
+    """
+    The search_data function keeps the old search URLs working.
+    The query is taken from the POSTed search_input or from the URL, and the request
+    is redirected to the canonical GET search URL (permanently, unless it was a form POST).
 
-    if page == 1:
-        if request.POST.get("search_input"):
-            data = request.POST.get("search_input")
+    :param request: HttpRequest: Get the request object from the view
+    :param data: str: The search data of an old search_data/<data> link
+    :param page: int: The page number of an old search_data/<data>/<page> link
+    :return: A redirect to the search view
+    """
+    if request.POST.get("search_input"):
+        data = request.POST.get("search_input")
 
-    tags = Tag.objects.filter(name__istartswith=data)
-    quotes = Quote.objects.filter(tags__in=tags)
+    cursor = IdListPaginator([], QuoteCard.objects.none(), per_page=PER_PAGE).cursor_for_page(page)
+    return redirect_to_search(normalize_query(data), cursor, permanent=request.method == "GET")
 
-    authors = Author.objects.filter(fullname__iregex=data)
-    quotes = quotes.union(Quote.objects.filter(author__in=authors))
 
-    page_object, top_tags = get_page_and_top_tags(quotes, page)
-    return render(request, "quoteapp/search.html", {"quotes": page_object, "top_tags": top_tags, "data": data})
+def redirect_to_search(query: str, cursor: Optional[str] = None, permanent: bool = False) -> HttpResponseRedirect:
+    params = {"q": query, "cursor": cursor} if cursor else {"q": query}
+    redirect_class = HttpResponsePermanentRedirect if permanent else HttpResponseRedirect
+    return redirect_class(f"{reverse('quoteapp:search')}?{urlencode(params, quote_via=quote)}")
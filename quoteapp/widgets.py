@@ -0,0 +1,50 @@
+from django.forms import Select, SelectMultiple
+from django.urls import reverse
+
+
+class AutocompleteMixin:
+    """
+    A select of a model choice field that renders only its selected options instead of the whole queryset.
+    The other choices are fetched while typing from the JSON endpoint of url_name, see quoteapp.autocomplete
+    and quoteapp/autocomplete.js.
+    """
+
+    class Media:
+        js = ["quoteapp/autocomplete.js"]
+
+    def __init__(self, url_name: str, attrs=None):
+        super().__init__(attrs)
+        self.url_name = url_name
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context["widget"]["attrs"]["data-autocomplete-url"] = reverse(self.url_name)
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        """
+        The optgroups function returns the options of the selected values only, read in one query.
+
+        :param name: The name of the field
+        :param value: The selected values, as strings
+        :param attrs: The attributes of the options
+        :return: A single group with the options
+        """
+        selected = [pk for pk in value if pk and str(pk).isdigit()]
+        options = []
+        if not self.allow_multiple_selected:
+            options.append(self.create_option(name, "", "---------", not selected, 0, attrs=attrs))
+        if selected:
+            field = self.choices.field
+            for obj in self.choices.queryset.filter(pk__in=selected):
+                option = self.create_option(name, obj.pk, field.label_from_instance(obj), True, len(options), attrs=attrs)
+                options.append(option)
+        return [(None, options, 0)]
+
+
+class AutocompleteSelect(AutocompleteMixin, Select):
+    pass
+
+
+class AutocompleteSelectMultiple(AutocompleteMixin, SelectMultiple):
+    pass
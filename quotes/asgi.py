@@ -11,6 +11,15 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from quotes.profiling import profile_asgi
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'quotes.settings')
 
 application = get_asgi_application()
+
+# Workers load the related tags matrix before serving their first request, the apps have to be ready first
+from quoteapp.related import related_tags  # noqa: E402
+
+related_tags.current()
+
+application = profile_asgi(application)
@@ -0,0 +1,13 @@
+"""
+The URLs of requests served through ASGI (ASYNC_URLCONF): those of quotes.urls, with quoteapp.async_urls in place
+of quoteapp.urls.
+"""
+from django.urls import include, path
+
+from quoteapp import urls as quoteapp_urls
+from quotes.urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path("", include("quoteapp.async_urls")) if getattr(pattern, "urlconf_name", None) is quoteapp_urls else pattern
+    for pattern in sync_urlpatterns
+]
@@ -0,0 +1,203 @@
+"""
+Routing of reads to the read replicas of DATABASE_REPLICAS.
+
+Writes go to the primary ("default"), reads to a replica picked at random in proportion to its weight.
+Reads stay on the primary:
+
+- inside a transaction on the primary, and for the rest of the request (or command) after a write,
+  so code reads what it wrote itself;
+- for REPLICA_PIN_SECONDS after a request that wrote or was unsafe (POST, ...), through the cookie set by
+  PrimaryPinningMiddleware, so a user sees their own changes on the next pages while the replicas catch up.
+
+Requests and background tasks (e.g. the avatar jobs) run in a pin_scope, so their write pin ends with them.
+A management command is one task: after its first write it reads what it wrote from the primary.
+
+Every process checks a replica with SELECT 1 at most every REPLICA_HEALTH_CHECK_INTERVAL seconds, on demand.
+A replica whose check fails is out of rotation until a later check succeeds; without a healthy replica reads
+go to the primary.
+
+Content versions are bumped on the primary, so data read from a replica right after a bump may be older than
+the version. The caches keyed by a content version (fragments, search results, autocomplete pages, the tag
+registry and the quote id pools) are filled from the replicas all the same, but a result is only stored when
+its version is older than REPLICA_MAX_LAG (see may_be_stale), the lag the replicas are assumed to stay below.
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.http import HttpRequest, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = "pin_primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+# Reads of this context go to the primary
+_pinned: ContextVar[bool] = ContextVar("quotes_pinned", default=False)
+# This context wrote to the primary
+_wrote: ContextVar[bool] = ContextVar("quotes_wrote", default=False)
+
+
+class ReplicaHealth:
+    """
+    The results of the health checks of the replicas in this process, each refreshed when it is
+    older than REPLICA_HEALTH_CHECK_INTERVAL. While one thread checks a replica, the others use its last result.
+    """
+
+    def __init__(self):
+        self._results: Dict[str, Tuple[float, bool]] = {}
+        self._lock = threading.Lock()
+
+    def is_healthy(self, alias: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            result = self._results.get(alias)
+            if result and now - result[0] < settings.REPLICA_HEALTH_CHECK_INTERVAL:
+                return result[1]
+            self._results[alias] = (now, result[1] if result else True)
+
+        healthy = self.check(alias)
+        with self._lock:
+            self._results[alias] = (time.monotonic(), healthy)
+        if not healthy:
+            logger.warning("Replica %s failed its health check and is out of rotation", alias)
+        return healthy
+
+    @staticmethod
+    def check(alias: str) -> bool:
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except DatabaseError:
+            connection.close_if_unusable_or_obsolete()
+            return False
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+def choose_replica() -> Optional[str]:
+    """
+    The choose_replica function picks a healthy replica at random, in proportion to the weights of DATABASE_REPLICAS.
+
+    :return: The alias of the replica, or None when no replica is healthy
+    """
+    replicas = [(alias, weight) for alias, weight in settings.DATABASE_REPLICAS.items() if weight > 0]
+    healthy = [(alias, weight) for alias, weight in replicas if replica_health.is_healthy(alias)]
+    if not healthy:
+        return None
+    aliases, weights = zip(*healthy)
+    return random.choices(aliases, weights)[0]
+
+
+@contextmanager
+def pin_scope(pinned: bool = False) -> Iterator[None]:
+    """
+    The pin_scope function scopes the primary pin, e.g. to a request or a task of a long-running worker:
+    the reads within it start on the replicas (unless pinned) and a write within it only pins the rest of it.
+
+    :param pinned: Send all reads of the scope to the primary
+    :return: A context manager
+    """
+    tokens = _pinned.set(pinned), _wrote.set(False)
+    try:
+        yield
+    finally:
+        _wrote.reset(tokens[1])
+        _pinned.reset(tokens[0])
+
+
+def reads_use_replicas() -> bool:
+    return bool(settings.DATABASE_REPLICAS) and not _pinned.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+def may_be_stale(modified: float) -> bool:
+    """
+    The may_be_stale function tells whether the reads of this context could miss a change made at a given time,
+    because they go to a replica and the change is more recent than REPLICA_MAX_LAG. Results read then can be used,
+    but must not be cached under the version of the change.
+
+    :param modified: The time of the change, as a timestamp
+    :return: True when a replica may not have the change yet
+    """
+    return time.time() - modified < settings.REPLICA_MAX_LAG and reads_use_replicas()
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the replicas and writes to the primary, see the module docstring.
+    """
+
+    def db_for_read(self, model, **hints) -> str:
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            # Related objects are read from the database their instance came from
+            return instance._state.db
+        if not reads_use_replicas():
+            return DEFAULT_DB_ALIAS
+        return choose_replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints) -> str:
+        _pinned.set(True)
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # The replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints) -> bool:
+        # Replicas get the schema by replication
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryPinningMiddleware:
+    """
+    Reads of unsafe requests and of requests sent within REPLICA_PIN_SECONDS of a write by the same client go to
+    the primary. The window is a cookie set on the responses to unsafe requests and to requests that wrote.
+    Not used without replicas.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable):
+        if not getattr(settings, "DATABASE_REPLICAS", None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with pin_scope(self.pinned(request)):
+            return self.finish(request, self.get_response(request))
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        with pin_scope(self.pinned(request)):
+            return self.finish(request, await self.get_response(request))
+
+    @staticmethod
+    def pinned(request: HttpRequest) -> bool:
+        return request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES
+
+    @staticmethod
+    def finish(request: HttpRequest, response: HttpResponse) -> HttpResponse:
+        if _wrote.get() or request.method not in SAFE_METHODS:
+            response.set_cookie(PIN_COOKIE, "1", max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite="Lax")
+        return response
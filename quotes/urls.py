@@ -1,11 +1,24 @@
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
+
+from users.storage import CONTENT_ADDRESSED_PREFIX
+from users.views import serve_immutable
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("quoteapp.urls")),
     path("users/", include("users.urls")),
     path("tinymce/", include("tinymce.urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+if settings.DEBUG:
+    urlpatterns.append(
+        re_path(
+            rf"^{settings.MEDIA_URL.lstrip('/')}(?P<path>{CONTENT_ADDRESSED_PREFIX}/.*)$",
+            serve_immutable,
+            {"document_root": settings.MEDIA_ROOT},
+        )
+    )
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
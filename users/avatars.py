@@ -0,0 +1,125 @@
+import hashlib
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from threading import Lock
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.db import close_old_connections, connection, transaction
+from PIL import Image, ImageOps
+from quotes.routers import pin_scope
+
+from .identity import refresh_identities
+
+logger = logging.getLogger(__name__)
+
+AVATAR_SIZES = (48, 96, 250)
+# File extension and Pillow format of every variant; PNG is the fallback for browsers without WebP
+AVATAR_FORMATS = (("webp", "WEBP"), ("png", "PNG"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = Lock()
+
+
+def variant_name(digest: str, size: int, extension: str) -> str:
+    return f"avatars/{digest[:2]}/{digest}/{size}.{extension}"
+
+
+def variant_urls(storage: Storage, digest: str) -> Dict[str, Dict[str, str]]:
+    return {str(size): {ext: storage.url(variant_name(digest, size, ext)) for ext, _ in AVATAR_FORMATS} for size in AVATAR_SIZES}
+
+
+def render_variants(storage: Storage, source: bytes, digest: str) -> None:
+    """
+    The render_variants function writes the pre-sized variants of an avatar to the storage.
+    Variants are named after the digest of the source image, so an image that was already
+    processed (e.g. the default avatar shared by every new user) is never rendered twice.
+
+    :param storage: The storage of the avatar field
+    :param source: The bytes of the uploaded image
+    :param digest: The sha256 hex digest of the source
+    :return: None
+    """
+    if all(storage.exists(variant_name(digest, size, ext)) for size in AVATAR_SIZES for ext, _ in AVATAR_FORMATS):
+        return
+
+    with Image.open(BytesIO(source)) as img:
+        img = ImageOps.exif_transpose(img).convert("RGBA")
+        for size in AVATAR_SIZES:
+            variant = img.copy()
+            variant.thumbnail((size, size))
+            for ext, image_format in AVATAR_FORMATS:
+                name = variant_name(digest, size, ext)
+                if storage.exists(name):
+                    continue
+                buffer = BytesIO()
+                variant.save(buffer, format=image_format, optimize=True)
+                storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def process_avatar(profile_id: int, avatar_name: str) -> None:
+    """
+    The process_avatar function builds the variants of a profile's avatar and marks them as ready.
+    The profile is only updated if it still points at the same file, so a job for an avatar that was
+    replaced in the meantime doesn't overwrite the newer one. The update doesn't send signals,
+    so it refreshes the cached identity of the profile's user itself.
+
+    :param profile_id: The primary key of the profile
+    :param avatar_name: The name of the avatar file the job was scheduled for
+    :return: None
+    """
+    from .models import Profile
+
+    storage = Profile._meta.get_field("avatar").storage
+    with storage.open(avatar_name, "rb") as avatar_file:
+        source = avatar_file.read()
+    digest = hashlib.sha256(source).hexdigest()
+
+    render_variants(storage, source, digest)
+    profiles = Profile.objects.filter(pk=profile_id, avatar=avatar_name)
+    if profiles.update(avatar_digest=digest, avatar_source=avatar_name):
+        refresh_identities(Profile.objects.filter(pk=profile_id).values_list("user_id", flat=True))
+
+
+def run_job(profile_id: int, avatar_name: str) -> None:
+    close_old_connections()
+    try:
+        # Worker threads are reused, so the write pin of a job must not outlive it
+        with pin_scope():
+            process_avatar(profile_id, avatar_name)
+    except Exception:
+        logger.exception("Processing avatar %s of profile %s failed", avatar_name, profile_id)
+    finally:
+        connection.close()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.AVATAR_WORKERS, thread_name_prefix="avatars")
+        return _executor
+
+
+def submit(profile_id: int, avatar_name: str) -> Optional[Future]:
+    if settings.AVATAR_WORKERS <= 0:
+        process_avatar(profile_id, avatar_name)
+        return None
+    return get_executor().submit(run_job, profile_id, avatar_name)
+
+
+def schedule_avatar_processing(profile) -> None:
+    """
+    The schedule_avatar_processing function queues the processing of a profile's avatar on the
+    local worker pool once the current transaction commits, so the request that saved the profile
+    never waits for image I/O. With AVATAR_WORKERS = 0 the avatar is processed inline (after commit),
+    which is what the tests use.
+
+    :param profile: The profile whose avatar changed
+    :return: None
+    """
+    profile_id, avatar_name = profile.pk, profile.avatar.name
+    transaction.on_commit(lambda: submit(profile_id, avatar_name))
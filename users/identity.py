@@ -0,0 +1,92 @@
+"""
+Cached resolution of the logged in user, so authenticated requests run no identity queries.
+
+Sessions use the cached_db engine (SESSION_ENGINE): they are read from the cache and written to the cache and
+the database. CachedModelBackend.get_user, called by the auth middleware on the first use of request.user, reads
+the user, with its profile, from the cache: one cache round trip fetches both the user's identity version and the
+cached user, which is only used when it was stored under that version. On a miss the user is loaded from the
+primary and stored under the current version.
+
+Saving or deleting a User or Profile (users.signals) refreshes the identity once the transaction commits: the user
+gets a new version and the fresh user is written through to the cache. Updates that send no signals call
+refresh_identities themselves. Versions are timestamps rather than counters, so an evicted version never comes
+back and matches an old entry.
+"""
+import time
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+VERSION_KEY = "users:identity:version:{}"
+IDENTITY_KEY = "users:identity:{}"
+# Bounds the number of parameters of the IN (...) lookup of a refresh
+REFRESH_CHUNK_SIZE = 500
+
+
+def load_users(user_ids: Iterable[int]) -> Dict[int, User]:
+    # From the primary: a replica may not have the change behind a new version yet
+    users = User._default_manager.db_manager(DEFAULT_DB_ALIAS).select_related("profile")
+    return users.in_bulk(list(user_ids))
+
+
+def get_identity(user_id: int) -> Optional[User]:
+    """
+    The get_identity function returns a user with its profile, from the cache unless it changed since it was stored.
+    Every call returns a copy of its own, so a request may modify it.
+
+    :param user_id: The primary key of the user
+    :return: The user, None if it doesn't exist
+    """
+    version_key, key = VERSION_KEY.format(user_id), IDENTITY_KEY.format(user_id)
+    values = cache.get_many([version_key, key])
+    version = values.get(version_key)
+    if version is None:
+        cache.add(version_key, time.time_ns(), timeout=None)
+        version = cache.get(version_key)
+    cached = values.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    user = load_users([user_id]).get(user_id)
+    if user is not None:
+        cache.set(key, (version, user), settings.IDENTITY_CACHE_TIMEOUT)
+    return user
+
+
+def refresh_identities(user_ids: Iterable[int]) -> None:
+    """
+    The refresh_identities function gives users a new identity version and writes them through to the cache,
+    once the current transaction commits (right away outside of one). Reads of the users that started before
+    keep their old version, so they can't store what they read under the new one.
+
+    :param user_ids: The primary keys of the users that changed
+    :return: None
+    """
+    user_ids = list(set(user_ids))
+    if user_ids:
+        transaction.on_commit(lambda: write_through(user_ids))
+
+
+def write_through(user_ids: List[int]) -> None:
+    for start in range(0, len(user_ids), REFRESH_CHUNK_SIZE):
+        chunk = user_ids[start : start + REFRESH_CHUNK_SIZE]
+        version = time.time_ns()
+        cache.set_many({VERSION_KEY.format(user_id): version for user_id in chunk}, timeout=None)
+        users = load_users(chunk)
+        cache.set_many(
+            {IDENTITY_KEY.format(user_id): (version, user) for user_id, user in users.items()}, settings.IDENTITY_CACHE_TIMEOUT
+        )
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend resolving the user of a session with get_identity instead of a query.
+    """
+
+    def get_user(self, user_id):
+        user = get_identity(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
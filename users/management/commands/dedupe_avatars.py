@@ -0,0 +1,66 @@
+from collections import defaultdict
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from users.identity import refresh_identities
+from users.models import Profile, StoredFile
+from users.storage import CONTENT_ADDRESSED_PREFIX, avatar_storage, is_content_addressed
+
+
+class Command(BaseCommand):
+    help = "Move existing avatars into the content-addressed storage, deduplicating identical files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-originals", action="store_true", help="Don't delete the old files after moving them")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be moved")
+
+    def handle(self, *args, **options):
+        default_avatar = Profile._meta.get_field("avatar").get_default()
+        profiles_by_name = defaultdict(list)
+        for profile_id, name in Profile.objects.values_list("pk", "avatar").iterator():
+            if name and name != default_avatar and not is_content_addressed(name):
+                profiles_by_name[name].append(profile_id)
+
+        if options["dry_run"]:
+            profiles = sum(map(len, profiles_by_name.values()))
+            self.stdout.write(f"Would move {len(profiles_by_name)} files used by {profiles} profiles")
+            return
+
+        # Every distinct legacy file is read and hashed once, however many profiles use it
+        moved = {}
+        for name in profiles_by_name:
+            if not avatar_storage.exists(name):
+                self.stderr.write(f"Skipping missing file {name}")
+                continue
+            with avatar_storage.open(name, "rb") as legacy_file:
+                moved[name] = avatar_storage.save(name, File(legacy_file, name))
+
+        with transaction.atomic():
+            for old_name, new_name in moved.items():
+                # update() doesn't send signals, the reference counts are recomputed below.
+                # Variants are named after the content digest, so processed avatars stay processed.
+                profiles = Profile.objects.filter(pk__in=profiles_by_name[old_name])
+                profiles.filter(avatar_source=old_name).update(avatar=new_name, avatar_source=new_name)
+                profiles.update(avatar=new_name)
+            self.recount()
+            moved_profiles = [profile_id for old_name in moved for profile_id in profiles_by_name[old_name]]
+            refresh_identities(Profile.objects.filter(pk__in=moved_profiles).values_list("user_id", flat=True))
+
+        if not options["keep_originals"]:
+            for old_name in moved:
+                avatar_storage.delete(old_name)
+
+        self.stdout.write(self.style.SUCCESS(f"Moved {len(moved)} files into {len(set(moved.values()))} content-addressed files"))
+
+    @staticmethod
+    def recount():
+        profiles = Profile.objects.filter(avatar__startswith=f"{CONTENT_ADDRESSED_PREFIX}/")
+        counts = profiles.values("avatar").annotate(refcount=Count("pk"))
+        StoredFile.objects.bulk_create(
+            [StoredFile(name=row["avatar"], refcount=row["refcount"]) for row in counts],
+            update_conflicts=True,
+            unique_fields=["name"],
+            update_fields=["refcount"],
+        )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from quotes.routers import pin_scope
+from users.avatars import process_avatar
+from users.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Build the resized avatar variants of every profile whose variants are missing or stale"
+
+    def handle(self, *args, **options):
+        processed = 0
+        stale = Profile.objects.exclude(avatar_source=F("avatar")).exclude(avatar="").values_list("pk", "avatar")
+        for profile_id, avatar_name in stale.iterator():
+            try:
+                # Every avatar is a task of its own, so its write doesn't pin the reads of the next ones
+                with pin_scope():
+                    process_avatar(profile_id, avatar_name)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f"Skipping the avatar of profile {profile_id}: {error}")
+                continue
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(f"Processed the avatars of {processed} profiles"))
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="avatar_digest",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="avatar_source",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+    ]
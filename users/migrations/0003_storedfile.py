@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:20
+
+import users.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0002_profile_avatar_variants"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredFile",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("refcount", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="profile",
+            name="avatar",
+            field=models.ImageField(
+                default="default_avatar.png", storage=users.storage.get_avatar_storage, upload_to="profile_images"
+            ),
+        ),
+    ]
@@ -1,23 +1,43 @@
+from typing import Dict, Optional
+
 from django.contrib.auth.models import User
 from django.db import models
-from PIL import Image
+
+from .avatars import variant_urls
+from .storage import get_avatar_storage
 
 
 # Extending User Model Using a One-To-One Link
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    avatar = models.ImageField(default="default_avatar.png", upload_to="profile_images")
+    avatar = models.ImageField(default="default_avatar.png", upload_to="profile_images", storage=get_avatar_storage)
+    # Set by users.avatars once the pre-sized variants of `avatar_source` exist
+    avatar_digest = models.CharField(max_length=64, blank=True, default="")
+    avatar_source = models.CharField(max_length=255, blank=True, default="")
 
     def __str__(self):
         return self.user.username
 
-    # resizing images
-    def save(self, *args, **kwargs):
-        super().save()
+    @property
+    def avatar_variants(self) -> Optional[Dict[str, Dict[str, str]]]:
+        """
+        The avatar_variants property returns the URLs of the resized avatar, by size and format,
+        e.g. avatar_variants["96"]["webp"]. It is None while the current avatar is still being processed.
+        """
+        if not self.avatar_digest or self.avatar_source != self.avatar.name:
+            return None
+        return variant_urls(self.avatar.storage, self.avatar_digest)
+
 
-        img = Image.open(self.avatar.path)
+class StoredFile(models.Model):
+    """
+    Reference count of a content-addressed file (see users.storage), kept by users.signals.
+    The file is deleted when the last profile stops using it; its variants are kept, see ContentAddressedStorage.
+    """
 
-        if img.height > 250 or img.width > 250:
-            new_img = (250, 250)
-            img.thumbnail(new_img)
-            img.save(self.avatar.path)
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
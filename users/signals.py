@@ -1,8 +1,13 @@
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
-from .models import Profile
+from .avatars import schedule_avatar_processing
+from .identity import refresh_identities
+from .models import Profile, StoredFile
+from .storage import avatar_storage, is_content_addressed
 
 
 @receiver(post_save, sender=User)
@@ -12,5 +17,79 @@ def create_profile(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-    instance.profile.save()
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    refresh_identities([instance.pk])
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def profile_changed(sender, instance, **kwargs):
+    refresh_identities([instance.user_id])
+
+
+def acquire_file(name: str) -> None:
+    """
+    The acquire_file function adds one reference to a content-addressed file. The row is locked, so a concurrent
+    release_file either sees the new reference or has already removed the row, which is then created again.
+
+    :param name: The name of the stored file
+    :return: None
+    """
+    if not is_content_addressed(name):
+        return
+    with transaction.atomic():
+        stored, created = StoredFile.objects.select_for_update().get_or_create(name=name, defaults={"refcount": 1})
+        if not created:
+            StoredFile.objects.filter(pk=stored.pk).update(refcount=F("refcount") + 1)
+
+
+def release_file(name: str) -> None:
+    """
+    The release_file function drops one reference to a content-addressed file.
+    When no profile uses the file anymore its row is removed and, once the transaction commits,
+    the file is deleted from the storage unless it was acquired again meanwhile.
+
+    :param name: The name of the stored file
+    :return: None
+    """
+    if not is_content_addressed(name):
+        return
+    with transaction.atomic():
+        stored = StoredFile.objects.select_for_update().filter(name=name).first()
+        if stored is None:
+            return
+        if stored.refcount > 1:
+            StoredFile.objects.filter(pk=stored.pk).update(refcount=F("refcount") - 1)
+        else:
+            StoredFile.objects.filter(pk=stored.pk).delete()
+            transaction.on_commit(lambda: delete_unreferenced_content(name))
+
+
+def delete_unreferenced_content(name: str) -> None:
+    # An identical upload gets the existing name back from the storage and acquires it again, possibly after
+    # the last reference was released, so the file is only deleted when it still has no row
+    if not StoredFile.objects.filter(name=name).exists():
+        avatar_storage.delete_content(name)
+
+
+@receiver(pre_save, sender=Profile)
+def remember_avatar(sender, instance, **kwargs):
+    previous = Profile.objects.filter(pk=instance.pk).values_list("avatar", flat=True) if instance.pk else []
+    instance._previous_avatar = next(iter(previous), None)
+
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_avatar", None)
+    if instance.avatar.name != previous:
+        acquire_file(instance.avatar.name)
+        if previous:
+            release_file(previous)
+    if instance.avatar and instance.avatar.name != instance.avatar_source:
+        schedule_avatar_processing(instance)
+
+
+@receiver(post_delete, sender=Profile)
+def profile_deleted(sender, instance, **kwargs):
+    release_file(instance.avatar.name)
@@ -0,0 +1,67 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CONTENT_ADDRESSED_PREFIX = "avatars"
+# Files under the prefix never change, so they can be cached forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def content_addressed_name(name: str, digest: str) -> str:
+    extension = os.path.splitext(name)[1].lower()
+    return f"{CONTENT_ADDRESSED_PREFIX}/{digest[:2]}/{digest}/original{extension}"
+
+
+def is_content_addressed(name: str) -> bool:
+    return bool(name) and name.startswith(f"{CONTENT_ADDRESSED_PREFIX}/")
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    A file system storage that names uploads after the sha256 of their content.
+    Uploading a file that is already stored writes nothing and returns the existing name, so identical
+    avatars share one file. Stored files never change, which makes their URLs safe to cache forever.
+    Files are reference counted by users.models.StoredFile; the resized variants made by users.avatars
+    live in the same directory as the original. Variants aren't counted: an avatar that isn't stored here,
+    like the default one, has its variants under the same digest, so they are kept when the original goes.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if is_content_addressed(name):
+            # Already named after its content, e.g. a variant of a stored avatar
+            return super().save(name, content, max_length=max_length)
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        name = content_addressed_name(name, digest.hexdigest())
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+    def delete_content(self, name: str) -> None:
+        """
+        The delete_content function removes a stored original. Its variants stay, profiles with an uncounted
+        avatar of the same content may link to them, and an identical upload will use them again.
+
+        :param name: The name of the original file
+        :return: None
+        """
+        self.delete(name)
+
+
+avatar_storage = ContentAddressedStorage()
+
+
+def get_avatar_storage() -> ContentAddressedStorage:
+    return avatar_storage
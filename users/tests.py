@@ -1,3 +1,193 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from PIL import Image
+
+from .avatars import AVATAR_FORMATS, AVATAR_SIZES, variant_name
+from .models import Profile, StoredFile
+from .storage import avatar_storage
+from .views import serve_immutable
+
+
+def png_upload(name: str, size=(600, 300), color="red") -> SimpleUploadedFile:
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+class AvatarTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, AVATAR_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username="albert", password="relativity")
+        self.client.force_login(self.user)
+
+
+class AvatarProcessingTests(AvatarTestCase):
+    def upload(self, avatar: SimpleUploadedFile):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/users/profile/", {"avatar": avatar})
+        self.user.profile.refresh_from_db()
+        return self.user.profile
+
+    def test_upload_builds_variants_after_the_request(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post("/users/profile/", {"avatar": png_upload("einstein.png")})
+        self.user.profile.refresh_from_db()
+        self.assertIsNone(self.user.profile.avatar_variants)
+        # The avatar job and the refresh of the cached user
+        self.assertEqual(len(callbacks), 2)
+
+        for callback in callbacks:
+            callback()
+        profile = self.user.profile
+        profile.refresh_from_db()
+        storage = profile.avatar.storage
+        for size in AVATAR_SIZES:
+            for ext, _ in AVATAR_FORMATS:
+                with Image.open(storage.open(variant_name(profile.avatar_digest, size, ext))) as img:
+                    self.assertEqual(img.size, (size, size // 2))
+        self.assertTrue(profile.avatar_variants["96"]["webp"].endswith("/96.webp"))
+
+    def test_unchanged_image_is_not_processed_again(self):
+        first = self.upload(png_upload("einstein.png"))
+        first_name, first_digest = first.avatar.name, first.avatar_digest
+        with mock.patch("users.signals.schedule_avatar_processing") as schedule, self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/users/profile/", {"avatar": png_upload("copy.png")})
+        schedule.assert_not_called()
+
+        profile = self.user.profile
+        profile.refresh_from_db()
+        self.assertEqual((profile.avatar.name, profile.avatar_digest), (first_name, first_digest))
+        self.assertIsNotNone(profile.avatar_variants)
+
+    def test_variants_are_only_rendered_once(self):
+        self.upload(png_upload("einstein.png"))
+        other = User.objects.create_user(username="marie", password="radioactivity")
+        with mock.patch("users.avatars.Image.open") as image_open:
+            with self.captureOnCommitCallbacks(execute=True):
+                other.profile.avatar = self.user.profile.avatar.name
+                other.profile.save()
+        image_open.assert_not_called()
+        other.profile.refresh_from_db()
+        self.assertEqual(other.profile.avatar_variants, self.user.profile.avatar_variants)
+
+    def test_user_saves_do_not_touch_the_avatar(self):
+        with mock.patch("users.signals.schedule_avatar_processing") as schedule:
+            self.user.last_name = "Einstein"
+            self.user.save()
+            self.client.logout()
+            self.client.login(username="albert", password="relativity")
+        schedule.assert_not_called()
+
+
+class ContentAddressedStorageTests(AvatarTestCase):
+    def set_avatar(self, user, avatar):
+        with self.captureOnCommitCallbacks(execute=True):
+            user.profile.avatar = avatar
+            user.profile.save()
+        return user.profile.avatar.name
+
+    def test_identical_uploads_share_one_counted_file(self):
+        other = User.objects.create_user(username="marie", password="radioactivity")
+        name = self.set_avatar(self.user, png_upload("einstein.png"))
+        self.assertEqual(self.set_avatar(other, png_upload("copy.PNG")), name)
+        self.assertTrue(name.endswith("/original.png"))
+        self.assertEqual(StoredFile.objects.get(name=name).refcount, 2)
+
+        self.set_avatar(self.user, png_upload("blue.png", color="blue"))
+        self.assertEqual(StoredFile.objects.get(name=name).refcount, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+        self.assertFalse(avatar_storage.exists(name))
+
+    def test_file_acquired_again_before_the_release_commits_is_kept(self):
+        name = self.set_avatar(self.user, png_upload("einstein.png"))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.profile.avatar = png_upload("blue.png", color="blue")
+            self.user.profile.save()
+        # An identical upload by another user acquires the file again before the deletion runs
+        other = User.objects.create_user(username="marie", password="radioactivity")
+        self.assertEqual(self.set_avatar(other, png_upload("copy.png")), name)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(StoredFile.objects.get(name=name).refcount, 1)
+        self.assertTrue(avatar_storage.exists(name))
+
+    def test_released_upload_keeps_the_variants_of_an_identical_default_avatar(self):
+        with open(settings.BASE_DIR / "media" / "default_avatar.png", "rb") as fp:
+            default = fp.read()
+        shutil.copy(settings.BASE_DIR / "media" / "default_avatar.png", settings.MEDIA_ROOT)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.profile.save()
+        self.user.profile.refresh_from_db()
+        variant = variant_name(self.user.profile.avatar_digest, 96, "webp")
+        self.assertTrue(avatar_storage.exists(variant))
+
+        other = User.objects.create_user(username="marie", password="radioactivity")
+        name = self.set_avatar(other, SimpleUploadedFile("copy.png", default))
+        self.set_avatar(other, png_upload("blue.png", color="blue"))
+        self.assertFalse(avatar_storage.exists(name))
+        self.assertTrue(avatar_storage.exists(variant))
+
+    def test_content_addressed_files_are_immutable(self):
+        name = self.set_avatar(self.user, png_upload("einstein.png"))
+        self.assertTrue(name.startswith("avatars/"))
+        response = serve_immutable(RequestFactory().get(f"/media/{name}"), name, document_root=settings.MEDIA_ROOT)
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+
+    def test_dedupe_command_moves_legacy_files(self):
+        content = png_upload("legacy.png").read()
+        legacy = [avatar_storage._save(f"profile_images/legacy_{i}.png", ContentFile(content)) for i in range(2)]
+        other = User.objects.create_user(username="marie", password="radioactivity")
+        Profile.objects.filter(user=self.user).update(avatar=legacy[0])
+        Profile.objects.filter(user=other).update(avatar=legacy[1])
+
+        call_command("dedupe_avatars", stdout=StringIO())
+
+        names = set(Profile.objects.values_list("avatar", flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertEqual(StoredFile.objects.get(name=names.pop()).refcount, 2)
+        self.assertFalse(any(avatar_storage.exists(name) for name in legacy))
+
+
+class IdentityCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="albert", password="relativity")
+        self.client.force_login(self.user)
+        # The session and the user are cached by the first request
+        self.client.get("/users/profile/")
+
+    def test_authenticated_requests_run_no_identity_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get("/users/profile/")
+        self.assertContains(response, "Profile page: albert")
+
+    def test_changes_are_written_through(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = "einstein"
+            self.user.save()
+        with self.assertNumQueries(0):
+            response = self.client.get("/users/profile/")
+        self.assertContains(response, "Profile page: einstein")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get("/users/profile/").status_code, 302)
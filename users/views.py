@@ -6,8 +6,10 @@ from django.contrib.messages.views import SuccessMessageMixin
 from django.shortcuts import redirect, render
 from django.urls import reverse_lazy
 from django.contrib.auth.views import PasswordResetConfirmView
+from django.views.static import serve
 
 from .forms import LoginForm, ProfileForm, RegisterForm, CustomPasswordResetForm, CastomSetPasswordForm
+from .storage import IMMUTABLE_CACHE_CONTROL
 
 
 def signupuser(request):
@@ -60,6 +62,17 @@ def profile(request):
     return render(request, "users/profile.html", {"profile_form": profile_form})
 
 
+def serve_immutable(request, path, document_root):
+    """
+    Serves content-addressed media files (development only, like django.conf.urls.static).
+    Their names change whenever their content does, so browsers may cache them forever.
+    In production the web server should send the same Cache-Control header for MEDIA_URL/avatars/.
+    """
+    response = serve(request, path, document_root=document_root)
+    response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
 class ResetPasswordView(SuccessMessageMixin, PasswordResetView):
     template_name = "users/password_reset.html"
     form_class = CustomPasswordResetForm